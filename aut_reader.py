@@ -0,0 +1,102 @@
+from __future__ import annotations
+from array import array
+from dataclasses import dataclass
+import re
+
+from csr import INDEX_TYPE
+
+# Bytes read from the file at a time
+CHUNK_SIZE = 1 << 20
+
+HEADER_RE = re.compile(rb'\s*des\s*\(\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*\)\s*')
+EDGE_RE = re.compile(rb'\(\s*(\d+)\s*,\s*"([^"]*)"\s*,\s*(\d+)\s*\)')
+# An edge that is a whole line, for findall over a chunk
+EDGE_LINE_RE = re.compile(rb'^[ \t]*' + EDGE_RE.pattern + rb'[ \t\r]*$', re.MULTILINE)
+
+
+class AutFormatError(ValueError):
+    def __init__(self, filename: str, line_number: int | None, message: str):
+        self.filename = filename
+        self.line_number = line_number
+        if line_number is None:
+            super().__init__(f"{filename}: {message}")
+        else:
+            super().__init__(f"{filename}:{line_number}: {message}")
+
+
+@dataclass
+class AutHeader:
+    initial_state: int
+    num_edges: int
+    num_nodes: int
+
+
+def read_aut(filename: str) -> tuple[AutHeader, dict[str, tuple[array, array]]]:
+    """
+    Reads an .aut file in chunks. Returns the header and, for every label,
+    the arrays (sources, destinations) of its edges.
+    Every chunk is tokenized with a single findall over whole lines, the
+    lines are only looked at one by one when some line did not match.
+    """
+    with open(filename, 'rb') as aut_file:
+        header_line = aut_file.readline()
+        header = HEADER_RE.fullmatch(header_line)
+        if header is None:
+            raise AutFormatError(filename, 1, "expected header 'des (start,edges,nodes)'")
+        header = AutHeader(*(int(g) for g in header.groups()))
+        if header.num_nodes > 0 and header.initial_state >= header.num_nodes:
+            raise AutFormatError(filename, 1, f"initial state {header.initial_state} is "
+                                 f"outside of 0..{header.num_nodes - 1}")
+        # Raw bytes of the numbers per label, converted in bulk at the end
+        raw_edges = dict()
+        num_edges = 0
+        line_number = 1
+        leftover = b''
+        while True:
+            chunk = aut_file.read(CHUNK_SIZE)
+            if chunk:
+                block = leftover + chunk
+                cut = block.rfind(b'\n') + 1
+                if cut == 0:
+                    leftover = block
+                    continue
+                block, leftover = block[:cut], block[cut:]
+            else:
+                block, leftover = leftover, b''
+                if not block:
+                    break
+            matches = EDGE_LINE_RE.findall(block)
+            # Normally every line is an edge. Only if that does not hold (an
+            # empty or malformed line) do we check line by line.
+            if len(matches) != block.count(b'\n') + (not block.endswith(b'\n')):
+                check_lines(filename, block, line_number)
+            num_edges += len(matches)
+            for src, label, dest in matches:
+                edges = raw_edges.get(label)
+                if edges is None:
+                    edges = raw_edges[label] = ([], [])
+                edges[0].append(src)
+                edges[1].append(dest)
+            line_number += block.count(b'\n')
+    if num_edges != header.num_edges:
+        raise AutFormatError(filename, 1, f"the header announces {header.num_edges} edges, "
+                             f"the file has {num_edges}")
+    edges = dict()
+    for label, (sources, destinations) in raw_edges.items():
+        sources = array(INDEX_TYPE, map(int, sources))
+        destinations = array(INDEX_TYPE, map(int, destinations))
+        if max(max(sources), max(destinations)) >= header.num_nodes:
+            raise AutFormatError(filename, None, f"label {label.decode()} has an edge "
+                                 f"to a state outside of 0..{header.num_nodes - 1}")
+        edges[label.decode()] = (sources, destinations)
+    return header, edges
+
+
+def check_lines(filename: str, block: bytes, line_number: int):
+    "block starts after line line_number, raises for the first malformed line in it"
+    for i, line in enumerate(block.split(b'\n')):
+        stripped = line.strip()
+        if stripped and EDGE_RE.fullmatch(stripped) is None:
+            text = stripped.decode(errors='replace')
+            raise AutFormatError(filename, line_number + i + 1,
+                                 f"expected an edge (src,\"label\",dest), got {text}")
@@ -0,0 +1,367 @@
+from __future__ import annotations
+from typing import Iterable, Sequence
+
+
+## A small reduced ordered BDD package and a state set backend on top of it.
+##
+## Nodes live in the parallel lists level/low/high of a Manager, node 0 is
+## false and node 1 is true. Variables are identified with their level, the
+## ordering is chosen when states are encoded (see ORDERINGS).
+## Users hold nodes through Function objects, which keep a reference count on
+## the node. Unreferenced nodes are collected (mark and sweep from the
+## referenced ones) before an operation once the node table grew past a
+## threshold, their ids are then reused.
+
+FALSE = 0
+TRUE = 1
+
+# Minimum number of nodes before a collection is attempted
+GC_THRESHOLD = 1 << 16
+
+
+class Manager:
+    def __init__(self, num_levels: int):
+        self.num_levels = num_levels
+        # Terminals sit below every variable
+        self.level = [num_levels, num_levels]
+        self.low = [FALSE, TRUE]
+        self.high = [FALSE, TRUE]
+        self.refs = [1, 1]
+        self.unique = dict()
+        self.free = []
+        self.and_cache = dict()
+        self.or_cache = dict()
+        self.not_cache = dict()
+        self.gc_threshold = GC_THRESHOLD
+        self.collections = 0
+
+    def __len__(self) -> int:
+        "Number of nodes in use, including the terminals"
+        return len(self.level) - len(self.free)
+
+    def mk(self, level: int, low: int, high: int) -> int:
+        if low == high:
+            return low
+        key = (level, low, high)
+        node = self.unique.get(key)
+        if node is not None:
+            return node
+        if len(self.free) > 0:
+            node = self.free.pop()
+            self.level[node] = level
+            self.low[node] = low
+            self.high[node] = high
+        else:
+            node = len(self.level)
+            self.level.append(level)
+            self.low.append(low)
+            self.high.append(high)
+            self.refs.append(0)
+        self.unique[key] = node
+        return node
+
+    def var(self, level: int) -> int:
+        return self.mk(level, FALSE, TRUE)
+
+    def cofactors(self, node: int, level: int) -> (int, int):
+        if self.level[node] == level:
+            return self.low[node], self.high[node]
+        return node, node
+
+    def conjoin(self, u: int, v: int) -> int:
+        if u == FALSE or v == FALSE:
+            return FALSE
+        if u == TRUE or u == v:
+            return v
+        if v == TRUE:
+            return u
+        if u > v:
+            u, v = v, u
+        key = (u, v)
+        res = self.and_cache.get(key)
+        if res is None:
+            level = min(self.level[u], self.level[v])
+            u0, u1 = self.cofactors(u, level)
+            v0, v1 = self.cofactors(v, level)
+            res = self.mk(level, self.conjoin(u0, v0), self.conjoin(u1, v1))
+            self.and_cache[key] = res
+        return res
+
+    def disjoin(self, u: int, v: int) -> int:
+        if u == TRUE or v == TRUE:
+            return TRUE
+        if u == FALSE or u == v:
+            return v
+        if v == FALSE:
+            return u
+        if u > v:
+            u, v = v, u
+        key = (u, v)
+        res = self.or_cache.get(key)
+        if res is None:
+            level = min(self.level[u], self.level[v])
+            u0, u1 = self.cofactors(u, level)
+            v0, v1 = self.cofactors(v, level)
+            res = self.mk(level, self.disjoin(u0, v0), self.disjoin(u1, v1))
+            self.or_cache[key] = res
+        return res
+
+    def negate(self, u: int) -> int:
+        if u <= TRUE:
+            return 1 - u
+        res = self.not_cache.get(u)
+        if res is None:
+            res = self.mk(self.level[u], self.negate(self.low[u]), self.negate(self.high[u]))
+            self.not_cache[u] = res
+        return res
+
+    def and_exists(self, u: int, v: int, quantified: Sequence[bool], cache: dict) -> int:
+        "Exists quantified levels. (u and v), without building u and v first"
+        if u == FALSE or v == FALSE:
+            return FALSE
+        if u == TRUE and v == TRUE:
+            return TRUE
+        key = (u, v)
+        res = cache.get(key)
+        if res is not None:
+            return res
+        level = min(self.level[u], self.level[v])
+        u0, u1 = self.cofactors(u, level)
+        v0, v1 = self.cofactors(v, level)
+        low = self.and_exists(u0, v0, quantified, cache)
+        if quantified[level]:
+            if low == TRUE:
+                res = TRUE
+            else:
+                res = self.disjoin(low, self.and_exists(u1, v1, quantified, cache))
+        else:
+            res = self.mk(level, low, self.and_exists(u1, v1, quantified, cache))
+        cache[key] = res
+        return res
+
+    def rename(self, u: int, mapping: Sequence[int], cache: dict) -> int:
+        "Moves every level l to mapping[l], mapping must keep the order of the levels of u"
+        if u <= TRUE:
+            return u
+        res = cache.get(u)
+        if res is None:
+            res = self.mk(mapping[self.level[u]], self.rename(self.low[u], mapping, cache),
+                          self.rename(self.high[u], mapping, cache))
+            cache[u] = res
+        return res
+
+    def maybe_collect(self):
+        "Runs a collection when the table is large, only call between operations"
+        if len(self) < self.gc_threshold:
+            return
+        self.collect()
+        # Do not collect over and over when most nodes are alive
+        if len(self) > self.gc_threshold // 2:
+            self.gc_threshold *= 2
+
+    def collect(self):
+        "Frees every node that is not reachable from a referenced node"
+        marked = bytearray(len(self.level))
+        marked[FALSE] = marked[TRUE] = 1
+        stack = [node for node, count in enumerate(self.refs) if count > 0]
+        while len(stack) > 0:
+            node = stack.pop()
+            if marked[node]:
+                continue
+            marked[node] = 1
+            stack.append(self.low[node])
+            stack.append(self.high[node])
+        free = set(self.free)
+        for node in range(2, len(self.level)):
+            if not marked[node] and node not in free:
+                del self.unique[(self.level[node], self.low[node], self.high[node])]
+                self.free.append(node)
+        # Cached results may point to freed nodes
+        self.and_cache.clear()
+        self.or_cache.clear()
+        self.not_cache.clear()
+        self.collections += 1
+
+
+class Function:
+    "A reference to a node, the node stays alive as long as this object does"
+    __slots__ = ('manager', 'node')
+
+    def __init__(self, manager: Manager, node: int):
+        self.manager = manager
+        self.node = node
+        manager.refs[node] += 1
+
+    def __del__(self):
+        self.manager.refs[self.node] -= 1
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Function) and self.node == other.node
+
+    def __hash__(self) -> int:
+        return self.node
+
+
+## Orderings of the variables. A state is encoded in bits bits, every bit has
+## a variable for the current state and one for the next state (used by the
+## transition relations). Each ordering maps bit k (0 is the least
+## significant) to the levels of its current and next variable.
+
+def interleaved(bits: int) -> (list[int], list[int]):
+    "Most significant bit first, current and next variable of a bit side by side"
+    current = [2 * (bits - 1 - k) for k in range(bits)]
+    return current, [level + 1 for level in current]
+
+
+def reversed_interleaved(bits: int) -> (list[int], list[int]):
+    "Least significant bit first, current and next variable side by side"
+    current = [2 * k for k in range(bits)]
+    return current, [level + 1 for level in current]
+
+
+def sequential(bits: int) -> (list[int], list[int]):
+    "All current variables (most significant first) above all next variables"
+    current = [bits - 1 - k for k in range(bits)]
+    return current, [level + bits for level in current]
+
+
+ORDERINGS = {
+    "interleaved": interleaved,
+    "reversed": reversed_interleaved,
+    "sequential": sequential,
+}
+
+DEFAULT_ORDERING = "interleaved"
+
+
+class BddBackend:
+    "A set of states is the BDD of the characteristic function of their codes"
+    name = "bdd"
+
+    def __init__(self, num_nodes: int, ordering: str = DEFAULT_ORDERING):
+        if ordering not in ORDERINGS:
+            raise ValueError(f"Unknown BDD variable ordering {ordering}, "
+                             f"expected one of {', '.join(ORDERINGS)}")
+        self.num_nodes = num_nodes
+        self.bits = max((num_nodes - 1).bit_length(), 1)
+        self.current, self.next = ORDERINGS[ordering](self.bits)
+        self.manager = Manager(2 * self.bits)
+        # Bits in the order of the levels of their current variables
+        self.bit_order = sorted(range(self.bits), key=lambda k: self.current[k])
+        self._empty = Function(self.manager, FALSE)
+        self._full = self.from_iterable(range(num_nodes))
+
+    def wrap(self, node: int) -> Function:
+        return Function(self.manager, node)
+
+    def empty(self) -> Function:
+        return self._empty
+
+    def full(self) -> Function:
+        return self._full
+
+    def union(self, a: Function, b: Function) -> Function:
+        self.manager.maybe_collect()
+        return self.wrap(self.manager.disjoin(a.node, b.node))
+
+    def intersection(self, a: Function, b: Function) -> Function:
+        self.manager.maybe_collect()
+        return self.wrap(self.manager.conjoin(a.node, b.node))
+
+    def complement(self, a: Function) -> Function:
+        "The states (not codes) that are not in a"
+        self.manager.maybe_collect()
+        return self.wrap(self.manager.conjoin(self._full.node, self.manager.negate(a.node)))
+
+    def equals(self, a: Function, b: Function) -> bool:
+        return a.node == b.node
+
+    def is_subset(self, a: Function, b: Function) -> bool:
+        return self.manager.conjoin(a.node, b.node) == a.node
+
+    def is_empty(self, a: Function) -> bool:
+        return a.node == FALSE
+
+    def contains(self, a: Function, i: int) -> bool:
+        m = self.manager
+        node = a.node
+        for k in self.bit_order:
+            if node <= TRUE:
+                break
+            if m.level[node] == self.current[k]:
+                node = m.high[node] if (i >> k) & 1 else m.low[node]
+        return node == TRUE
+
+    def count(self, a: Function) -> int:
+        m = self.manager
+        position = {level: p for p, level in enumerate(sorted(self.current))}
+        memo = dict()
+
+        def models(node: int, p: int) -> int:
+            "Number of assignments to the current variables from position p on"
+            if node == FALSE:
+                return 0
+            if node == TRUE:
+                return 1 << (self.bits - p)
+            q = position[m.level[node]]
+            if node not in memo:
+                memo[node] = models(m.low[node], q + 1) + models(m.high[node], q + 1)
+            return memo[node] << (q - p)
+        return models(a.node, 0)
+
+    def encode(self, items: Sequence, levels: list[tuple[int, int, int]]) -> int:
+        """
+        The node of the set of items, levels lists (level, field, bit) in level
+        order, where the variable at level is bit bit of item[field].
+        """
+        m = self.manager
+
+        def build(items: Sequence, p: int) -> int:
+            if len(items) == 0:
+                return FALSE
+            if p == len(levels):
+                return TRUE
+            level, field, bit = levels[p]
+            low = [item for item in items if not (item[field] >> bit) & 1]
+            high = [item for item in items if (item[field] >> bit) & 1]
+            return m.mk(level, build(low, p + 1), build(high, p + 1))
+        return build(items, 0)
+
+    def from_iterable(self, states: Iterable[int]) -> Function:
+        levels = [(self.current[k], 0, k) for k in self.bit_order]
+        return self.wrap(self.encode([(s,) for s in set(states)], levels))
+
+    def relation(self, sources: Sequence[int], destinations: Sequence[int]) -> Function:
+        "The BDD over current and next variables of the pairs (source, destination)"
+        levels = sorted([(self.current[k], 0, k) for k in range(self.bits)] +
+                        [(self.next[k], 1, k) for k in range(self.bits)])
+        return self.wrap(self.encode(list(set(zip(sources, destinations))), levels))
+
+    def to_set(self, a: Function) -> set[int]:
+        m = self.manager
+        res = set()
+
+        def expand(node: int, p: int, code: int):
+            if node == FALSE:
+                return
+            if p == self.bits:
+                res.add(code)
+                return
+            k = self.bit_order[p]
+            if m.level[node] == self.current[k]:
+                expand(m.low[node], p + 1, code)
+                expand(m.high[node], p + 1, code | (1 << k))
+            else:
+                expand(node, p + 1, code)
+                expand(node, p + 1, code | (1 << k))
+        expand(a.node, 0, 0)
+        return res
+
+    def membership(self, a: Function) -> bytes:
+        m = bytearray(self.num_nodes)
+        for i in self.to_set(a):
+            m[i] = 1
+        return m
+
+    def from_membership(self, m: bytes) -> Function:
+        return self.from_iterable(i for i, b in enumerate(m) if b)
@@ -0,0 +1,58 @@
+"""
+Compares the chunked .aut reader behind Graph.from_file with the previous
+loader, which ran the parse library on every line, on all .aut files under
+Experiments/. Run with: python -m bench_loader [-r repeats]
+"""
+from __future__ import annotations
+import argparse
+import glob
+import os
+import time
+from collections import defaultdict
+
+import parse
+
+from graph import Graph
+
+
+def legacy_from_file(filename: str) -> dict[tuple[int, str], list[int]]:
+    "The loader as it was before aut_reader, kept only for comparison"
+    with open(filename, 'r') as graph_file:
+        lines = graph_file.read().strip().split('\n')
+    header_format_str = "des ({start:d},{edges:d},{nodes:d})"
+    parse.parse(header_format_str, lines[0].strip())
+    adjacency_dict = defaultdict(list)
+    edge_format = parse.compile("({src:d},\"{label}\",{dest:d})")
+    for i in range(1, len(lines)):
+        res = edge_format.parse(lines[i].strip())
+        adjacency_dict[(res['src'], res['label'])].append(res['dest'])
+    return adjacency_dict
+
+
+def best_time(load, filename: str, repeats: int) -> float:
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        load(filename)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="Loader benchmark")
+    parser.add_argument('-r', '--repeats', type=int, default=3)
+    parser.add_argument('-d', '--dirpath', default="Experiments")
+    args = parser.parse_args()
+    files = sorted(glob.glob(os.path.join(args.dirpath, "**", "*.aut"), recursive=True),
+                   key=os.path.getsize)
+    print(f"{'file':<45}{'size':>10}{'parse':>12}{'new':>12}{'speedup':>10}")
+    for filename in files:
+        old = best_time(legacy_from_file, filename, args.repeats)
+        new = best_time(Graph.from_file, filename, args.repeats)
+        size = os.path.getsize(filename)
+        print(f"{filename:<45}{size:>10}{old*1000:>10.1f}ms{new*1000:>10.1f}ms{old/new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Times every checker on every .aut x .mcf pair of the experiments under
+Experiments/, with warm-up runs and repeats. Graph loading and solving are
+timed separately. Results can be saved as a JSON baseline, and a later run can
+be compared against it, failing (exit status 1) when a median got slower than
+the threshold allows.
+
+    python -m benchmark -o baseline.json
+    python -m benchmark --baseline baseline.json -t 0.2
+"""
+from __future__ import annotations
+import argparse
+import functools
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+
+import query
+import checker_utils as cu
+from graph import Graph
+from naive import NaiveChecker
+from emerson import EmersonChecker
+from worklist import WorklistChecker
+from compiler import CompiledChecker
+from parity import ParityChecker
+from scc import SccChecker
+from patterns import PatternChecker
+
+EXPERIMENTS = ["ccp", "demanding", "dining"]
+
+CHECKERS = {
+    "naive": NaiveChecker,
+    "emerson": EmersonChecker,
+    "worklist": WorklistChecker,
+    "compiled": CompiledChecker,
+    "parity": ParityChecker,
+    "scc": SccChecker,
+    "patterns": PatternChecker,
+    "symbolic": functools.partial(EmersonChecker, backend="bdd", modal_engine="symbolic"),
+}
+
+# Run when no checkers are given, the symbolic one is much slower on the
+# larger experiments
+DEFAULT_CHECKERS = ["naive", "emerson", "worklist", "compiled", "parity", "scc", "patterns"]
+
+# Medians below this are too noisy to call a regression
+NOISE_FLOOR_NS = 1_000_000
+
+
+def percentile(values: list[int], q: float) -> int:
+    "Nearest rank percentile, q in [0, 100]"
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def summarise(times: list[int]) -> dict:
+    return {
+        "median_ns": int(statistics.median(times)),
+        "p95_ns": percentile(times, 95),
+        "min_ns": min(times),
+        "repeats": len(times),
+    }
+
+
+def measure(run, warmup: int, repeats: int) -> list[int]:
+    "Calls run warmup times without and repeats times with timing"
+    for _ in range(warmup):
+        run()
+    times = []
+    for _ in range(repeats):
+        start = cu.get_time()
+        run()
+        times.append(cu.get_time() - start)
+    return times
+
+
+def get_experiment_files(path: str) -> (list[str], list[str]):
+    "Returns the .aut and .mcf files in path, smallest graphs first"
+    files = os.listdir(path)
+    graphs = sorted((f for f in files if f.endswith(".aut")),
+                    key=lambda f: os.path.getsize(os.path.join(path, f)))
+    queries = sorted(f for f in files if f.endswith(".mcf"))
+    return graphs, queries
+
+
+def run_suite(dirpath: str, experiments: list[str], checkers: list[str],
+              warmup: int = 1, repeats: int = 5, use_cache: bool = True,
+              max_nodes: int | None = None, graph_filter: str | None = None,
+              log=print) -> dict[str, dict]:
+    """
+    Returns a summary per benchmark. Keys are experiment/graph/load for
+    loading a graph and experiment/graph/query/checker for solving a query.
+    """
+    results = dict()
+    for experiment in experiments:
+        path = os.path.join(dirpath, experiment)
+        graphs, query_files = get_experiment_files(path)
+        queries = [query.parse_query(os.path.join(path, q)) for q in query_files]
+        for graph_file in graphs:
+            if graph_filter is not None and graph_filter not in graph_file:
+                continue
+            filename = os.path.join(path, graph_file)
+            graph = Graph.load(filename, use_cache)
+            if max_nodes is not None and graph.num_nodes > max_nodes:
+                continue
+            times = measure(lambda: Graph.load(filename, use_cache), warmup, repeats)
+            key = f"{experiment}/{graph_file}/load"
+            results[key] = summarise(times)
+            log(format_row(key, results[key]))
+            for query_file, (formula, variables, _) in zip(query_files, queries):
+                for name in checkers:
+                    # A fresh checker for every run, nothing carries over
+                    checker_class = CHECKERS[name]
+                    times = measure(lambda: checker_class(graph).solve_formula(variables, formula),
+                                    warmup, repeats)
+                    key = f"{experiment}/{graph_file}/{query_file}/{name}"
+                    results[key] = summarise(times)
+                    log(format_row(key, results[key]))
+    return results
+
+
+def format_row(key: str, summary: dict) -> str:
+    return (f"{key:<80}{summary['median_ns'] / 1e6:>12.2f}ms"
+            f"{summary['p95_ns'] / 1e6:>12.2f}ms")
+
+
+def compare(baseline: dict[str, dict], current: dict[str, dict], threshold: float,
+            noise_floor_ns: int = NOISE_FLOOR_NS) -> list[tuple[str, int, int]]:
+    """
+    Returns (key, baseline median, current median) for every benchmark whose
+    median grew by more than threshold (0.1 is 10%). Benchmarks missing on
+    either side and those faster than noise_floor_ns in both runs are skipped.
+    """
+    regressions = []
+    for key, summary in current.items():
+        if key not in baseline:
+            continue
+        old = baseline[key]["median_ns"]
+        new = summary["median_ns"]
+        if max(old, new) < noise_floor_ns:
+            continue
+        if new > old * (1 + threshold):
+            regressions.append((key, old, new))
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="Checker benchmark")
+    parser.add_argument('-d', '--dirpath', default="Experiments")
+    parser.add_argument('-x', '--experiments', nargs='+', default=EXPERIMENTS)
+    parser.add_argument('-c', '--checkers', nargs='+', choices=list(CHECKERS),
+                        default=DEFAULT_CHECKERS)
+    parser.add_argument('-g', '--graph', help="Only graphs whose name contains this")
+    parser.add_argument('--max-nodes', type=int, help="Skip graphs with more states")
+    parser.add_argument('-w', '--warmup', type=int, default=1)
+    parser.add_argument('-r', '--repeats', type=int, default=5)
+    parser.add_argument('--no-cache', action="store_true",
+                        help="Time parsing the .aut instead of mapping the .gcache")
+    parser.add_argument('-o', '--output', help="Write the results to this JSON file")
+    parser.add_argument('--baseline', help="JSON file of an earlier run to compare with")
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                        help="Allowed slowdown of a median, 0.1 is 10%%")
+    parser.add_argument('--noise-floor', type=int, default=NOISE_FLOOR_NS,
+                        help="Medians below this many ns are never a regression")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    print(f"{'benchmark':<80}{'median':>14}{'p95':>14}")
+    results = run_suite(args.dirpath, args.experiments, args.checkers, args.warmup,
+                        args.repeats, not args.no_cache, args.max_nodes, args.graph)
+    if args.output is not None:
+        with open(args.output, 'w') as out:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "warmup": args.warmup,
+                "results": results,
+            }, out, indent=2)
+            out.write("\n")
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)["results"]
+    regressions = compare(baseline, results, args.threshold, args.noise_floor)
+    for key, old, new in regressions:
+        print(f"REGRESSION {key}: {old / 1e6:.2f}ms -> {new / 1e6:.2f}ms ({new / old:.2f}x)")
+    if len(regressions) > 0:
+        return 1
+    print(f"No regressions above {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+from __future__ import annotations
+from array import array
+from typing import Iterable
+
+from graph import Graph, INDEX_TYPE
+import query
+import checker_utils as cu
+
+
+## Strong bisimulation minimisation with the partition refinement of Paige and
+## Tarjan, O(E log V).
+##
+## Next to the partition into blocks there is a coarser partition into
+## compound blocks, and the blocks are stable with respect to every compound.
+## As long as a compound consists of several blocks, the smaller of two of
+## them (B) is split off into a compound of its own, and all blocks are split
+## by the states with an edge into B and by those whose edges into the old
+## compound all go into B. Only the predecessors of B are touched, and a state
+## ends up in the smaller half at most log V times.
+## Telling "only into B" from "also into the rest" works with a counter per
+## state, label and compound, shared by all edges of that state and label
+## into the compound.
+
+
+class Partition:
+    "Blocks of states, every block is a range of elements"
+    def __init__(self, num_nodes: int):
+        self.elements = array(INDEX_TYPE, range(num_nodes))
+        self.position = array(INDEX_TYPE, range(num_nodes))
+        self.block_of = array(INDEX_TYPE, [0]) * num_nodes
+        self.start = [0]
+        self.end = [num_nodes]
+        # Per block, the number of marked states, which are kept at its front
+        self.marked = [0]
+        self.touched = []
+
+    def size(self, block: int) -> int:
+        return self.end[block] - self.start[block]
+
+    def states(self, block: int) -> array:
+        return self.elements[self.start[block]:self.end[block]]
+
+    def mark(self, s: int):
+        b = self.block_of[s]
+        p = self.position[s]
+        front = self.start[b] + self.marked[b]
+        if p < front:
+            return
+        other = self.elements[front]
+        self.elements[front] = s
+        self.position[s] = front
+        self.elements[p] = other
+        self.position[other] = p
+        if self.marked[b] == 0:
+            self.touched.append(b)
+        self.marked[b] += 1
+
+    def split(self) -> list[tuple[int, int]]:
+        """
+        Splits every block with marked states into its marked part, which gets
+        a new block number, and the rest. Returns (old block, new block) pairs.
+        """
+        splits = []
+        for b in self.touched:
+            m = self.marked[b]
+            self.marked[b] = 0
+            if m == self.size(b):
+                continue
+            new = len(self.start)
+            self.start.append(self.start[b])
+            self.end.append(self.start[b] + m)
+            self.marked.append(0)
+            self.start[b] += m
+            for i in range(self.start[new], self.end[new]):
+                self.block_of[self.elements[i]] = new
+            splits.append((b, new))
+        self.touched = []
+        return splits
+
+
+def bisimulation(graph: Graph, labels: Iterable[str] | None = None) -> (array, int):
+    """
+    Returns the block of every state under the coarsest strong bisimulation
+    that only looks at labels (all labels by default), and the number of
+    blocks. Blocks are numbered in the order of their smallest state.
+    """
+    n = graph.num_nodes
+    if labels is None:
+        label_ids = list(range(len(graph.labels)))
+    else:
+        label_ids = [l for l in map(graph.get_label_id, labels) if l is not None]
+    partition = Partition(n)
+    # Counters and, per label, the counter of every edge in predecessor order
+    counts = array('q')
+    refs = dict()
+    for l in label_ids:
+        offsets = graph.succ_offsets[l]
+        record = array(INDEX_TYPE, [-1]) * n
+        for x in range(n):
+            degree = offsets[x + 1] - offsets[x]
+            if degree > 0:
+                record[x] = len(counts)
+                counts.append(degree)
+                partition.mark(x)
+        partition.split()
+        refs[l] = array(INDEX_TYPE, (record[x] for x in graph.pred_targets[l]))
+
+    # Every compound is a set of blocks, at first there is one with all of them
+    compounds = [set(range(len(partition.start)))]
+    compound_of = [0] * len(partition.start)
+    worklist = [0] if len(compounds[0]) > 1 else []
+
+    def add_blocks(splits: list[tuple[int, int]]):
+        for old, new in splits:
+            c = compound_of[old]
+            compound_of.append(c)
+            compounds[c].add(new)
+            if len(compounds[c]) == 2:
+                worklist.append(c)
+
+    while len(worklist) > 0:
+        compound = compounds[worklist[-1]]
+        blocks = iter(compound)
+        first, second = next(blocks), next(blocks)
+        splitter = first if partition.size(first) <= partition.size(second) else second
+        compound.remove(splitter)
+        if len(compound) < 2:
+            worklist.pop()
+        compound_of[splitter] = len(compounds)
+        compounds.append({splitter})
+        splitter_states = partition.states(splitter)
+        for l in label_ids:
+            offsets, sources, ref = graph.pred_offsets[l], graph.pred_targets[l], refs[l]
+            # Edges into the splitter per predecessor, and its old counter
+            into_splitter = dict()
+            old_record = dict()
+            for y in splitter_states:
+                for j in range(offsets[y], offsets[y + 1]):
+                    x = sources[j]
+                    if x in into_splitter:
+                        into_splitter[x] += 1
+                    else:
+                        into_splitter[x] = 1
+                        old_record[x] = ref[j]
+            if len(into_splitter) == 0:
+                continue
+            for x in into_splitter:
+                partition.mark(x)
+            add_blocks(partition.split())
+            for x, c in into_splitter.items():
+                if counts[old_record[x]] == c:
+                    partition.mark(x)
+            add_blocks(partition.split())
+            new_record = dict()
+            for x, c in into_splitter.items():
+                counts[old_record[x]] -= c
+                new_record[x] = len(counts)
+                counts.append(c)
+            for y in splitter_states:
+                for j in range(offsets[y], offsets[y + 1]):
+                    ref[j] = new_record[sources[j]]
+
+    # Number the blocks by their smallest state
+    number = dict()
+    blocks = array(INDEX_TYPE, [0]) * n
+    for s in range(n):
+        b = partition.block_of[s]
+        if b not in number:
+            number[b] = len(number)
+        blocks[s] = number[b]
+    return blocks, len(number)
+
+
+def quotient(graph: Graph, blocks: array, num_blocks: int,
+             labels: Iterable[str] | None = None) -> Graph:
+    "The graph on the blocks, with the edges of labels (all by default)"
+    labels = graph.labels if labels is None else [l for l in labels if l in graph.label_ids]
+    edges = dict()
+    for label in labels:
+        l = graph.get_label_id(label)
+        offsets, targets = graph.succ_offsets[l], graph.succ_targets[l]
+        seen = set()
+        sources, destinations = array(INDEX_TYPE), array(INDEX_TYPE)
+        for s in range(graph.num_nodes):
+            for j in range(offsets[s], offsets[s + 1]):
+                edge = (blocks[s], blocks[targets[j]])
+                if edge not in seen:
+                    seen.add(edge)
+                    sources.append(edge[0])
+                    destinations.append(edge[1])
+        edges[label] = (sources, destinations)
+    initial = blocks[graph.initial_state] if graph.num_nodes > 0 else 0
+    return Graph.from_edges(num_blocks, edges, initial)
+
+
+def minimise(graph: Graph, labels: Iterable[str] | None = None) -> (Graph, array):
+    """
+    The bisimulation quotient of graph for labels (all by default), and the
+    state of the quotient for every state of graph.
+    """
+    labels = None if labels is None else list(labels)
+    blocks, num_blocks = bisimulation(graph, labels)
+    return quotient(graph, blocks, num_blocks, labels), blocks
+
+
+class QuotientChecker:
+    "Runs checker on a quotient and maps its results back to the original states"
+    def __init__(self, checker, blocks: array):
+        self.checker = checker
+        self.blocks = blocks
+
+    def solve_formula(self, variables: set[str],
+                      formula: query.Formula) -> cu.CheckerOutput:
+        res = self.checker.solve_formula(variables, formula)
+        blocks = self.blocks
+        satisfied = res.satisfied_states
+        res.satisfied_states = {s for s in range(len(blocks)) if blocks[s] in satisfied}
+        return res
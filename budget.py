@@ -0,0 +1,124 @@
+from __future__ import annotations
+import os
+from dataclasses import dataclass
+from typing import Callable
+
+import query
+import checker_utils as cu
+
+
+## Time and memory budgets and progress reports for the Naive and Emerson
+## checkers. Supervisor(checker, ...) replaces checker.solve and
+## checker.solve_formula, the same way the profiler does.
+##
+## The time budget is checked on every call of solve, the memory budget and
+## progress after every evaluation of a fixpoint body, when the checker is
+## between two iterations. A single modal step is never interrupted. Once a
+## budget is exceeded the query stops and its CheckerOutput has no satisfying
+## states, but names the budget and holds the iterations done so far and the
+## sizes of the current approximations.
+
+
+@dataclass
+class Budget:
+    timeout_ns: int | None = None
+    # Resident memory of the whole process, in bytes
+    max_memory: int | None = None
+
+
+@dataclass
+class Progress:
+    "A fixpoint body was evaluated, iteration counts like CheckerOutput.num_iter"
+    variable: str
+    iteration: int
+    size: int
+    elapsed_ns: int
+    memory: int
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def resident_memory() -> int:
+    "Current resident memory of the process in bytes, or the peak where that is unknown"
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        import resource
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def fixpoint_bodies(formula: query.Formula) -> dict[int, str]:
+    "id of the body of every fixpoint -> its variable"
+    bodies = dict()
+    for f in query.subformulas(formula):
+        match f:
+            case query.MuFormula(var, sub) | query.NuFormula(var, sub):
+                bodies[id(sub)] = var.name
+    return bodies
+
+
+class Supervisor:
+    def __init__(self, checker, budget: Budget,
+                 progress: Callable[[Progress], None] | None = None,
+                 interval_ns: int = 1_000_000_000):
+        """
+        progress is called at most once per interval_ns, after a fixpoint
+        body was evaluated.
+        """
+        self.checker = checker
+        self.budget = budget
+        self.progress = progress
+        self.interval_ns = interval_ns
+        self.bodies = dict()
+        self.start = 0
+        self.deadline = None
+        self.last_report = 0
+        self.solve = checker.solve
+        self.solve_formula = checker.solve_formula
+        checker.solve = self.solve_supervised
+        checker.solve_formula = self.solve_formula_supervised
+
+    def solve_formula_supervised(self, variables: set[str],
+                                 formula: query.Formula) -> cu.CheckerOutput:
+        self.bodies = fixpoint_bodies(formula)
+        self.start = self.last_report = cu.get_time()
+        if self.budget.timeout_ns is not None:
+            self.deadline = self.start + self.budget.timeout_ns
+        try:
+            return self.solve_formula(variables, formula)
+        except BudgetExceeded as exceeded:
+            checker = self.checker
+            sizes = {v: checker.sets.count(s) for v, s in checker.varState.items()}
+            return cu.CheckerOutput(set(), dict(checker.iter_count), cu.get_time() - self.start,
+                                    budget_exceeded=exceeded.reason, approximation_sizes=sizes)
+
+    def solve_supervised(self, formula: query.Formula):
+        now = cu.get_time()
+        if self.deadline is not None and now > self.deadline:
+            raise BudgetExceeded("time")
+        res = self.solve(formula)
+        variable = self.bodies.get(id(formula))
+        if variable is None:
+            return res
+        memory = None
+        if self.budget.max_memory is not None:
+            memory = resident_memory()
+            if memory > self.budget.max_memory:
+                raise BudgetExceeded("memory")
+        if self.progress is not None:
+            now = cu.get_time()
+            if now - self.last_report >= self.interval_ns:
+                self.last_report = now
+                memory = resident_memory() if memory is None else memory
+                self.progress(Progress(variable, self.checker.iter_count[variable],
+                                       self.checker.sets.count(res), now - self.start, memory))
+        return res
@@ -5,7 +5,28 @@ import time
 class CheckerOutput:
     satisfied_states: set[int]
     num_iter: dict[str,int] # Number of iterations made on a variable
-    running_time_millis: int
+    running_time_ns: int
+    # Only filled in when the checker memoizes subformula results
+    cache_hits: int = 0
+    cache_misses: int = 0
+    # A profiler.Profile, only filled in by a profiled checker
+    profile: object = None
+    initial_state_holds: bool | None = None
+    # Set by local.LocalChecker when it stopped as soon as initial_state_holds
+    # was known, satisfied_states is then only a bound on the real result
+    decided_early: bool = False
+    # Set by selector.AutoChecker: the checker it chose and why
+    engine: str | None = None
+    engine_reason: str | None = None
+    # Set by budget.Supervisor when a budget ("time" or "memory") stopped the
+    # query, with the size of the approximation of every variable by then
+    budget_exceeded: str | None = None
+    approximation_sizes: dict[str, int] | None = None
+
+    @property
+    def running_time_millis(self) -> int:
+        return round(self.running_time_ns / 1_000_000)
 
 def get_time() -> int:
-    return round(time.time() * 1000)
+    "High resolution clock in nanoseconds, only useful for differences"
+    return time.perf_counter_ns()
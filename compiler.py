@@ -0,0 +1,290 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import NamedTuple
+
+from graph import Graph
+import query
+import checker_utils as cu
+import state_set as ss
+import modal as md
+import regular
+
+
+## Compiles a formula once into a flat list of instructions over numbered
+## cells, which CompiledChecker then runs in a loop without recursion.
+##
+## Cells: 0 and 1 hold false and true, then one cell per fixpoint variable
+## (its slot), one per free variable, and one register per logic or modal
+## subformula. A variable or literal has no instruction of its own, its parent
+## reads the slot or constant cell directly. A fixpoint leaves its value in
+## its slot, so it does not need a register either.
+##
+## A fixpoint compiles to
+##   RESET   slots to set back before the body runs (only if there are any)
+##   ...     the body
+##   LOOP    if the body differs from the slot, store it and jump back
+##
+## Resets follow Emerson-Lei: when a fixpoint is entered whose closest
+## enclosing fixpoint is of the other kind, the fixpoints of its own kind in
+## its scope that have free variables start again from empty (mu) or full (nu).
+## Fixpoints of the same kind can continue from their last value.
+
+FALSE_CELL = 0
+TRUE_CELL = 1
+
+
+class Instruction(NamedTuple):
+    op: str
+    # Cell written (the slot for LOOP)
+    dst: int
+    # AND/OR: (left cell, right cell), BOX/DIAMOND: (label, cell),
+    # LOOP: (body cell, pc of the first body instruction),
+    # RESET: (slots set to empty, slots set to full)
+    args: tuple
+
+
+@dataclass
+class Program:
+    instructions: list[Instruction] = field(default_factory=list)
+    num_cells: int = 2
+    result: int = FALSE_CELL
+    # Slot cell -> name of the variable, and whether it is bound by a nu
+    # (nu slots start full, mu and free slots empty)
+    slot_names: dict[int, str] = field(default_factory=dict)
+    nu_slots: set[int] = field(default_factory=set)
+
+    def disassemble(self) -> str:
+        lines = []
+        for pc, instruction in enumerate(self.instructions):
+            lines.append(f"{pc:>5} {instruction.op:<8} {instruction.dst:>5} {instruction.args}")
+        return "\n".join(lines)
+
+
+class Frame:
+    "A subformula on the compile stack"
+    __slots__ = ('formula', 'started', 'children', 'results', 'slot', 'parent_is_mu')
+
+    def __init__(self, formula: query.Formula):
+        self.formula = formula
+        self.started = False
+        self.children = None
+        # (cell, free slots) of the children compiled so far
+        self.results = []
+        self.slot = None
+        self.parent_is_mu = None
+
+
+def compile_formula(formula: query.Formula) -> Program:
+    program = Program()
+    code = program.instructions
+    # Name -> slots of the enclosing binders with that name, innermost last
+    scopes = dict()
+    free_slots = dict()
+    # Binders whose body is being compiled, innermost last
+    binders = []
+    # Slot -> whether the fixpoint is a mu / has free variables
+    slot_is_mu = dict()
+    slot_has_free = dict()
+    # Slot -> pc of its RESET placeholder and of its first body instruction
+    body_start = dict()
+
+    def new_cell() -> int:
+        program.num_cells += 1
+        return program.num_cells - 1
+
+    stack = [Frame(formula)]
+    result = None
+    while len(stack) > 0:
+        frame = stack[-1]
+        f = frame.formula
+        if not frame.started:
+            frame.started = True
+            match f:
+                case query.LogicFormula(left, right, _):
+                    frame.children = [right, left]
+                case query.BoxFormula(_, sub) | query.DiamondFormula(_, sub):
+                    frame.children = [sub]
+                case query.MuFormula(var, sub) | query.NuFormula(var, sub):
+                    frame.children = [sub]
+                    frame.slot = new_cell()
+                    is_mu = isinstance(f, query.MuFormula)
+                    program.slot_names[frame.slot] = var.name
+                    if not is_mu:
+                        program.nu_slots.add(frame.slot)
+                    slot_is_mu[frame.slot] = is_mu
+                    frame.parent_is_mu = slot_is_mu[binders[-1]] if len(binders) > 0 else None
+                    scopes.setdefault(var.name, []).append(frame.slot)
+                    binders.append(frame.slot)
+                    # Placeholder for the RESET, filled in once the body is known
+                    code.append(None)
+                    body_start[frame.slot] = len(code)
+                case _:
+                    frame.children = []
+        if len(frame.children) > 0:
+            stack.append(Frame(frame.children.pop()))
+            continue
+        stack.pop()
+        match f:
+            case query.TrueLiteral():
+                result = (TRUE_CELL, frozenset())
+            case query.FalseLiteral() | None:
+                result = (FALSE_CELL, frozenset())
+            case query.RecursionVariable(name):
+                if len(scopes.get(name, ())) > 0:
+                    slot = scopes[name][-1]
+                else:
+                    if name not in free_slots:
+                        free_slots[name] = new_cell()
+                        program.slot_names[free_slots[name]] = name
+                    slot = free_slots[name]
+                result = (slot, frozenset([slot]))
+            case query.LogicFormula(_, _, is_and):
+                (left, left_free), (right, right_free) = frame.results
+                cell = new_cell()
+                code.append(Instruction("AND" if is_and else "OR", cell, (left, right)))
+                result = (cell, left_free | right_free)
+            case query.BoxFormula(l, _) | query.DiamondFormula(l, _):
+                ((child, free),) = frame.results
+                cell = new_cell()
+                op = "BOX" if isinstance(f, query.BoxFormula) else "DIAMOND"
+                code.append(Instruction(op, cell, (l, child)))
+                result = (cell, free)
+            case query.MuFormula(var, _) | query.NuFormula(var, _):
+                ((body, free),) = frame.results
+                slot = frame.slot
+                scopes[var.name].pop()
+                binders.pop()
+                free = free - {slot}
+                slot_has_free[slot] = len(free) > 0
+                start = body_start[slot]
+                code.append(Instruction("LOOP", slot, (body, start)))
+                is_mu = slot_is_mu[slot]
+                resets = ()
+                if frame.parent_is_mu is not None and frame.parent_is_mu != is_mu:
+                    # Slots are handed out in preorder, so the scope of this
+                    # fixpoint holds exactly the slots after its own
+                    resets = tuple(s for s in range(slot, program.num_cells)
+                                   if slot_is_mu.get(s) == is_mu and slot_has_free[s])
+                if len(resets) > 0:
+                    code[start - 1] = Instruction("RESET", slot, (resets, ()) if is_mu else ((), resets))
+                else:
+                    code[start - 1] = Instruction("NOP", slot, ())
+                result = (slot, free)
+            case _:
+                raise AssertionError
+        if len(stack) > 0:
+            stack[-1].results.append(result)
+    program.result = result[0]
+    # Drop the NOPs, jump targets move along
+    shift = []
+    removed = 0
+    for instruction in code:
+        shift.append(removed)
+        if instruction.op == "NOP":
+            removed += 1
+    shift.append(removed)
+    compacted = []
+    for instruction in code:
+        match instruction:
+            case Instruction("NOP", _, _):
+                continue
+            case Instruction("LOOP", slot, (body, start)):
+                compacted.append(Instruction("LOOP", slot, (body, start - shift[start])))
+            case _:
+                compacted.append(instruction)
+    program.instructions = compacted
+    return program
+
+
+class CompiledChecker:
+    "Emerson-Lei on a compiled formula, see compile_formula"
+    def __init__(self, graph: Graph, backend: str = ss.DEFAULT_BACKEND,
+                 modal_engine: str = md.DEFAULT_MODAL_ENGINE):
+        self.graph = graph
+        self.sets = ss.create_backend(backend, graph.num_nodes)
+        self.modal = md.create_modal_engine(modal_engine, graph, self.sets)
+        self.regular = regular.RegularModalities(graph, self.sets)
+
+    def solve_formula(self, variables: set[str],
+                      formula: query.Formula) -> cu.CheckerOutput:
+        program = compile_formula(formula)
+        cells, iterations, code = self.link_program(program)
+        start = cu.get_time()
+        self.run(code)
+        duration = cu.get_time() - start
+        iter_count = {v: 0 for v in variables}
+        for slot, name in program.slot_names.items():
+            iter_count[name] = iter_count.get(name, 0) + iterations[slot]
+        states = self.sets.to_set(cells[program.result])
+        return cu.CheckerOutput(states, iter_count, duration,
+                                initial_state_holds=self.graph.initial_state in states)
+
+    def link_program(self, program: Program) -> (list, list[int], list):
+        "Returns the initial cells, the iteration counters per slot and the linked code"
+        cells = [None] * program.num_cells
+        cells[FALSE_CELL] = self.sets.empty()
+        cells[TRUE_CELL] = self.sets.full()
+        for slot in program.slot_names:
+            cells[slot] = self.sets.full() if slot in program.nu_slots else self.sets.empty()
+        iterations = [0] * program.num_cells
+        code = [self.link(pc, instruction, cells, iterations)
+                for pc, instruction in enumerate(program.instructions)]
+        return cells, iterations, code
+
+    def run(self, code: list):
+        pc = 0
+        end = len(code)
+        while pc < end:
+            pc = code[pc]()
+
+    def link(self, pc: int, instruction: Instruction, cells: list, iterations: list[int]):
+        "Turns instruction into a closure that executes it and returns the next pc"
+        following = pc + 1
+        dst = instruction.dst
+        match instruction:
+            case Instruction("AND", _, (a, b)):
+                intersection = self.sets.intersection
+
+                def run():
+                    cells[dst] = intersection(cells[a], cells[b])
+                    return following
+            case Instruction("OR", _, (a, b)):
+                union = self.sets.union
+
+                def run():
+                    cells[dst] = union(cells[a], cells[b])
+                    return following
+            case Instruction("BOX", _, (label, a)):
+                box = self.modal.box if query.is_action(label) else self.regular.box
+
+                def run():
+                    cells[dst] = box(label, cells[a])
+                    return following
+            case Instruction("DIAMOND", _, (label, a)):
+                diamond = self.modal.diamond if query.is_action(label) else self.regular.diamond
+
+                def run():
+                    cells[dst] = diamond(label, cells[a])
+                    return following
+            case Instruction("RESET", _, (to_empty, to_full)):
+                empty = self.sets.empty()
+                full = self.sets.full()
+
+                def run():
+                    for slot in to_empty:
+                        cells[slot] = empty
+                    for slot in to_full:
+                        cells[slot] = full
+                    return following
+            case Instruction("LOOP", _, (body, start)):
+                equals = self.sets.equals
+
+                def run():
+                    if equals(cells[dst], cells[body]):
+                        return following
+                    cells[dst] = cells[body]
+                    iterations[dst] += 1
+                    return start
+            case _:
+                raise AssertionError
+        return run
@@ -0,0 +1,42 @@
+from __future__ import annotations
+from array import array
+from typing import Sequence
+
+
+## Compressed sparse rows: the values of key k are
+## targets[offsets[k]:offsets[k+1]]. Shared by graph.py and the readers that
+## build its arrays (aut_reader, graph_cache), so none of them imports the
+## other.
+
+# Typecode used for state numbers and offsets (4 byte signed int)
+INDEX_TYPE = 'i'
+
+
+def build_csr(num_nodes: int, keys: Sequence[int],
+              values: Sequence[int]) -> tuple[array, array]:
+    """
+    Groups values by key with a counting sort. Returns (offsets, targets)
+    such that the values of key k are targets[offsets[k]:offsets[k+1]].
+    """
+    offsets = array(INDEX_TYPE, [0]) * (num_nodes + 1)
+    for k in keys:
+        offsets[k + 1] += 1
+    for i in range(num_nodes):
+        offsets[i + 1] += offsets[i]
+    position = offsets[:-1]
+    targets = array(INDEX_TYPE, [0]) * len(values)
+    for k, v in zip(keys, values):
+        targets[position[k]] = v
+        position[k] += 1
+    return offsets, targets
+
+
+def merge_csr(num_nodes: int, relations: list[tuple[Sequence[int], Sequence[int]]]) -> tuple[array, array]:
+    "One (offsets, targets) with the targets of all relations per key, in one pass over them"
+    offsets = array(INDEX_TYPE, [0]) * (num_nodes + 1)
+    targets = array(INDEX_TYPE)
+    for k in range(num_nodes):
+        for key_offsets, key_targets in relations:
+            targets.extend(key_targets[key_offsets[k]:key_offsets[k + 1]])
+        offsets[k + 1] = len(targets)
+    return offsets, targets
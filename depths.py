@@ -17,6 +17,8 @@ class ComputeDepths:
 
     def nested(self):
         "computes the nested depth"
+        if self.tree is None:
+            return 0
         child_to_parent = create_parent_relation(self.tree) 
         parent_to_child = self.make_parent_to_child(child_to_parent)    
         
@@ -69,27 +71,27 @@ class ComputeDepths:
         
         return max_alternate_depth
 
-    def make_open_variables_dict(self, formula, dict):
+    def make_open_variables_dict(self, formula, dict, min_max_dict):
         match formula:
             case query.TrueLiteral() | query.FalseLiteral():
                 pass
             case query.LogicFormula(left, right, _):
-                self.make_open_variables_dict(left, dict)
-                self.make_open_variables_dict(right, dict)
+                self.make_open_variables_dict(left, dict, min_max_dict)
+                self.make_open_variables_dict(right, dict, min_max_dict)
             case query.DiamondFormula(l, f) | query.BoxFormula(l, f):
-                self.make_open_variables_dict(f, dict)
+                self.make_open_variables_dict(f, dict, min_max_dict)
             case query.MuFormula(var, formula):
                 if var.name not in dict:
-                    relation_creator = ResetRelationCreator(formula)
+                    relation_creator = ResetRelationCreator(self.tree, min_max_dict)
                     open_variables = relation_creator.find_open_variables(formula,{var.name})
                     dict[var.name] = open_variables
-                    self.make_open_variables_dict(formula, dict)
+                    self.make_open_variables_dict(formula, dict, min_max_dict)
             case query.NuFormula(var, formula):
                 if var.name not in dict:
-                    relation_creator = ResetRelationCreator(formula)
+                    relation_creator = ResetRelationCreator(self.tree, min_max_dict)
                     open_variables = relation_creator.find_open_variables(formula,{var.name})
                     dict[var.name] = open_variables
-                    self.make_open_variables_dict(formula, dict)
+                    self.make_open_variables_dict(formula, dict, min_max_dict)
             case query.RecursionVariable(name):
                 pass
             case _:
@@ -98,50 +100,49 @@ class ComputeDepths:
         
     def d_alternate(self):
         "computes the dependent alternation depth"
-        open_variables_dict = self.make_open_variables_dict(self.formula, {})
-        print("final result: ",open_variables_dict)
-        child_to_parent = create_parent_relation(self.tree) 
         min_max_dict = create_fixpoint_to_type_relation(self.tree)
+        open_variables_dict = self.make_open_variables_dict(self.formula, {}, min_max_dict)
+        child_to_parent = create_parent_relation(self.tree) 
         parent_to_child = self.make_parent_to_child(child_to_parent) 
         
-        def dfs(node, depth, current_label):
-            if node not in parent_to_child:
-                # Leaf node reached
-                return depth
-
-            max_depth = depth
-            max_depth_with_dependency = 0
-            children = parent_to_child[node]
-
-            for child in children:
-                child_label = min_max_dict[child]
-                if child_label != current_label:
-                    # Labels alternate, continue exploration
-                    if node in open_variables_dict[child]:
-                       #only update max depth if the dependency condition is met
-                       max_depth_with_dependency = depth+1 
-                    child_depth = dfs(child, depth + 1, child_label)
-                    max_depth = max(max_depth, child_depth)
-                    
-
-            return max_depth_with_dependency
+        def descendants(node):
+            for child in parent_to_child.get(node, []):
+                yield child
+                yield from descendants(child)
+
+        # Node -> result of dfs, its label is always min_max_dict[node]
+        longest = {}
+
+        def dfs(node, current_label):
+            # Longest chain of alternating fixpoints from node on, in which
+            # every fixpoint occurs free in the body of the next one
+            if node not in longest:
+                max_depth = 1
+                for child in descendants(node):
+                    child_label = min_max_dict[child]
+                    if child_label != current_label and node in open_variables_dict[child]:
+                        max_depth = max(max_depth, 1 + dfs(child, child_label))
+                longest[node] = max_depth
+            return longest[node]
 
         max_dependent_alternate_depth = 0
-        
+
         #start compution of depth from every node, not just root node
         for node in min_max_dict:
             node_label = min_max_dict[node]
-            alternate_depth = dfs(node, 1, node_label)
+            alternate_depth = dfs(node, node_label)
             max_dependent_alternate_depth = max(max_dependent_alternate_depth, alternate_depth)
-        
+
         return max_dependent_alternate_depth
     
-formula = "mu X. (mu Y. (Y && X) && (mu Z. Z || mu Q. (nu V. Q && mu T. T)))"
-parser = query.Parser(formula)
-res = parser.parse()
-tree = create_tree(res)
-
-compute_depths = ComputeDepths(res, tree)
-print(compute_depths.nested())
-print(compute_depths.alternate())
-print(compute_depths.d_alternate())
+
+if __name__ == "__main__":
+    formula = "mu X. (mu Y. (Y && X) && (mu Z. Z || mu Q. (nu V. Q && mu T. T)))"
+    parser = query.Parser(formula)
+    res = parser.parse()
+    tree = create_tree(res)
+    
+    compute_depths = ComputeDepths(res, tree)
+    print(compute_depths.nested())
+    print(compute_depths.alternate())
+    print(compute_depths.d_alternate())
@@ -2,12 +2,32 @@ from graph import Graph
 
 import query
 import fixpoint_tree as ft
+import formula_dag
 import checker_utils as cu
+import state_set as ss
+import modal as md
+import regular
+
+# Number of stored results per fixpoint formula in warm start mode
+WARM_START_ENTRIES = 8
 
 
 class EmersonChecker:
-    def __init__(self, graph: Graph):
+    def __init__(self, graph: Graph, backend: str = ss.DEFAULT_BACKEND,
+                 modal_engine: str = md.DEFAULT_MODAL_ENGINE, memoize: bool = False,
+                 warm_start: bool = False):
         self.graph = graph
+        self.sets = ss.create_backend(backend, graph.num_nodes)
+        self.modal = md.create_modal_engine(modal_engine, graph, self.sets)
+        self.regular = regular.RegularModalities(graph, self.sets)
+        self.memoize = memoize
+        if memoize:
+            # Every recursive call now goes through the cache first
+            self.solve = self.memoized(self.solve)
+        self.warm_start = warm_start
+        # Alpha normalised fixpoint formula -> [(values of its free variables, result)],
+        # kept for all queries solved with this checker
+        self.approximations = {}
 
     def solve_formula(self, variables: set[str],
                       formula: query.Formula) -> cu.CheckerOutput:
@@ -18,73 +38,168 @@ class EmersonChecker:
         # Initialization step
         self.varState = {}
         self.iter_count = {}
+        # Bumped every time the state of a variable changes
+        self.version = {}
+        self.memo = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        if self.memoize:
+            self.free_variables = {}
+            self.find_free_variables(formula, rel_creator)
+        if self.warm_start:
+            self.alpha_keys = {}
+            self.find_alpha_keys(formula)
         for v in variables:
             if self.type_relation[v] == "max":
-                self.varState[v] = set(range(0, self.graph.num_nodes))
+                self.varState[v] = self.sets.full()
             else:
-                self.varState[v] = set()
+                self.varState[v] = self.sets.empty()
             self.iter_count[v] = 0
+            self.version[v] = 0
         start = cu.get_time()
         res = self.solve(formula)
         duration = cu.get_time()-start
-        return cu.CheckerOutput(res, self.iter_count, duration)
+        states = self.sets.to_set(res)
+        return cu.CheckerOutput(states, self.iter_count, duration,
+                                self.cache_hits, self.cache_misses,
+                                initial_state_holds=self.graph.initial_state in states)
+
+    def find_free_variables(self, formula: query.Formula,
+                            rel_creator: ft.ResetRelationCreator):
+        "Stores the free variables of every subformula under the id of the subformula"
+        open_variables = rel_creator.find_open_variables(formula, set())
+        self.free_variables[id(formula)] = tuple(sorted(set(open_variables)))
+        match formula:
+            case query.LogicFormula(left, right, _):
+                self.find_free_variables(left, rel_creator)
+                self.find_free_variables(right, rel_creator)
+            case query.DiamondFormula(_, f) | query.BoxFormula(_, f) | \
+                    query.MuFormula(_, f) | query.NuFormula(_, f):
+                self.find_free_variables(f, rel_creator)
+
+    def find_alpha_keys(self, formula: query.Formula):
+        "Stores the alpha_key of every fixpoint subformula under the id of the subformula"
+        match formula:
+            case query.LogicFormula(left, right, _):
+                self.find_alpha_keys(left)
+                self.find_alpha_keys(right)
+            case query.DiamondFormula(_, f) | query.BoxFormula(_, f):
+                self.find_alpha_keys(f)
+            case query.MuFormula(_, f) | query.NuFormula(_, f):
+                self.alpha_keys[id(formula)] = formula_dag.alpha_key(formula)
+                self.find_alpha_keys(f)
+
+    def seed(self, formula: query.Formula, name: str, is_mu: bool):
+        """
+        Moves the variable of a fixpoint formula closer to its fixpoint using
+        the results stored for the same formula. By monotonicity an earlier
+        mu result is below the least fixpoint when all free variables were
+        subsets of their current values, and an earlier nu result is above the
+        greatest fixpoint when they were all supersets.
+        """
+        key, free = self.alpha_keys[id(formula)]
+        current = [self.varState[v] for v in free]
+        value = self.varState[name]
+        for values, result in self.approximations.get(key, ()):
+            if is_mu and all(self.sets.is_subset(old, new)
+                             for old, new in zip(values, current)):
+                value = self.sets.union(value, result)
+            elif not is_mu and all(self.sets.is_subset(new, old)
+                                   for old, new in zip(values, current)):
+                value = self.sets.intersection(value, result)
+        if not self.sets.equals(value, self.varState[name]):
+            self.varState[name] = value
+            self.version[name] += 1
+
+    def remember(self, formula: query.Formula, name: str):
+        "Stores the fixpoint just computed for formula, for seed"
+        key, free = self.alpha_keys[id(formula)]
+        values = tuple(self.varState[v] for v in free)
+        entries = self.approximations.setdefault(key, [])
+        entries[:] = [(old, result) for old, result in entries
+                      if not all(self.sets.equals(a, b) for a, b in zip(old, values))]
+        entries.append((values, self.varState[name]))
+        del entries[:-WARM_START_ENTRIES]
+
+    def reset(self, name: str):
+        "Empties the variables that have to start over when the mu fixpoint of name is entered"
+        for var_to_reset in self.reset_relation.get(name, ()):
+            if not self.sets.is_empty(self.varState[var_to_reset]):
+                self.version[var_to_reset] += 1
+            self.varState[var_to_reset] = self.sets.empty()
+
+    def memoized(self, solve):
+        """
+        Wraps solve such that a subformula is only evaluated again when one of
+        its free variables changed since the last time. Closed subformulas are
+        therefore evaluated once per query.
+        """
+        def solve_memoized(formula: query.Formula) -> ss.StateSet:
+            match formula:
+                case query.RecursionVariable() | query.TrueLiteral() | query.FalseLiteral():
+                    return solve(formula)
+            key = id(formula)
+            versions = tuple(self.version[v] for v in self.free_variables[key])
+            cached = self.memo.get(key)
+            if cached is not None and cached[0] == versions:
+                self.cache_hits += 1
+                return cached[1]
+            self.cache_misses += 1
+            res = solve(formula)
+            self.memo[key] = (versions, res)
+            return res
+        return solve_memoized
 
-    def solve(self, formula: query.Formula) -> set[int]:
+    def solve(self, formula: query.Formula) -> ss.StateSet:
         match formula:
             case query.RecursionVariable(name):
                 return self.varState[name]
             case query.TrueLiteral():
-                return set(range(0, self.graph.num_nodes))
+                return self.sets.full()
             case query.FalseLiteral():
-                return set()
+                return self.sets.empty()
             case query.LogicFormula(left, right, is_and):
                 left_solution = self.solve(left)
                 right_solution = self.solve(right)
                 if is_and:
-                    return left_solution.intersection(right_solution)
+                    return self.sets.intersection(left_solution, right_solution)
                 else:
-                    return left_solution.union(right_solution)
-            case query.BoxFormula(l, f):
-                result = self.solve(f)
-                box_result = set()
-                for i in range(self.graph.num_nodes):
-                    out_neighbours = self.graph.get_outgoing(i, l)
-                    all_in = True
-                    for neighbour in out_neighbours:
-                        if neighbour not in result:
-                            all_in = False
-                            break
-                    if all_in:
-                        box_result.add(i)
-                return box_result
-            case query.DiamondFormula(l, f):
-                result = self.solve(f)
-                diamond_result = set()
-                for i in range(self.graph.num_nodes):
-                    out_neighbours = self.graph.get_outgoing(i, l)
-                    for neighbour in out_neighbours:
-                        if neighbour in result:
-                            diamond_result.add(i)
-                            break
-                return diamond_result
+                    return self.sets.union(left_solution, right_solution)
+            case query.BoxFormula(l, f) if query.is_action(l):
+                return self.modal.box(l, self.solve(f))
+            case query.DiamondFormula(l, f) if query.is_action(l):
+                return self.modal.diamond(l, self.solve(f))
+            case query.BoxFormula(regex, f):
+                return self.regular.box(regex, self.solve(f))
+            case query.DiamondFormula(regex, f):
+                return self.regular.diamond(regex, self.solve(f))
             case query.NuFormula(var, f):
+                if self.warm_start:
+                    self.seed(formula, var.name, False)
                 while True:
-                    updatedState = self.varState[var.name].copy()
+                    # State sets are never modified in place, no copy needed
+                    updatedState = self.varState[var.name]
                     self.varState[var.name] = self.solve(f)
-                    if self.varState[var.name] == updatedState:
+                    if self.sets.equals(self.varState[var.name], updatedState):
                         break
                     self.iter_count[var.name] += 1
+                    self.version[var.name] += 1
+                if self.warm_start:
+                    self.remember(formula, var.name)
                 return self.varState[var.name]
             case query.MuFormula(var, f):
-                if var.name in self.reset_relation:
-                    for var_to_reset in self.reset_relation[var.name]:
-                        self.varState[var_to_reset] = set()
+                self.reset(var.name)
+                if self.warm_start:
+                    self.seed(formula, var.name, True)
                 while True:
-                    updatedState = self.varState[var.name].copy()
+                    updatedState = self.varState[var.name]
                     self.varState[var.name] = self.solve(f)
-                    if self.varState[var.name] == updatedState:
+                    if self.sets.equals(self.varState[var.name], updatedState):
                         break
                     self.iter_count[var.name] += 1
+                    self.version[var.name] += 1
+                if self.warm_start:
+                    self.remember(formula, var.name)
                 return self.varState[var.name]
             case _:
                 raise AssertionError
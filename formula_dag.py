@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import query
+
+
+## Hash-consing of formulas. Structurally equal subformulas of all formulas
+## added to the same FormulaDAG become one and the same object, so a result
+## stored under the id of a subformula is found again from every query that
+## contains it.
+
+class FormulaDAG:
+    def __init__(self):
+        # Structural key -> canonical formula
+        self.table = dict()
+        # id of canonical formula -> its free variables
+        self.free = dict()
+
+    def add(self, formula: query.Formula) -> query.Formula:
+        "Returns the canonical version of formula"
+        match formula:
+            case query.TrueLiteral():
+                key = ("true",)
+                make = query.TrueLiteral
+                free = frozenset()
+            case query.FalseLiteral():
+                key = ("false",)
+                make = query.FalseLiteral
+                free = frozenset()
+            case query.RecursionVariable(name):
+                key = ("var", name)
+                make = lambda: query.RecursionVariable(name)
+                free = frozenset([name])
+            case query.LogicFormula(left, right, is_and):
+                left = self.add(left)
+                right = self.add(right)
+                key = ("logic", id(left), id(right), is_and)
+                make = lambda: query.LogicFormula(left, right, is_and)
+                free = self.free[id(left)] | self.free[id(right)]
+            case query.BoxFormula(l, f) | query.DiamondFormula(l, f):
+                kind = type(formula)
+                f = self.add(f)
+                key = (kind.__name__, l, id(f))
+                make = lambda: kind(l, f)
+                free = self.free[id(f)]
+            case query.MuFormula(var, f) | query.NuFormula(var, f):
+                kind = type(formula)
+                f = self.add(f)
+                key = (kind.__name__, var.name, id(f))
+                make = lambda: kind(query.RecursionVariable(var.name), f)
+                free = self.free[id(f)] - {var.name}
+            case _:
+                raise AssertionError
+        if key not in self.table:
+            canonical = make()
+            self.table[key] = canonical
+            self.free[id(canonical)] = free
+        return self.table[key]
+
+    def is_closed(self, formula: query.Formula) -> bool:
+        free = self.free.get(id(formula))
+        return free is not None and len(free) == 0
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+
+def share_closed_results(checker, dag: FormulaDAG):
+    """
+    Makes checker (Naive or Emerson) keep the value of every closed subformula
+    of dag for all queries it solves afterwards. A closed subformula has the
+    same value wherever it occurs, so it is evaluated once per graph. Its
+    iterations and time only count for the query that evaluates it.
+    """
+    cache = dict()
+    solve = checker.solve
+
+    def solve_shared(formula: query.Formula):
+        key = id(formula)
+        if key in cache:
+            return cache[key]
+        res = solve(formula)
+        if dag.is_closed(formula):
+            cache[key] = res
+        return res
+    checker.solve = solve_shared
+
+
+def alpha_key(formula: query.Formula) -> (tuple, tuple[str, ...]):
+    """
+    Returns a key that is the same for all formulas that only differ in the
+    names of their variables, and the free variables of formula in the order in
+    which the key numbers them. Bound variables are numbered by the depth of
+    their binder, free variables by their first occurrence.
+    """
+    free = []
+
+    def walk(formula: query.Formula, bound: dict[str, int], depth: int) -> tuple:
+        match formula:
+            case query.TrueLiteral():
+                return ("true",)
+            case query.FalseLiteral():
+                return ("false",)
+            case query.RecursionVariable(name):
+                if name in bound:
+                    return ("bound", bound[name])
+                if name not in free:
+                    free.append(name)
+                return ("free", free.index(name))
+            case query.LogicFormula(left, right, is_and):
+                return ("logic", walk(left, bound, depth), walk(right, bound, depth),
+                        is_and)
+            case query.BoxFormula(l, f) | query.DiamondFormula(l, f):
+                return (type(formula).__name__, l, walk(f, bound, depth))
+            case query.MuFormula(var, f) | query.NuFormula(var, f):
+                return (type(formula).__name__,
+                        walk(f, {**bound, var.name: depth}, depth + 1))
+            case _:
+                raise AssertionError
+    key = walk(formula, {}, 0)
+    return key, tuple(free)
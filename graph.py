@@ -1,28 +1,220 @@
 from __future__ import annotations
-from dataclasses import dataclass
-from collections import defaultdict
+from array import array
+from typing import Iterable, Iterator, Sequence
 
-import parse
+import aut_reader
+import graph_cache
+import query
+from csr import INDEX_TYPE, build_csr, merge_csr
+
+# A label id, or the ids of a set of labels whose edges are merged (see Graph.label_set_id)
+LabelKey = int | frozenset[int]
 
 
-@dataclass
 class Graph:
-    adjacency_dict: dict[tuple[int, str],list[int]]
-    num_nodes: int
+    """
+    Labelled transition system in compressed sparse row form.
+    Labels are interned to ints. For every label id l the successors of state s
+    are succ_targets[l][succ_offsets[l][s]:succ_offsets[l][s+1]], and the
+    predecessors are stored the same way in pred_offsets/pred_targets.
+    These lists hold one entry per label, the merged edges of label sets
+    are kept apart in merged. Use successors and predecessors to read the
+    edges of any LabelKey.
+    """
+    __slots__ = ('num_nodes', 'labels', 'label_ids', 'succ_offsets',
+                 'succ_targets', 'pred_offsets', 'pred_targets', 'initial_state',
+                 'successor_masks', 'merged', 'actions')
+
+    def __init__(self, num_nodes: int, labels: list[str],
+                 succ_offsets: list[Sequence[int]], succ_targets: list[Sequence[int]],
+                 pred_offsets: list[Sequence[int]], pred_targets: list[Sequence[int]],
+                 initial_state: int = 0):
+        self.num_nodes = num_nodes
+        self.labels = labels
+        self.label_ids = {label: i for i, label in enumerate(labels)}
+        self.succ_offsets = succ_offsets
+        self.succ_targets = succ_targets
+        self.pred_offsets = pred_offsets
+        self.pred_targets = pred_targets
+        self.initial_state = initial_state
+        # LabelKey -> has_successor(l), built on first use
+        self.successor_masks = dict()
+        # Frozenset of label ids -> (successors, predecessors) of their merged edges
+        self.merged = dict()
+        # Action formula -> its LabelKey, resolved on first use
+        self.actions = dict()
+
+    @property
+    def num_edges(self) -> int:
+        return sum(len(t) for t in self.succ_targets)
+
+    def get_label_id(self, label: query.Action) -> LabelKey | None:
+        "The id of a label, or the key of the labels an action formula matches"
+        if isinstance(label, str):
+            return self.label_ids.get(label)
+        if label not in self.actions:
+            self.actions[label] = self.label_set_id(
+                [name for name in self.labels if query.action_matches(label, name)])
+        return self.actions[label]
+
+    def label_set_id(self, labels: Iterable[str]) -> LabelKey | None:
+        """
+        A key for the edges of all labels together, None when none of them
+        occurs. A single label keeps its own id. For more the key is the set
+        of their ids, and their successors and predecessors are merged once
+        per set, so a modal step over the set reads every edge once.
+        """
+        ids = frozenset(l for l in map(self.label_ids.get, labels) if l is not None)
+        if len(ids) <= 1:
+            return next(iter(ids), None)
+        if ids not in self.merged:
+            ordered = sorted(ids)
+            self.merged[ids] = (
+                merge_csr(self.num_nodes, [(self.succ_offsets[l], self.succ_targets[l]) for l in ordered]),
+                merge_csr(self.num_nodes, [(self.pred_offsets[l], self.pred_targets[l]) for l in ordered]))
+        return ids
+
+    def successors(self, l: LabelKey) -> tuple[Sequence[int], Sequence[int]]:
+        "(offsets, targets) of the successors over the edges of l"
+        if isinstance(l, int):
+            return self.succ_offsets[l], self.succ_targets[l]
+        return self.merged[l][0]
+
+    def predecessors(self, l: LabelKey) -> tuple[Sequence[int], Sequence[int]]:
+        "(offsets, targets) of the predecessors over the edges of l"
+        if isinstance(l, int):
+            return self.pred_offsets[l], self.pred_targets[l]
+        return self.merged[l][1]
+
+    def get_outgoing(self, src: int, label: str) -> Sequence[int]:
+        l = self.label_ids.get(label)
+        if l is None:
+            return ()
+        offsets = self.succ_offsets[l]
+        return self.succ_targets[l][offsets[src]:offsets[src + 1]]
+
+    def get_incoming(self, dest: int, label: str) -> Sequence[int]:
+        l = self.label_ids.get(label)
+        if l is None:
+            return ()
+        offsets = self.pred_offsets[l]
+        return self.pred_targets[l][offsets[dest]:offsets[dest + 1]]
 
-    def get_outgoing(self, src: int, label: str) -> tuple[int]:
-        return self.adjacency_dict[(src, label)]
+    def edges(self) -> Iterator[tuple[int, str, int]]:
+        for l, label in enumerate(self.labels):
+            offsets = self.succ_offsets[l]
+            targets = self.succ_targets[l]
+            for src in range(self.num_nodes):
+                for i in range(offsets[src], offsets[src + 1]):
+                    yield (src, label, targets[i])
+
+    def reachable(self, start: int | None = None) -> array:
+        "The states reachable from start (default the initial state), in increasing order"
+        start = self.initial_state if start is None else start
+        seen = bytearray(self.num_nodes)
+        seen[start] = 1
+        frontier = [start]
+        relations = list(zip(self.succ_offsets, self.succ_targets))
+        while len(frontier) > 0:
+            s = frontier.pop()
+            for offsets, targets in relations:
+                for j in range(offsets[s], offsets[s + 1]):
+                    t = targets[j]
+                    if not seen[t]:
+                        seen[t] = 1
+                        frontier.append(t)
+        return array(INDEX_TYPE, (s for s in range(self.num_nodes) if seen[s]))
+
+    def restrict(self, states: Sequence[int]) -> Graph:
+        """
+        The subgraph on states (increasing), where state states[i] becomes i.
+        Edges leaving states are dropped, and so are labels without edges.
+        """
+        index = array(INDEX_TYPE, [-1]) * self.num_nodes
+        for i, s in enumerate(states):
+            index[s] = i
+        edges = dict()
+        for l, label in enumerate(self.labels):
+            offsets = self.succ_offsets[l]
+            targets = self.succ_targets[l]
+            sources, destinations = array(INDEX_TYPE), array(INDEX_TYPE)
+            for i, s in enumerate(states):
+                for j in range(offsets[s], offsets[s + 1]):
+                    t = index[targets[j]]
+                    if t >= 0:
+                        sources.append(i)
+                        destinations.append(t)
+            if len(sources) > 0:
+                edges[label] = (sources, destinations)
+        return Graph.from_edges(len(states), edges, max(index[self.initial_state], 0))
+
+    def has_successor(self, l: LabelKey) -> bytes:
+        "m[s] == 1 iff state s has a successor over the edges of l"
+        mask = self.successor_masks.get(l)
+        if mask is None:
+            offsets, _ = self.successors(l)
+            mask = bytes(offsets[s] != offsets[s + 1] for s in range(self.num_nodes))
+            self.successor_masks[l] = mask
+        return mask
+
+    def project(self, labels: Iterable[str]) -> Graph:
+        """
+        The graph with only the edges of labels, labels that do not occur are
+        ignored. The edge arrays are shared with this graph, not copied.
+        """
+        labels = set(labels)
+        ids = [self.label_ids[label] for label in self.labels if label in labels]
+        return Graph(self.num_nodes, [self.labels[l] for l in ids],
+                     [self.succ_offsets[l] for l in ids], [self.succ_targets[l] for l in ids],
+                     [self.pred_offsets[l] for l in ids], [self.pred_targets[l] for l in ids],
+                     self.initial_state)
+
+    @property
+    def adjacency_dict(self) -> dict[tuple[int, str], list[int]]:
+        "The old representation, only built on request"
+        adjacency = dict()
+        for src, label, dest in self.edges():
+            adjacency.setdefault((src, label), []).append(dest)
+        return adjacency
+
+    @staticmethod
+    def from_edges(num_nodes: int, edges: dict[str, tuple[Sequence[int], Sequence[int]]],
+                   initial_state: int = 0) -> Graph:
+        "edges maps every label to a pair (sources, destinations) of equal length"
+        labels = list(edges)
+        succ_offsets, succ_targets = [], []
+        pred_offsets, pred_targets = [], []
+        for label in labels:
+            sources, destinations = edges[label]
+            offsets, targets = build_csr(num_nodes, sources, destinations)
+            succ_offsets.append(offsets)
+            succ_targets.append(targets)
+            offsets, targets = build_csr(num_nodes, destinations, sources)
+            pred_offsets.append(offsets)
+            pred_targets.append(targets)
+        return Graph(num_nodes, labels, succ_offsets, succ_targets,
+                     pred_offsets, pred_targets, initial_state)
 
     @staticmethod
     def from_file(filename: str) -> Graph:
-        with open(filename, 'r') as graph_file:
-            lines = graph_file.read().strip().split('\n')
-        header_format_str = "des ({start:d},{edges:d},{nodes:d})"
-        header = parse.parse(header_format_str, lines[0].strip())
-        g = Graph(defaultdict(list), header['nodes'])
-        edge_format = parse.compile("({src:d},\"{label}\",{dest:d})")
-        for i in range(1, len(lines)):
-            res = edge_format.parse(lines[i].strip())
-            key = (res['src'], res['label'])
-            g.adjacency_dict[key].append(res['dest'])
+        header, edges = aut_reader.read_aut(filename)
+        return Graph.from_edges(header.num_nodes, edges, header.initial_state)
+
+    @staticmethod
+    def load(filename: str, use_cache: bool = True, validate: str = "mtime") -> Graph:
+        """
+        Like from_file, but goes through the binary sidecar of graph_cache.
+        The sidecar is (re)written when it is missing or out of date.
+        """
+        if not use_cache:
+            return Graph.from_file(filename)
+        cached = graph_cache.read_cache(filename, validate)
+        if cached is not None:
+            return Graph(*cached)
+        g = Graph.from_file(filename)
+        try:
+            graph_cache.write_cache(g, filename)
+        except OSError:
+            # Read-only directory, we simply go without a cache
+            pass
         return g
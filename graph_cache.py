@@ -0,0 +1,152 @@
+from __future__ import annotations
+from array import array
+import hashlib
+import mmap
+import os
+import struct
+from typing import TYPE_CHECKING
+
+from csr import INDEX_TYPE
+
+if TYPE_CHECKING:
+    from graph import Graph
+
+## Binary sidecar for a parsed .aut file, stored next to it as <file>.gcache
+##
+## Layout (native byte order, checked with BYTE_ORDER_MARK):
+##   header        HEADER struct, see below
+##   label table   for every label: 4 byte length followed by utf-8 bytes
+##   edge counts   num_labels 8 byte ints
+##   per label     succ_offsets (num_nodes+1), succ_targets (edges),
+##                 pred_offsets (num_nodes+1), pred_targets (edges),
+##                 all 4 byte ints, every section starts 8 byte aligned
+##
+## The cache is valid when the size and mtime of the source match,
+## or with validate="hash", when the blake2b digest of the source matches.
+
+MAGIC = b'MCGRAPH\0'
+VERSION = 2
+BYTE_ORDER_MARK = 0x01020304
+SUFFIX = ".gcache"
+# magic, version, bom, itemsize, source size, source mtime, source digest,
+# num_nodes, num_labels, initial_state
+HEADER = struct.Struct('=8sIIIqq16sqqq')
+DIGEST_SIZE = 16
+
+
+def cache_path(filename: str) -> str:
+    return filename + SUFFIX
+
+
+def file_digest(filename: str) -> bytes:
+    digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with open(filename, 'rb') as source:
+        for chunk in iter(lambda: source.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def padding(position: int) -> int:
+    return -position % 8
+
+
+def write_cache(graph: Graph, filename: str):
+    "Writes the sidecar for graph, which was loaded from filename"
+    stat = os.stat(filename)
+    header = HEADER.pack(MAGIC, VERSION, BYTE_ORDER_MARK,
+                         array(INDEX_TYPE).itemsize, stat.st_size,
+                         stat.st_mtime_ns, file_digest(filename),
+                         graph.num_nodes, len(graph.labels), graph.initial_state)
+    parts = [header]
+    for label in graph.labels:
+        encoded = label.encode()
+        parts.append(struct.pack('=I', len(encoded)))
+        parts.append(encoded)
+    position = sum(len(p) for p in parts)
+    parts.append(bytes(padding(position)))
+    parts.append(array('q', [len(t) for t in graph.succ_targets]).tobytes())
+    for l in range(len(graph.labels)):
+        for section in (graph.succ_offsets[l], graph.succ_targets[l],
+                        graph.pred_offsets[l], graph.pred_targets[l]):
+            data = bytes(section)
+            parts.append(data)
+            parts.append(bytes(padding(len(data))))
+    # Write to a temporary file first so other processes never see half a cache
+    temporary = f"{cache_path(filename)}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as cache_file:
+        for part in parts:
+            cache_file.write(part)
+    os.replace(temporary, cache_path(filename))
+
+
+def read_cache(filename: str, validate: str = "mtime") -> tuple | None:
+    """
+    Maps the sidecar of filename into memory and returns the arguments of
+    graph.Graph for it, whose arrays are read-only views on the mapped pages.
+    Returns None when there is no cache, it is out of date or its sections do
+    not fit in the file.
+    """
+    path = cache_path(filename)
+    try:
+        with open(path, 'rb') as cache_file:
+            mapped = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if len(mapped) < HEADER.size:
+        return None
+    (magic, version, bom, itemsize, source_size, source_mtime,
+     source_digest, num_nodes, num_labels, initial_state) = HEADER.unpack_from(mapped, 0)
+    if magic != MAGIC or version != VERSION or bom != BYTE_ORDER_MARK \
+            or itemsize != array(INDEX_TYPE).itemsize:
+        return None
+    stat = os.stat(filename)
+    if validate == "hash":
+        if file_digest(filename) != source_digest:
+            return None
+    elif stat.st_size != source_size or stat.st_mtime_ns != source_mtime:
+        return None
+    view = memoryview(mapped)
+    position = HEADER.size
+
+    def fits(length: int) -> bool:
+        "Whether length bytes from position are inside the file"
+        return 0 <= length and position + length <= len(mapped)
+
+    labels = []
+    for _ in range(num_labels):
+        if not fits(4):
+            return None
+        (length,) = struct.unpack_from('=I', mapped, position)
+        position += 4
+        if not fits(length):
+            return None
+        try:
+            labels.append(bytes(view[position:position + length]).decode())
+        except UnicodeDecodeError:
+            return None
+        position += length
+    position += padding(position)
+    if not fits(8 * num_labels):
+        return None
+    counts = view[position:position + 8 * num_labels].cast('q')
+    position += 8 * num_labels
+
+    def take(length: int) -> memoryview | None:
+        nonlocal position
+        if not fits(length * itemsize):
+            return None
+        section = view[position:position + length * itemsize].cast(INDEX_TYPE)
+        position += length * itemsize
+        position += padding(position)
+        return section
+
+    succ_offsets, succ_targets = [], []
+    pred_offsets, pred_targets = [], []
+    for l in range(num_labels):
+        sections = [take(num_nodes + 1), take(counts[l]), take(num_nodes + 1), take(counts[l])]
+        if None in sections:
+            return None
+        for arrays, section in zip((succ_offsets, succ_targets, pred_offsets, pred_targets), sections):
+            arrays.append(section)
+    return (num_nodes, labels, succ_offsets, succ_targets,
+            pred_offsets, pred_targets, initial_state)
@@ -0,0 +1,75 @@
+from __future__ import annotations
+from array import array
+
+from graph import Graph
+import query
+import checker_utils as cu
+
+
+## Local checking from the initial state. Only the states reachable from it
+## are kept, they are closed under successors, so every formula has the same
+## value on them as in the whole graph.
+##
+## For the Naive and Emerson checkers the outermost fixpoint can also stop
+## early: every iteration of a mu is below its fixpoint, so once it contains
+## the initial state the formula holds there, and every iteration of a nu is
+## above its fixpoint, so once it lacks the initial state the formula does not
+## hold. This is observed by wrapping checker.solve, like memoization does.
+
+
+def reachable_part(graph: Graph) -> (Graph, array):
+    "The subgraph reachable from the initial state, and its states in graph"
+    states = graph.reachable()
+    return graph.restrict(states), states
+
+
+class Decided(Exception):
+    "Raised from the wrapped solve once the initial state is decided"
+    def __init__(self, holds: bool, approximation):
+        super().__init__()
+        self.holds = holds
+        self.approximation = approximation
+
+
+class LocalChecker:
+    def __init__(self, checker, states: array, early_stop: bool = False):
+        """
+        checker runs on the subgraph of reachable_part and states is the
+        state of the original graph for each of its states.
+        """
+        self.checker = checker
+        self.graph = checker.graph
+        self.states = states
+        self.root_body = None
+        self.root_is_mu = False
+        if early_stop:
+            solve = checker.solve
+
+            def solve_local(formula: query.Formula):
+                res = solve(formula)
+                if formula is self.root_body:
+                    # res is the next approximation of the outermost fixpoint
+                    inside = checker.sets.contains(res, self.graph.initial_state)
+                    if inside == self.root_is_mu:
+                        raise Decided(inside, res)
+                return res
+            checker.solve = solve_local
+
+    def solve_formula(self, variables: set[str],
+                      formula: query.Formula) -> cu.CheckerOutput:
+        match formula:
+            case query.MuFormula(_, body) | query.NuFormula(_, body):
+                self.root_body = body
+                self.root_is_mu = isinstance(formula, query.MuFormula)
+            case _:
+                self.root_body = None
+        start = cu.get_time()
+        try:
+            res = self.checker.solve_formula(variables, formula)
+        except Decided as decided:
+            sets = self.checker.sets
+            res = cu.CheckerOutput(sets.to_set(decided.approximation),
+                                   dict(self.checker.iter_count), cu.get_time() - start,
+                                   initial_state_holds=decided.holds, decided_early=True)
+        res.satisfied_states = {self.states[s] for s in res.satisfied_states}
+        return res
@@ -1,13 +1,33 @@
 from __future__ import annotations
 import os
+import sys
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 import query
+import formula_dag
+import profiler
+import budget
+import local
+import bisim
+import parity
+import selector
+import results as rs
+import checker_utils as cu
 from graph import Graph
 from naive import NaiveChecker
 from emerson import EmersonChecker
+from worklist import WorklistChecker
+from compiler import CompiledChecker
+from parity import ParityChecker
+from scc import SccChecker
+from patterns import PatternChecker
+import state_set as ss
+import modal as md
+import bdd
 
-Checker = NaiveChecker | EmersonChecker
+Checker = NaiveChecker | EmersonChecker | WorklistChecker | CompiledChecker | ParityChecker | \
+    SccChecker | PatternChecker
 
 def get_files(path: str) -> (list[str], list[str]):
     files = os.listdir(path)
@@ -20,13 +40,189 @@ def get_files(path: str) -> (list[str], list[str]):
             query_files.append(file)
     return (query_files, graph_files)
 
-def get_checker(graph: Graph, args: argparse.Namespace) -> Checker:
+ENGINES = ["naive", "emerson", "worklist", "compiled", "parity", "scc", "patterns", "auto"]
+
+def get_checker_name(args: argparse.Namespace) -> str:
+    if args.engine is not None:
+        return args.engine.capitalize()
+    if args.worklist:
+        return "Worklist"
+    if args.compiled:
+        return "Compiled"
+    if args.parity:
+        return "Parity"
     if not args.emerson:
-        print("Using Naive checker")
-        return NaiveChecker(graph)
-    print("Using Emerson checker")
-    print()
-    return EmersonChecker(graph)
+        return "Naive"
+    return "Emerson"
+
+def get_checker(graph: Graph, args: argparse.Namespace, name: str | None = None) -> Checker:
+    match get_checker_name(args) if name is None else name:
+        case "Worklist":
+            return WorklistChecker(graph)
+        case "Compiled":
+            return CompiledChecker(graph, args.backend, args.modal)
+        case "Parity":
+            return ParityChecker(graph)
+        case "Scc":
+            return SccChecker(graph, args.backend, args.modal)
+        case "Patterns":
+            return PatternChecker(graph, args.backend, args.modal, args.memoize,
+                                  args.warm_start)
+        case "Naive":
+            return NaiveChecker(graph, args.backend, args.modal)
+        case _:
+            return EmersonChecker(graph, args.backend, args.modal, args.memoize,
+                                  args.warm_start)
+
+def print_checker_name(args: argparse.Namespace):
+    name = get_checker_name(args)
+    print(f"Using {name} checker")
+    if name != "Naive":
+        print()
+
+def prepare_queries(queries: list, args: argparse.Namespace) -> (list, formula_dag.FormulaDAG):
+    if not args.batch:
+        return queries, None
+    # All queries become one DAG, equal subformulas are the same object
+    dag = formula_dag.FormulaDAG()
+    return [(dag.add(f), v, s) for f, v, s in queries], dag
+
+def format_result(formula_string: str, res) -> str:
+    lines = [f"Query={formula_string}"]
+    for variable in res.num_iter:
+        lines.append(f"Variable={variable} Num Iterations={res.num_iter[variable]}")
+    lines.append(f"Duration={res.running_time_millis}ms")
+    if res.cache_hits + res.cache_misses > 0:
+        lines.append(f"Cache Hits={res.cache_hits} Cache Misses={res.cache_misses}")
+    if res.budget_exceeded is not None:
+        sizes = ", ".join(f"{v}={n}" for v, n in res.approximation_sizes.items())
+        lines.append(f"Stopped, {res.budget_exceeded} budget exceeded. Approximation sizes: {sizes}")
+        lines.append("---------------------------------------")
+        return "\n".join(lines) + "\n"
+    if res.engine is not None:
+        lines.append(f"Engine={res.engine} ({res.engine_reason})")
+    if res.decided_early:
+        lines.append(f"Initial State Holds={res.initial_state_holds} (decided early)")
+    else:
+        lines.append(f"Initial State Holds={res.initial_state_holds}")
+        lines.append(f"Satisfying States={len(res.satisfied_states)}")
+    lines.append("---------------------------------------")
+    return "\n".join(lines) + "\n"
+
+def query_labels(queries: list) -> set[str] | None:
+    "All labels used in the modal operators of queries, None when they may use any label"
+    labels = [query.collect_labels(formula) for formula, _, _ in queries]
+    if None in labels:
+        return None
+    return set().union(*labels)
+
+def wrap_checker(args: argparse.Namespace, name: str, graph: Graph,
+                 dag: formula_dag.FormulaDAG | None, states) -> Checker:
+    "The checker called name for graph, with the wrappers args ask for"
+    checker = get_checker(graph, args, name)
+    if args.profile or args.profile_stacks is not None:
+        if name in ("Naive", "Emerson"):
+            profiler.Profiler(checker)
+    if args.batch and name in ("Naive", "Emerson"):
+        formula_dag.share_closed_results(checker, dag)
+    if (args.timeout, args.max_memory, args.progress) != (None, None, None):
+        supervise(args, checker)
+    if args.local:
+        checker = local.LocalChecker(checker, states, name in ("Naive", "Emerson"))
+    return checker
+
+def report_progress(progress: budget.Progress):
+    print(f"{progress.variable} iteration {progress.iteration}: {progress.size} states, "
+          f"{progress.elapsed_ns / 1e9:.1f}s, {progress.memory // 2**20}MB", file=sys.stderr)
+
+def supervise(args: argparse.Namespace, checker: Checker):
+    "Puts the budgets and progress reports of args on checker"
+    limits = budget.Budget(None if args.timeout is None else int(args.timeout * 1e9),
+                           None if args.max_memory is None else args.max_memory * 2**20)
+    interval = int((args.progress or 0) * 1e9)
+    budget.Supervisor(checker, limits, None if args.progress is None else report_progress,
+                      interval)
+
+def load_checker(args: argparse.Namespace, graph_file: str,
+                 dag: formula_dag.FormulaDAG | None, labels: set[str] | None) -> (Checker, int):
+    """
+    Returns the checker for graph_file and the time it took to load (and
+    minimise) the graph. labels are the labels the queries use.
+    """
+    start = cu.get_time()
+    graph = Graph.load(args.dirpath+graph_file, not args.no_cache)
+    if args.minimise:
+        graph, blocks = bisim.minimise(graph, labels)
+    states = None
+    if args.local:
+        graph, states = local.reachable_part(graph)
+    # Edges of labels no query mentions are never looked at
+    if labels is not None:
+        graph = graph.project(labels)
+    load_time = cu.get_time() - start
+    name = get_checker_name(args)
+    if name == "Auto":
+        checker = selector.AutoChecker(graph, lambda n: wrap_checker(args, n, graph, dag, states))
+    else:
+        checker = wrap_checker(args, name, graph, dag, states)
+    if args.parity_above is not None:
+        checker = parity.AlternationSwitch(checker, wrap_checker(args, "Parity", graph, dag, states),
+                                           args.parity_above)
+    if args.minimise:
+        checker = bisim.QuotientChecker(checker, blocks)
+    return checker, load_time
+
+def solve_serial(args: argparse.Namespace, queries: list, graph_files: list[str]):
+    """
+    Yields (graph_file, results) for every graph, where results lazily yields
+    (CheckerOutput, graph load time) for every query.
+    """
+    queries, dag = prepare_queries(queries, args)
+    labels = query_labels(queries)
+    for graph_file in graph_files:
+        checker, load_time = load_checker(args, graph_file, dag, labels)
+        yield graph_file, ((checker.solve_formula(variables, formula), load_time)
+                           for formula, variables, _ in queries)
+
+## State of a worker process in --jobs mode. Every worker keeps the graphs
+## (and their checkers) it has seen, so a graph is loaded once per worker.
+_worker = dict()
+
+def init_worker(args: argparse.Namespace, queries: list):
+    _worker["args"] = args
+    # The DAG is rebuilt here, ids of formulas do not survive pickling
+    _worker["queries"], _worker["dag"] = prepare_queries(queries, args)
+    _worker["labels"] = query_labels(queries)
+    _worker["checkers"] = dict()
+
+def run_query(graph_file: str, query_index: int) -> (cu.CheckerOutput, int):
+    checkers = _worker["checkers"]
+    if graph_file not in checkers:
+        checkers[graph_file] = load_checker(_worker["args"], graph_file, _worker["dag"],
+                                            _worker["labels"])
+    checker, load_time = checkers[graph_file]
+    formula, variables, _ = _worker["queries"][query_index]
+    return checker.solve_formula(variables, formula), load_time
+
+def solve_parallel(args: argparse.Namespace, queries: list, graph_files: list[str]):
+    """
+    Same as solve_serial, but the graph x query grid is solved on a process
+    pool. Results still come out in the serial order.
+    """
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker,
+                             initargs=(args, queries)) as pool:
+        futures = dict()
+        for graph_file in graph_files:
+            for i in range(len(queries)):
+                futures[(graph_file, i)] = pool.submit(run_query, graph_file, i)
+        for graph_file in graph_files:
+            yield graph_file, (futures[(graph_file, i)].result()
+                               for i in range(len(queries)))
+
+def print_graph_header(graph_file: str):
+    print("############################")
+    print(f"Processing file {graph_file}")
+    print("############################")
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(prog="Model checker")
@@ -34,7 +230,72 @@ def parse_args() -> argparse.Namespace:
     # If this is provided we don't run all the graph files
     parser.add_argument('-g', '--graph', help="Name of graph file to run")
     parser.add_argument('-e', '--emerson', action="store_true")
+    parser.add_argument('--engine', choices=ENGINES,
+                        help="The checker to use, instead of -e/-w/-c/-p. "
+                             "auto picks one per query from its alternation depths and the graph size")
+    parser.add_argument('--memoize', action="store_true",
+                        help="Emerson checker only: reuse results of subformulas whose free variables did not change")
+    parser.add_argument('--warm-start', action="store_true",
+                        help="Emerson checker only: start fixpoints from the results of earlier queries on the same graph")
+    parser.add_argument('-w', '--worklist', action="store_true",
+                        help="Use the predecessor driven worklist checker")
+    parser.add_argument('-c', '--compiled', action="store_true",
+                        help="Compile the formula to flat instructions and run Emerson-Lei on them")
+    parser.add_argument('-p', '--parity', action="store_true",
+                        help="Solve the parity game of graph and formula with Zielonka's algorithm")
+    parser.add_argument('--parity-above', type=int, metavar="DEPTH",
+                        help="Use the parity game checker for queries whose alternation depth is above DEPTH")
+    parser.add_argument('-b', '--backend',
+                        choices=[*ss.BACKENDS, *(f"bdd:{o}" for o in bdd.ORDERINGS)],
+                        default=ss.DEFAULT_BACKEND,
+                        help="Representation used for sets of states, bdd:ordering picks the BDD variable ordering")
+    parser.add_argument('-m', '--modal', choices=list(md.MODAL_ENGINES),
+                        help="Evaluation of <a> and [a], vector requires numpy and symbolic the bdd backend. "
+                             "Default symbolic for bdd, predecessor otherwise")
+    parser.add_argument('--local', action="store_true",
+                        help="Only check the states reachable from the initial state, Naive and Emerson stop as soon as it is decided")
+    parser.add_argument('--minimise', action="store_true",
+                        help="Check the strong bisimulation quotient for the labels of the queries")
+    parser.add_argument('--no-cache', action="store_true",
+                        help="Do not read or write the binary .gcache next to each .aut")
+    parser.add_argument('--batch', action="store_true",
+                        help="Share closed subformulas between all queries on a graph. Only the first query "
+                             "using one pays its iterations and time, so these are not comparable "
+                             "with a run without --batch")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="Number of worker processes for the graph x query grid")
+    parser.add_argument('--profile', action="store_true",
+                        help="Print the time and state set sizes of every subformula after each query")
+    parser.add_argument('--profile-stacks',
+                        help="Write the profile of all queries to this file as collapsed stacks (flamegraph)")
+    parser.add_argument('--timeout', type=float, metavar="SECONDS",
+                        help="Naive and Emerson only: stop a query after this long and report how far it got")
+    parser.add_argument('--max-memory', type=int, metavar="MB",
+                        help="Naive and Emerson only: stop a query once the process uses more memory")
+    parser.add_argument('--progress', type=float, metavar="SECONDS",
+                        help="Naive and Emerson only: report the current fixpoint iteration on stderr this often")
+    parser.add_argument('--output', choices=rs.FORMATS, default="text",
+                        help="json and csv write one record per graph and query")
+    parser.add_argument('--output-file', help="Where json/csv records go, default stdout")
     args = parser.parse_args()
+    if args.engine is not None and (args.emerson or args.worklist or args.compiled or args.parity):
+        parser.error("--engine replaces -e/-w/-c/-p, use only one of them")
+    name = get_checker_name(args)
+    if args.batch and name not in ("Naive", "Emerson"):
+        parser.error("--batch works with the Naive and Emerson checkers only")
+    if args.profile or args.profile_stacks is not None:
+        if name not in ("Naive", "Emerson"):
+            parser.error("Profiling works with the Naive and Emerson checkers only")
+        if args.jobs > 1:
+            parser.error("Profiling works with --jobs 1 only")
+    if (args.timeout, args.max_memory, args.progress) != (None, None, None):
+        if name not in ("Naive", "Emerson"):
+            parser.error("Budgets and progress work with the Naive and Emerson checkers only")
+    is_bdd = args.backend.partition(":")[0] == "bdd"
+    if args.modal is None:
+        args.modal = "symbolic" if is_bdd else md.DEFAULT_MODAL_ENGINE
+    elif args.modal == "symbolic" and not is_bdd:
+        parser.error("The symbolic modal engine requires the bdd backend")
     if not args.dirpath.endswith("/"):
         args.dirpath += "/"
     return args
@@ -45,24 +306,38 @@ def main():
     if args.graph is not None:
         graph_files = [g for g in graph_files if g == args.graph]
     queries = []
+    parse_times = []
     for query_file in query_files:
+        start = cu.get_time()
         queries.append(query.parse_query(args.dirpath+query_file))
-    for graph_file in graph_files:
-        graph = Graph.from_file(args.dirpath+graph_file)
-        checker = get_checker(graph, args)
-        print("############################")
-        print(f"Processing file {graph_file}")
-        print("############################")
-        for i in range(len(queries)):
-            formula, variables, formula_string = queries[i]
-            print(f"Query={formula_string}")
-            res = checker.solve_formula(variables, formula)
-            for variable in res.num_iter:
-                print(f"Variable={variable} Num Iterations={res.num_iter[variable]}")
-            print(f"Duration={res.running_time_millis}ms")
-            print(f"Satisfying States={len(res.satisfied_states)}")
-            print("---------------------------------------")
-            print()
+        parse_times.append(cu.get_time() - start)
+    text = args.output == "text"
+    solve = solve_parallel if args.jobs > 1 else solve_serial
+    records = []
+    stacks = []
+    for graph_file, results in solve(args, queries, graph_files):
+        if text:
+            print_checker_name(args)
+            print_graph_header(graph_file)
+        for i, (res, load_time) in enumerate(results):
+            formula_string = queries[i][2]
+            if text:
+                print(format_result(formula_string, res))
+                if args.profile and res.profile is not None:
+                    print(res.profile.format_tree() + "\n")
+            if args.profile_stacks is not None and res.profile is not None:
+                stacks.extend(res.profile.collapsed_stacks([graph_file, query_files[i]]))
+            records.append(rs.make_record(graph_file, query_files[i], get_checker_name(args),
+                                          formula_string, parse_times[i], load_time, res))
+    if args.profile_stacks is not None:
+        with open(args.profile_stacks, 'w') as out:
+            out.write("\n".join(stacks) + "\n")
+    if not text:
+        if args.output_file is None:
+            rs.write_records(records, args.output, sys.stdout)
+        else:
+            with open(args.output_file, 'w', newline='') as out:
+                rs.write_records(records, args.output, out)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+from array import array
+from itertools import compress
+
+from graph import Graph, LabelKey, INDEX_TYPE
+import query
+import state_set as ss
+import bdd
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for the vector engine
+    np = None
+
+
+## Modal engines evaluate <l>S and [l]S for a state set S of some backend.
+## The scalar engine walks the successor arrays in python, the vector engine
+## does the same work with numpy operations over the per-label edge arrays.
+## The predecessor engine walks the predecessor arrays of the states in S (or
+## outside of it), and the symbolic engine works on BDDs and needs the bdd
+## backend.
+
+class ScalarModalEngine:
+    name = "scalar"
+
+    def __init__(self, graph: Graph, sets: ss.Backend):
+        self.graph = graph
+        self.sets = sets
+
+    def box(self, label: query.Action, states: ss.StateSet) -> ss.StateSet:
+        l = self.graph.get_label_id(label)
+        if l is None:
+            return self.sets.full()
+        result = self.sets.membership(states)
+        offsets, targets = self.graph.successors(l)
+        box_result = bytearray(self.graph.num_nodes)
+        for i in range(self.graph.num_nodes):
+            all_in = True
+            for j in range(offsets[i], offsets[i+1]):
+                if not result[targets[j]]:
+                    all_in = False
+                    break
+            if all_in:
+                box_result[i] = 1
+        return self.sets.from_membership(box_result)
+
+    def diamond(self, label: query.Action, states: ss.StateSet) -> ss.StateSet:
+        l = self.graph.get_label_id(label)
+        if l is None:
+            return self.sets.empty()
+        result = self.sets.membership(states)
+        offsets, targets = self.graph.successors(l)
+        diamond_result = bytearray(self.graph.num_nodes)
+        for i in range(self.graph.num_nodes):
+            for j in range(offsets[i], offsets[i+1]):
+                if result[targets[j]]:
+                    diamond_result[i] = 1
+                    break
+        return self.sets.from_membership(diamond_result)
+
+
+class VectorModalEngine:
+    """
+    For a label, the successor targets of all states form one array and the
+    states with at least one successor start a segment in it. <l>S is a
+    logical_or.reduceat of S[targets] over those segments, [l]S the
+    logical_and.reduceat, where states without successors satisfy the box.
+    """
+    name = "vector"
+
+    def __init__(self, graph: Graph, sets: ss.Backend):
+        if np is None:
+            raise ImportError("The vector modal engine requires numpy to be installed")
+        self.graph = graph
+        self.sets = sets
+        self.label_arrays = dict()
+
+    def get_arrays(self, l: LabelKey):
+        "(targets, states with a successor, start of their segment) for the edges of l"
+        if l not in self.label_arrays:
+            offsets, targets = self.graph.successors(l)
+            offsets = np.asarray(offsets, dtype=np.int64)
+            targets = np.asarray(targets, dtype=np.int64)
+            has_successor = np.flatnonzero(np.diff(offsets) > 0)
+            self.label_arrays[l] = (targets, has_successor, offsets[has_successor])
+        return self.label_arrays[l]
+
+    def to_array(self, states: ss.StateSet):
+        if isinstance(self.sets, ss.NumpyBackend):
+            return states
+        return np.frombuffer(self.sets.membership(states), dtype=np.bool_)
+
+    def from_array(self, array) -> ss.StateSet:
+        if isinstance(self.sets, ss.NumpyBackend):
+            return array
+        return self.sets.from_membership(array.tobytes())
+
+    def box(self, label: query.Action, states: ss.StateSet) -> ss.StateSet:
+        l = self.graph.get_label_id(label)
+        if l is None:
+            return self.sets.full()
+        targets, has_successor, starts = self.get_arrays(l)
+        result = np.ones(self.graph.num_nodes, dtype=np.bool_)
+        if len(targets) > 0:
+            hits = self.to_array(states)[targets]
+            result[has_successor] = np.logical_and.reduceat(hits, starts)
+        return self.from_array(result)
+
+    def diamond(self, label: query.Action, states: ss.StateSet) -> ss.StateSet:
+        l = self.graph.get_label_id(label)
+        if l is None:
+            return self.sets.empty()
+        targets, has_successor, starts = self.get_arrays(l)
+        result = np.zeros(self.graph.num_nodes, dtype=np.bool_)
+        if len(targets) > 0:
+            hits = self.to_array(states)[targets]
+            result[has_successor] = np.logical_or.reduceat(hits, starts)
+        return self.from_array(result)
+
+
+class SymbolicModalEngine:
+    """
+    Every label has a transition relation T_l over the current and next
+    variables of the bdd backend. <l>S is the preimage
+    exists next. T_l(current, next) && S(next), and [l]S = !<l>!S.
+    """
+    name = "symbolic"
+
+    def __init__(self, graph: Graph, sets: ss.Backend):
+        if not isinstance(sets, bdd.BddBackend):
+            raise ValueError("The symbolic modal engine requires the bdd backend")
+        self.graph = graph
+        self.sets = sets
+        manager = sets.manager
+        self.relations = dict()
+        # Results of and_exists and rename, kept between calls until a
+        # collection frees nodes they may refer to
+        self.caches = dict()
+        self.rename_cache = dict()
+        self.collections = manager.collections
+        # The preimage quantifies the next variables, S moves to them first
+        self.quantified = [False] * manager.num_levels
+        self.to_next = list(range(manager.num_levels))
+        for current, following in zip(sets.current, sets.next):
+            self.quantified[following] = True
+            self.to_next[current] = following
+
+    def get_relation(self, l: LabelKey) -> bdd.Function:
+        if l not in self.relations:
+            offsets, targets = self.graph.successors(l)
+            sources = array(INDEX_TYPE)
+            for i in range(self.graph.num_nodes):
+                sources.extend([i] * (offsets[i + 1] - offsets[i]))
+            self.relations[l] = self.sets.relation(sources, targets)
+        return self.relations[l]
+
+    def preimage(self, l: LabelKey, states: bdd.Function) -> bdd.Function:
+        manager = self.sets.manager
+        relation = self.get_relation(l)
+        manager.maybe_collect()
+        if manager.collections != self.collections:
+            self.collections = manager.collections
+            self.caches.clear()
+            self.rename_cache.clear()
+        target = manager.rename(states.node, self.to_next, self.rename_cache)
+        cache = self.caches.setdefault(l, dict())
+        return self.sets.wrap(manager.and_exists(relation.node, target, self.quantified, cache))
+
+    def box(self, label: query.Action, states: bdd.Function) -> bdd.Function:
+        l = self.graph.get_label_id(label)
+        if l is None:
+            return self.sets.full()
+        return self.sets.complement(self.preimage(l, self.sets.complement(states)))
+
+    def diamond(self, label: query.Action, states: bdd.Function) -> bdd.Function:
+        l = self.graph.get_label_id(label)
+        if l is None:
+            return self.sets.empty()
+        return self.preimage(l, states)
+
+
+class PredecessorModalEngine:
+    """
+    <l>S marks the l-predecessors of the states in S, [l]S starts from all
+    states and unmarks the l-predecessors of the states outside S. Only
+    edges into those states are touched, which pays off while they are the
+    minority. Otherwise the successors are scanned like the scalar engine
+    does, but only for the states that have any (Graph.has_successor).
+    """
+    name = "predecessor"
+
+    def __init__(self, graph: Graph, sets: ss.Backend):
+        self.graph = graph
+        self.sets = sets
+        self.sources = dict()
+
+    def get_sources(self, l: LabelKey) -> array:
+        "The states with a successor over the edges of l"
+        if l not in self.sources:
+            n = self.graph.num_nodes
+            self.sources[l] = array(INDEX_TYPE, compress(range(n), self.graph.has_successor(l)))
+        return self.sources[l]
+
+    def mark_predecessors(self, l: LabelKey, m: bytes, result: bytearray, value: int):
+        "Sets result[s] = value for every l-predecessor s of a state in m"
+        offsets, sources = self.graph.predecessors(l)
+        for t in compress(range(self.graph.num_nodes), m):
+            for s in sources[offsets[t]:offsets[t + 1]]:
+                result[s] = value
+
+    def box(self, label: query.Action, states: ss.StateSet) -> ss.StateSet:
+        l = self.graph.get_label_id(label)
+        if l is None:
+            return self.sets.full()
+        n = self.graph.num_nodes
+        m = self.sets.membership(states)
+        outside = bytes(m).translate(ss.FLIP)
+        if outside.count(1) <= n // 2:
+            result = bytearray(b'\x01') * n
+            self.mark_predecessors(l, outside, result, 0)
+            return self.sets.from_membership(result)
+        offsets, targets = self.graph.successors(l)
+        result = bytearray(self.graph.has_successor(l)).translate(ss.FLIP)
+        for i in self.get_sources(l):
+            for t in targets[offsets[i]:offsets[i + 1]]:
+                if not m[t]:
+                    break
+            else:
+                result[i] = 1
+        return self.sets.from_membership(result)
+
+    def diamond(self, label: query.Action, states: ss.StateSet) -> ss.StateSet:
+        l = self.graph.get_label_id(label)
+        if l is None:
+            return self.sets.empty()
+        n = self.graph.num_nodes
+        m = self.sets.membership(states)
+        result = bytearray(n)
+        if bytes(m).count(1) <= n // 2:
+            self.mark_predecessors(l, m, result, 1)
+            return self.sets.from_membership(result)
+        offsets, targets = self.graph.successors(l)
+        for i in self.get_sources(l):
+            for t in targets[offsets[i]:offsets[i + 1]]:
+                if m[t]:
+                    result[i] = 1
+                    break
+        return self.sets.from_membership(result)
+
+
+ModalEngine = ScalarModalEngine | VectorModalEngine | SymbolicModalEngine | PredecessorModalEngine
+
+MODAL_ENGINES = {
+    "scalar": ScalarModalEngine,
+    "vector": VectorModalEngine,
+    "symbolic": SymbolicModalEngine,
+    "predecessor": PredecessorModalEngine,
+}
+
+DEFAULT_MODAL_ENGINE = "predecessor"
+
+
+def create_modal_engine(name: str, graph: Graph, sets: ss.Backend) -> ModalEngine:
+    if name not in MODAL_ENGINES:
+        raise ValueError(f"Unknown modal engine {name}, "
+                         f"expected one of {', '.join(MODAL_ENGINES)}")
+    return MODAL_ENGINES[name](graph, sets)
@@ -1,77 +1,72 @@
 from graph import Graph
 import query
 import checker_utils as cu
+import state_set as ss
+import modal as md
+import regular
 
 
 class NaiveChecker:
-    def __init__(self, graph: Graph):
+    def __init__(self, graph: Graph, backend: str = ss.DEFAULT_BACKEND,
+                 modal_engine: str = md.DEFAULT_MODAL_ENGINE):
         self.graph = graph
+        self.sets = ss.create_backend(backend, graph.num_nodes)
+        self.modal = md.create_modal_engine(modal_engine, graph, self.sets)
+        self.regular = regular.RegularModalities(graph, self.sets)
 
     def solve_formula(self, variables: set[str],
                       formula: query.Formula) -> cu.CheckerOutput:
         self.varState = dict()
         self.iter_count = dict()
         for v in variables:
-            self.varState[v] = {}
+            self.varState[v] = self.sets.empty()
             self.iter_count[v] = 0
         start = cu.get_time()
         res = self.solve(formula)
         duration = cu.get_time() - start
-        return cu.CheckerOutput(res, self.iter_count, duration)
+        states = self.sets.to_set(res)
+        return cu.CheckerOutput(states, self.iter_count, duration,
+                                initial_state_holds=self.graph.initial_state in states)
 
-    def solve(self, formula: query.Formula) -> set[int]:
+    def solve(self, formula: query.Formula) -> ss.StateSet:
         match formula:
             case query.RecursionVariable(name):
                 return self.varState[name]
             case query.TrueLiteral():
-                return set(range(0, self.graph.num_nodes))
+                return self.sets.full()
             case query.FalseLiteral():
-                return set()
+                return self.sets.empty()
             case query.LogicFormula(left, right, is_and):
                 left_solution = self.solve(left)
                 right_solution = self.solve(right)
                 if is_and:
-                    return left_solution.intersection(right_solution)
+                    return self.sets.intersection(left_solution, right_solution)
                 else:
-                    return left_solution.union(right_solution)
-            case query.BoxFormula(l, f):
-                result = self.solve(f)
-                box_result = set()
-                for i in range(self.graph.num_nodes):
-                    out_neighbours = self.graph.get_outgoing(i, l)
-                    all_in = True
-                    for neighbour in out_neighbours:
-                        if neighbour not in result:
-                            all_in = False
-                            break
-                    if all_in:
-                        box_result.add(i)
-                return box_result
-            case query.DiamondFormula(l, f):
-                result = self.solve(f)
-                diamond_result = set()
-                for i in range(self.graph.num_nodes):
-                    out_neighbours = self.graph.get_outgoing(i, l)
-                    for neighbour in out_neighbours:
-                        if neighbour in result:
-                            diamond_result.add(i)
-                            break
-                return diamond_result
+                    return self.sets.union(left_solution, right_solution)
+            case query.BoxFormula(l, f) if query.is_action(l):
+                return self.modal.box(l, self.solve(f))
+            case query.DiamondFormula(l, f) if query.is_action(l):
+                return self.modal.diamond(l, self.solve(f))
+            case query.BoxFormula(regex, f):
+                return self.regular.box(regex, self.solve(f))
+            case query.DiamondFormula(regex, f):
+                return self.regular.diamond(regex, self.solve(f))
             case query.NuFormula(var, f):
-                self.varState[var.name] = set(range(0, self.graph.num_nodes))
+                self.varState[var.name] = self.sets.full()
                 while True:
-                    updatedState = {i for i in self.varState[var.name]}
+                    # State sets are never modified in place, no copy needed
+                    updatedState = self.varState[var.name]
                     self.varState[var.name] = self.solve(f)
-                    if self.varState[var.name] == updatedState:
+                    if self.sets.equals(self.varState[var.name], updatedState):
                         break
                     self.iter_count[var.name] += 1
                 return self.varState[var.name]
             case query.MuFormula(var, f):
-                self.varState[var.name] = set()
+                self.varState[var.name] = self.sets.empty()
                 while True:
-                    updatedState = {i for i in self.varState[var.name]}
+                    updatedState = self.varState[var.name]
                     self.varState[var.name] = self.solve(f)
-                    if self.varState[var.name] == updatedState:
+                    if self.sets.equals(self.varState[var.name], updatedState):
                         break
                     self.iter_count[var.name] += 1
                 return self.varState[var.name]
@@ -0,0 +1,298 @@
+from __future__ import annotations
+from array import array
+from dataclasses import dataclass
+
+from graph import Graph, INDEX_TYPE, build_csr
+import query
+import checker_utils as cu
+import fixpoint_tree as ft
+import regular
+from depths import ComputeDepths
+
+
+## Model checking as a parity game, solved with Zielonka's recursive algorithm.
+##
+## Player 0 (even) tries to show that a state satisfies a subformula, player 1
+## (odd) that it does not. There is a vertex per state and logic, modal or
+## fixpoint subformula: player 0 picks the side of an || and the successor of
+## a <a>, player 1 those of && and [a]. Literals, free variables and modal
+## operators without successors lead to the sinks TRUE_SINK and FALSE_SINK,
+## a bound variable leads straight to the vertex of its fixpoint.
+##
+## Only fixpoint vertices have a priority above 1, nu even and mu odd, and a
+## fixpoint has a higher priority than the fixpoints in its body. An infinite
+## play keeps returning to fixpoints, the outermost of those it visits
+## infinitely often has the highest priority and decides the winner. A state
+## satisfies the formula iff player 0 wins from its root vertex.
+##
+## Zielonka's algorithm is exponential in the number of priorities, but only
+## in that, where Emerson-Lei iteration counts can multiply with every
+## alternation of the formula.
+
+TRUE_SINK = 0
+FALSE_SINK = 1
+
+
+@dataclass
+class Game:
+    "Vertices 0..num_vertices-1, edges in CSR form in both directions"
+    num_vertices: int
+    owner: bytearray
+    priority: array
+    succ_offsets: array
+    succ_targets: array
+    pred_offsets: array
+    pred_targets: array
+
+
+def binder_priorities(binders: list[tuple[int, bool]]) -> list[int]:
+    """
+    binders lists (index of enclosing binder or -1, is_mu) for every fixpoint
+    in preorder. A fixpoint of the same kind as the enclosing one shares its
+    priority, one of the other kind gets one less. All priorities are above 1.
+    """
+    top = 2 * len(binders) + 2
+    priorities = []
+    for parent, is_mu in binders:
+        if parent < 0:
+            priorities.append(top + is_mu)
+        elif binders[parent][1] == is_mu:
+            priorities.append(priorities[parent])
+        else:
+            priorities.append(priorities[parent] - 1)
+    return priorities
+
+
+def build_game(graph: Graph, formula: query.Formula) -> (Game, int):
+    """
+    The game of formula on graph, and the reference of the root: the vertex
+    of the root for state s is ref * num_nodes + s + 2 for ref >= 0, and
+    -1 - ref is the sink for every state otherwise.
+    """
+    n = graph.num_nodes
+    # One entry per logic, modal and fixpoint subformula in preorder:
+    # (formula, references of its children), binders as in binder_priorities
+    nodes = []
+    binders = []
+    binder_node = []
+    scopes = dict()
+    # (formula, index of the parent node, index of the enclosing binder)
+    stack = [(formula, -1, -1)]
+    root = None
+    while len(stack) > 0:
+        f, parent, enclosing = stack.pop()
+        if f is None:
+            # Leaving a fixpoint
+            scopes[parent].pop()
+            continue
+        match f:
+            case query.TrueLiteral():
+                ref = -1 - TRUE_SINK
+            case query.FalseLiteral():
+                ref = -1 - FALSE_SINK
+            case query.RecursionVariable(name):
+                if len(scopes.get(name, ())) > 0:
+                    ref = binder_node[scopes[name][-1]]
+                else:
+                    # Free variables start empty, as in the other checkers
+                    ref = -1 - FALSE_SINK
+            case _:
+                ref = len(nodes)
+                nodes.append((f, []))
+        if parent < 0:
+            root = ref
+        else:
+            nodes[parent][1].append(ref)
+        match f:
+            case query.LogicFormula(left, right, _):
+                stack.append((right, ref, enclosing))
+                stack.append((left, ref, enclosing))
+            case query.BoxFormula(_, sub) | query.DiamondFormula(_, sub):
+                stack.append((sub, ref, enclosing))
+            case query.MuFormula(var, sub) | query.NuFormula(var, sub):
+                binders.append((enclosing, isinstance(f, query.MuFormula)))
+                binder_node.append(ref)
+                scopes.setdefault(var.name, []).append(len(binders) - 1)
+                stack.append((None, var.name, enclosing))
+                stack.append((sub, ref, len(binders) - 1))
+
+    priorities = binder_priorities(binders)
+    node_priority = dict(zip(binder_node, priorities))
+    num_vertices = 2 + len(nodes) * n
+    owner = bytearray(num_vertices)
+    owner[FALSE_SINK] = 1
+    priority = array(INDEX_TYPE, [0]) * num_vertices
+    priority[FALSE_SINK] = 1
+    offsets = array(INDEX_TYPE, [0, 1, 2])
+    targets = array(INDEX_TYPE, [TRUE_SINK, FALSE_SINK])
+
+    def vertices(ref: int) -> range | list[int]:
+        "The vertex of ref for every state"
+        if ref < 0:
+            return [-1 - ref] * n
+        return range(2 + ref * n, 2 + (ref + 1) * n)
+
+    for k, (f, children) in enumerate(nodes):
+        base = 2 + k * n
+        match f:
+            case query.LogicFormula(_, _, is_and):
+                if is_and:
+                    owner[base:base + n] = b'\x01' * n
+                for left, right in zip(vertices(children[0]), vertices(children[1])):
+                    targets.append(left)
+                    targets.append(right)
+                    offsets.append(len(targets))
+            case query.BoxFormula(label, _) | query.DiamondFormula(label, _):
+                is_box = isinstance(f, query.BoxFormula)
+                if is_box:
+                    owner[base:base + n] = b'\x01' * n
+                sink = TRUE_SINK if is_box else FALSE_SINK
+                l = graph.get_label_id(label)
+                child = vertices(children[0])
+                if l is None:
+                    targets.extend([sink] * n)
+                    offsets.extend(range(len(targets) - n + 1, len(targets) + 1))
+                    continue
+                succ_offsets, succ_targets = graph.successors(l)
+                for s in range(n):
+                    if succ_offsets[s] == succ_offsets[s + 1]:
+                        targets.append(sink)
+                    else:
+                        targets.extend([child[t] for t in
+                                        succ_targets[succ_offsets[s]:succ_offsets[s + 1]]])
+                    offsets.append(len(targets))
+            case query.MuFormula() | query.NuFormula():
+                priority[base:base + n] = array(INDEX_TYPE, [node_priority[k]]) * n
+                targets.extend(vertices(children[0]))
+                offsets.extend(range(len(targets) - n + 1, len(targets) + 1))
+            case _:
+                raise AssertionError
+
+    sources = array(INDEX_TYPE)
+    for v in range(num_vertices):
+        sources.extend([v] * (offsets[v + 1] - offsets[v]))
+    pred_offsets, pred_targets = build_csr(num_vertices, targets, sources)
+    return Game(num_vertices, owner, priority, offsets, targets,
+                pred_offsets, pred_targets), root
+
+
+def attractor(game: Game, player: int, target: list[int], in_game: bytearray) -> list[int]:
+    """
+    The vertices of the subgame in_game from which player can force a visit
+    to target (which lies in the subgame), including target.
+    """
+    owner = game.owner
+    succ_offsets, succ_targets = game.succ_offsets, game.succ_targets
+    pred_offsets, pred_targets = game.pred_offsets, game.pred_targets
+    attracted = bytearray(game.num_vertices)
+    # Per opponent vertex reached so far, its successors not attracted yet
+    remaining = dict()
+    result = list(target)
+    for v in result:
+        attracted[v] = 1
+    i = 0
+    while i < len(result):
+        v = result[i]
+        i += 1
+        for j in range(pred_offsets[v], pred_offsets[v + 1]):
+            u = pred_targets[j]
+            if attracted[u] or not in_game[u]:
+                continue
+            if owner[u] != player:
+                count = remaining.get(u)
+                if count is None:
+                    count = 0
+                    for k in range(succ_offsets[u], succ_offsets[u + 1]):
+                        count += in_game[succ_targets[k]]
+                count -= 1
+                remaining[u] = count
+                if count > 0:
+                    continue
+            attracted[u] = 1
+            result.append(u)
+    return result
+
+
+def zielonka(game: Game, vertices: list[int]) -> (list[int], list[int]):
+    """
+    The winning regions of player 0 and 1 in the subgame on vertices, every
+    vertex of which needs a successor in the subgame.
+    """
+    won = ([], [])
+    in_game = bytearray(game.num_vertices)
+    for v in vertices:
+        in_game[v] = 1
+    priority = game.priority
+    while len(vertices) > 0:
+        top = max(priority[v] for v in vertices)
+        player = top % 2
+        attracted = attractor(game, player, [v for v in vertices if priority[v] == top], in_game)
+        for v in attracted:
+            in_game[v] = 0
+        rest = [v for v in vertices if in_game[v]]
+        sub_won = zielonka(game, rest)
+        for v in attracted:
+            in_game[v] = 1
+        if len(sub_won[1 - player]) == 0:
+            won[player].extend(vertices)
+            break
+        # The opponent wins what it can force into its region of the subgame,
+        # the rest is solved again without it
+        lost = attractor(game, 1 - player, sub_won[1 - player], in_game)
+        won[1 - player].extend(lost)
+        for v in lost:
+            in_game[v] = 0
+        vertices = [v for v in vertices if in_game[v]]
+    return won
+
+
+class ParityChecker:
+    "Solves the parity game of (graph, formula), see build_game"
+    def __init__(self, graph: Graph):
+        self.graph = graph
+
+    def solve_formula(self, variables: set[str],
+                      formula: query.Formula) -> cu.CheckerOutput:
+        n = self.graph.num_nodes
+        start = cu.get_time()
+        # Regular modalities become fixpoints over single steps
+        formula, _ = regular.desugar(formula)
+        game, root = build_game(self.graph, formula)
+        if root < 0:
+            states = set(range(n)) if -1 - root == TRUE_SINK else set()
+        else:
+            won_even = bytearray(game.num_vertices)
+            for v in zielonka(game, list(range(game.num_vertices)))[0]:
+                won_even[v] = 1
+            base = 2 + root * n
+            states = {s for s in range(n) if won_even[base + s]}
+        duration = cu.get_time() - start
+        return cu.CheckerOutput(states, {v: 0 for v in variables}, duration,
+                                initial_state_holds=self.graph.initial_state in states)
+
+
+def alternation_depth(formula: query.Formula) -> int | None:
+    "None when formula is nested too deep for the recursive fixpoint tree"
+    try:
+        return ComputeDepths(formula, ft.create_tree(formula)).alternate()
+    except RecursionError:
+        return None
+
+
+class AlternationSwitch:
+    """
+    Hands queries with an alternation depth above threshold to the parity
+    checker and all others to checker, including those too deep to tell
+    (the compiled checker gets through them).
+    """
+    def __init__(self, checker, parity_checker, threshold: int):
+        self.checker = checker
+        self.parity_checker = parity_checker
+        self.threshold = threshold
+
+    def solve_formula(self, variables: set[str],
+                      formula: query.Formula) -> cu.CheckerOutput:
+        depth = alternation_depth(formula)
+        if depth is not None and depth > self.threshold:
+            return self.parity_checker.solve_formula(variables, formula)
+        return self.checker.solve_formula(variables, formula)
@@ -0,0 +1,321 @@
+from __future__ import annotations
+from array import array
+from dataclasses import dataclass
+import operator
+
+from graph import Graph, LabelKey, INDEX_TYPE
+import query
+import checker_utils as cu
+import state_set as ss
+import scc
+from emerson import EmersonChecker
+
+
+## Linear time kernels for fixpoints of a few common shapes.
+##
+## A flat fixpoint is sigma V. (t1 op t2 op ...) with op one of && and ||
+## and every term either free of V, <a>V or [a]V. Reachability
+## mu Y. (phi || <a>Y) is one backward search from phi, invariance
+## nu X. (phi && [a]X) the complement of one from !phi. Any other flat
+## fixpoint is solved with a counter per state and [a] term of the successors
+## not yet in V, so every edge is read once per term. A nu fixpoint is the
+## complement of the mu fixpoint of its dual body (swap && and ||, <a> and
+## [a], complement the terms free of V).
+##
+## Fairness nu X. mu Y. (phi || <A>X || <B>Y) holds where a path over the
+## A and B edges reaches phi or goes through A edges infinitely often, so
+## reaches a strongly connected component with an A edge inside. It is a
+## backward search from phi and those components; mu X. nu Y. (phi && [A]X
+## && [B]Y) is its dual.
+##
+## PatternChecker recognises these shapes and leaves all other fixpoints
+## to Emerson-Lei. Terms free of V are solved by the checker first, with
+## the current values of the outer variables.
+
+
+@dataclass
+class Flat:
+    variable: str
+    is_mu: bool
+    is_and: bool
+    # Terms without variable, and the labels of <a>variable and [a]variable
+    closed: list[query.Formula]
+    diamonds: list[query.Action]
+    boxes: list[query.Action]
+
+
+@dataclass
+class Fair:
+    "nu outer. mu inner. (closed || <A>outer || <B>inner) or its dual"
+    outer: str
+    inner: str
+    is_nu: bool
+    closed: list[query.Formula]
+    outer_labels: list[query.Action]
+    inner_labels: list[query.Action]
+
+
+Pattern = Flat | Fair
+
+
+def junction_terms(formula: query.Formula, is_and: bool) -> list[query.Formula]:
+    "The operands of a chain of && (is_and) or || around formula"
+    terms = []
+    stack = [formula]
+    while len(stack) > 0:
+        f = stack.pop()
+        match f:
+            case query.LogicFormula(left, right, op) if op == is_and:
+                stack.extend((right, left))
+            case _:
+                terms.append(f)
+    return terms
+
+
+def split_terms(terms: list[query.Formula], free: dict[int, frozenset[str]],
+                variables: dict[str, tuple[list[query.Action], list[query.Action]]],
+                closed: list[query.Formula]) -> bool:
+    """
+    Sorts terms into closed (free of all variables) and the labels of <a>v
+    and [a]v into variables[v]. False when some term is neither.
+    """
+    for term in terms:
+        if free[id(term)].isdisjoint(variables):
+            closed.append(term)
+            continue
+        match term:
+            case query.DiamondFormula(label, query.RecursionVariable(name)) \
+                    if name in variables and query.is_action(label):
+                variables[name][0].append(label)
+            case query.BoxFormula(label, query.RecursionVariable(name)) \
+                    if name in variables and query.is_action(label):
+                variables[name][1].append(label)
+            case _:
+                return False
+    return True
+
+
+def match_flat(formula: query.Formula, free: dict[int, frozenset[str]]) -> Flat | None:
+    match formula:
+        case query.MuFormula(var, body) | query.NuFormula(var, body):
+            is_mu = isinstance(formula, query.MuFormula)
+    match body:
+        case query.LogicFormula(_, _, is_and):
+            pass
+        case _:
+            # A single term, the junction that keeps it as it is
+            is_and = not is_mu
+    name = var.name
+    terms = junction_terms(body, is_and)
+    # mu V. (V || f) = mu V. f and nu V. (V && f) = nu V. f
+    if is_and != is_mu:
+        terms = [t for t in terms if t != query.RecursionVariable(name)]
+    closed = []
+    labels = {name: ([], [])}
+    if not split_terms(terms, free, labels, closed):
+        return None
+    return Flat(name, is_mu, is_and, closed, *labels[name])
+
+
+def match_fair(formula: query.Formula, free: dict[int, frozenset[str]]) -> Fair | None:
+    match formula:
+        case query.NuFormula(outer, query.MuFormula(inner, body)):
+            is_nu = True
+        case query.MuFormula(outer, query.NuFormula(inner, body)):
+            is_nu = False
+        case _:
+            return None
+    if outer.name == inner.name:
+        return None
+    closed = []
+    labels = {outer.name: ([], []), inner.name: ([], [])}
+    if not split_terms(junction_terms(body, not is_nu), free, labels, closed):
+        return None
+    # Only <a> under nu mu, only [a] under mu nu
+    outer_labels = labels[outer.name][0 if is_nu else 1]
+    inner_labels = labels[inner.name][0 if is_nu else 1]
+    if len(labels[outer.name][1 if is_nu else 0]) > 0 or len(labels[inner.name][1 if is_nu else 0]) > 0 \
+            or len(outer_labels) == 0:
+        return None
+    return Fair(outer.name, inner.name, is_nu, closed, outer_labels, inner_labels)
+
+
+def recognise(formula: query.Formula) -> dict[int, Pattern]:
+    "id of every fixpoint subformula with a kernel -> its pattern"
+    free = dict()
+    scc.find_free_variables(formula, free)
+    patterns = dict()
+    for f in query.subformulas(formula):
+        match f:
+            case query.MuFormula() | query.NuFormula():
+                # Also recorded inside other patterns, where they are never
+                # looked up (the inner fixpoint of Fair)
+                pattern = match_fair(f, free) or match_flat(f, free)
+                if pattern is not None:
+                    patterns[id(f)] = pattern
+    return patterns
+
+
+def backward_search(graph: Graph, start: bytearray, labels: list[LabelKey]) -> bytearray:
+    "start together with every state that reaches it over the edges of labels, in place"
+    relations = [graph.predecessors(l) for l in labels]
+    work = [s for s, b in enumerate(start) if b]
+    while len(work) > 0:
+        t = work.pop()
+        for offsets, sources in relations:
+            for p in sources[offsets[t]:offsets[t + 1]]:
+                if not start[p]:
+                    start[p] = 1
+                    work.append(p)
+    return start
+
+
+def least_flat(graph: Graph, phi: bytearray, is_and: bool,
+               diamonds: list[query.Action], boxes: list[query.Action]) -> bytearray:
+    """
+    mu V. (phi op <d>V op ... op [b]V ...) as a membership, op is && when
+    is_and. phi is the combination of all terms free of V, or None when there
+    are none.
+    """
+    n = graph.num_nodes
+    diamonds = [graph.get_label_id(label) for label in diamonds]
+    boxes = [graph.get_label_id(label) for label in boxes]
+    if is_and:
+        if None in diamonds:
+            # <d>V never holds
+            return bytearray(n)
+        boxes = [l for l in boxes if l is not None]
+    else:
+        if None in boxes:
+            # [b]V always holds
+            return bytearray(b'\x01') * n
+        diamonds = [l for l in diamonds if l is not None]
+    if phi is None:
+        phi = bytearray(b'\x01') * n if is_and else bytearray(n)
+    if not is_and and len(boxes) == 0:
+        return backward_search(graph, bytearray(phi), diamonds)
+    value = bytearray(n)
+    # Per [b] term and state: successors not in value yet
+    remaining = [array(INDEX_TYPE, map(operator.sub, offsets[1:], offsets[:-1]))
+                 for offsets, _ in map(graph.successors, boxes)]
+    if is_and:
+        # Per <d> term and state: whether a successor is in value
+        seen = [bytearray(n) for _ in diamonds]
+        # Per state: terms that do not hold yet
+        missing = array(INDEX_TYPE, [len(diamonds)]) * n
+        for counts in remaining:
+            for s in range(n):
+                if counts[s] > 0:
+                    missing[s] += 1
+        work = [s for s in range(n) if phi[s] and missing[s] == 0]
+    else:
+        work = [s for s in range(n) if phi[s] or any(counts[s] == 0 for counts in remaining)]
+    for s in work:
+        value[s] = 1
+    predecessors = [graph.predecessors(l) for l in diamonds]
+    box_predecessors = [graph.predecessors(l) for l in boxes]
+    while len(work) > 0:
+        t = work.pop()
+        for i, (offsets, sources) in enumerate(predecessors):
+            for p in sources[offsets[t]:offsets[t + 1]]:
+                if value[p]:
+                    continue
+                if not is_and:
+                    value[p] = 1
+                    work.append(p)
+                elif not seen[i][p]:
+                    seen[i][p] = 1
+                    missing[p] -= 1
+                    if missing[p] == 0 and phi[p]:
+                        value[p] = 1
+                        work.append(p)
+        for counts, (offsets, sources) in zip(remaining, box_predecessors):
+            for p in sources[offsets[t]:offsets[t + 1]]:
+                counts[p] -= 1
+                if counts[p] > 0 or value[p]:
+                    continue
+                if is_and:
+                    missing[p] -= 1
+                    if missing[p] > 0 or not phi[p]:
+                        continue
+                value[p] = 1
+                work.append(p)
+    return value
+
+
+def fair_states(graph: Graph, phi: bytearray, outer_labels: list[query.Action],
+                inner_labels: list[query.Action]) -> bytearray:
+    "nu X. mu Y. (phi || <A>X || <B>Y) as a membership, phi None when there are no closed terms"
+    n = graph.num_nodes
+    outer = [l for l in map(graph.get_label_id, outer_labels) if l is not None]
+    labels = set(outer) | {l for l in map(graph.get_label_id, inner_labels) if l is not None}
+    component, _ = scc.strongly_connected_components(graph, labels)
+    value = bytearray(n) if phi is None else bytearray(phi)
+    fair = set()
+    for l in outer:
+        offsets, targets = graph.successors(l)
+        for s in range(n):
+            if component[s] not in fair and any(component[t] == component[s]
+                                                for t in targets[offsets[s]:offsets[s + 1]]):
+                fair.add(component[s])
+    for s in range(n):
+        if component[s] in fair:
+            value[s] = 1
+    return backward_search(graph, value, labels)
+
+
+class PatternChecker(EmersonChecker):
+    """
+    Emerson-Lei, except for the fixpoints recognise finds a pattern for,
+    which are solved with the kernels above. Those do not count iterations.
+    """
+    def solve_formula(self, variables: set[str],
+                      formula: query.Formula) -> cu.CheckerOutput:
+        self.patterns = recognise(formula)
+        return super().solve_formula(variables, formula)
+
+    def solve(self, formula: query.Formula) -> ss.StateSet:
+        pattern = self.patterns.get(id(formula))
+        match pattern:
+            case None:
+                return super().solve(formula)
+            case Flat(variable, is_mu, is_and, closed, diamonds, boxes):
+                if is_mu:
+                    self.reset(variable)
+                    value = least_flat(self.graph, self.closed_membership(closed, is_and, False),
+                                       is_and, diamonds, boxes)
+                else:
+                    # The complement of the mu fixpoint of the dual body
+                    value = least_flat(self.graph, self.closed_membership(closed, is_and, True),
+                                       not is_and, boxes, diamonds).translate(ss.FLIP)
+                res = self.sets.from_membership(value)
+                self.set_variable(variable, res)
+            case Fair(outer, inner, is_nu, closed, outer_labels, inner_labels):
+                self.reset(inner if is_nu else outer)
+                value = fair_states(self.graph, self.closed_membership(closed, not is_nu, not is_nu),
+                                    outer_labels, inner_labels)
+                if not is_nu:
+                    value = value.translate(ss.FLIP)
+                res = self.sets.from_membership(value)
+                self.set_variable(outer, res)
+                self.set_variable(inner, res)
+        return res
+
+    def closed_membership(self, closed: list[query.Formula], is_and: bool,
+                          complement: bool) -> bytearray | None:
+        "The junction of the closed terms as a membership, optionally complemented"
+        if len(closed) == 0:
+            return None
+        res = self.solve(closed[0])
+        for term in closed[1:]:
+            if is_and:
+                res = self.sets.intersection(res, self.solve(term))
+            else:
+                res = self.sets.union(res, self.solve(term))
+        membership = bytearray(self.sets.membership(res))
+        return membership.translate(ss.FLIP) if complement else membership
+
+    def set_variable(self, name: str, value: ss.StateSet):
+        if not self.sets.equals(self.varState[name], value):
+            self.varState[name] = value
+            self.version[name] += 1
@@ -1,3 +1,5 @@
+import argparse
+
 import matplotlib.pyplot as plt
 import numpy as np
 
@@ -6,10 +8,15 @@ from graph import Graph
 from main import get_files
 from naive import NaiveChecker
 from emerson import EmersonChecker
+import results as rs
 
 
-def plot_num_iterations(experiment: str, xlabel: str, begin_range: int, end_range: int):
-    emerson, naive = get_num_iterations(experiment)
+def plot_num_iterations(experiment: str, xlabel: str, begin_range: int, end_range: int,
+                        result_files: list[str] = None):
+    if result_files is None:
+        emerson, naive = get_num_iterations(experiment)
+    else:
+        emerson, naive = read_num_iterations(result_files)
     i = 0
     for query_string, emerson_data in emerson.items():
         naive_data = naive[query_string]
@@ -26,10 +33,31 @@ def plot_num_iterations(experiment: str, xlabel: str, begin_range: int, end_rang
         i += 1
 
 
+def graph_size(graph_file: str) -> int:
+    return int(graph_file.split('_')[-1].split('.')[0])
+
+
+def read_num_iterations(result_files: list[str]):
+    "Same as get_num_iterations, but from records stored by main.py --output"
+    records = [r for f in result_files for r in rs.read_records(f)]
+    emerson_iterations = {}
+    naive_iterations = {}
+    for record in sorted(records, key=lambda r: graph_size(r["graph"])):
+        if record["algorithm"] == "Emerson":
+            iterations = emerson_iterations
+        elif record["algorithm"] == "Naive":
+            iterations = naive_iterations
+        else:
+            continue
+        total_num_iter = sum(record["iterations"].values())
+        iterations.setdefault(record["query"], []).append(total_num_iter)
+    return emerson_iterations, naive_iterations
+
+
 def get_num_iterations(experiment:str):
     path = f'Experiments/{experiment}/'
     query_files, graph_files = get_files(path)
-    sorted_graph_files = sorted(graph_files, key=lambda x: int(x.split('_')[-1].split('.')[0]))
+    sorted_graph_files = sorted(graph_files, key=graph_size)
     print(query_files)
     queries = []
 
@@ -43,7 +71,7 @@ def get_num_iterations(experiment:str):
         naive_iterations[query_file] = []
     for graph_file in sorted_graph_files:
         print(f'hey {graph_file}')
-        graph = Graph.from_file(path + graph_file)
+        graph = Graph.load(path + graph_file)
         for i in range(len(queries)):
             checker = EmersonChecker(graph)
             formula, variables, formula_string = queries[i]
@@ -64,14 +92,18 @@ def get_num_iterations(experiment:str):
     return emerson_iterations, naive_iterations
 
 
-plot_num_iterations('demanding', 'amount of children', 2, 10)
-#plot_num_iterations('dining', 'amount of professors', 2, 11)
-#plot_num_iterations('ccp', 'amount of clients', 2, 5)
-
-
-
-
-
-
-
-
+EXPERIMENTS = {
+    'demanding': ('amount of children', 2, 10),
+    'dining': ('amount of professors', 2, 8),
+    'ccp': ('amount of clients', 2, 4),
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Plot iterations")
+    parser.add_argument('experiment', nargs='?', default='demanding', choices=list(EXPERIMENTS))
+    parser.add_argument('-r', '--results', nargs='+',
+                        help="Records from main.py --output json/csv (for both -e and the naive"
+                             " checker), used instead of running the checkers again")
+    args = parser.parse_args()
+    xlabel, begin_range, end_range = EXPERIMENTS[args.experiment]
+    plot_num_iterations(args.experiment, xlabel, begin_range, end_range, args.results)
@@ -0,0 +1,138 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+
+import query
+import checker_utils as cu
+
+
+## Per subformula profile of the solve recursion of the Naive and Emerson
+## checkers. Profiler(checker) replaces checker.solve by a timing wrapper, the
+## same way memoization does, so an unprofiled checker runs unchanged code.
+## Every CheckerOutput of a profiled checker carries the Profile of its query.
+
+
+@dataclass
+class NodeStats:
+    evaluations: int = 0
+    # Including the subformulas, self_ns excludes them
+    total_ns: int = 0
+    self_ns: int = 0
+    # Summed over all evaluations, the input is the size of the results of the
+    # direct subformulas (all iterations of the body for a fixpoint)
+    input_states: int = 0
+    output_states: int = 0
+
+
+@dataclass
+class Profile:
+    formula: query.Formula
+    # id of subformula -> its statistics
+    stats: dict[int, NodeStats] = field(default_factory=dict)
+    # Path of subformula ids from the root -> time spent in the last one itself
+    stacks: dict[tuple[int, ...], int] = field(default_factory=dict)
+
+    def format_tree(self) -> str:
+        "The formula as an indented tree, one subformula per line with its statistics"
+        lines = [f"{'evals':>8}{'total ms':>11}{'self ms':>10}{'avg in':>10}{'avg out':>10}  formula"]
+        for formula, depth in walk(self.formula):
+            stats = self.stats.get(id(formula))
+            name = "  " * depth + node_name(formula)
+            if stats is None:
+                lines.append(f"{'-':>8}{'':>41}  {name}")
+                continue
+            average_in = stats.input_states / stats.evaluations
+            average_out = stats.output_states / stats.evaluations
+            lines.append(f"{stats.evaluations:>8}{stats.total_ns / 1e6:>11.3f}"
+                         f"{stats.self_ns / 1e6:>10.3f}{average_in:>10.1f}"
+                         f"{average_out:>10.1f}  {name}")
+        return "\n".join(lines)
+
+    def collapsed_stacks(self, prefix: list[str] = ()) -> list[str]:
+        """
+        Lines in the collapsed stack format of flamegraph.pl and speedscope:
+        frames separated by ';' followed by the self time in nanoseconds.
+        """
+        names = {id(f): node_name(f) for f, _ in walk(self.formula)}
+        lines = []
+        for path, self_ns in self.stacks.items():
+            frames = [*prefix, *(names[key] for key in path)]
+            lines.append(f"{';'.join(f.replace(';', ':') for f in frames)} {self_ns}")
+        return lines
+
+
+def node_name(formula: query.Formula) -> str:
+    match formula:
+        case query.TrueLiteral():
+            return "true"
+        case query.FalseLiteral():
+            return "false"
+        case query.RecursionVariable(name):
+            return name
+        case query.LogicFormula(_, _, is_and):
+            return "&&" if is_and else "||"
+        case query.DiamondFormula(l, _):
+            return f"<{l}>"
+        case query.BoxFormula(l, _):
+            return f"[{l}]"
+        case query.MuFormula(var, _):
+            return f"mu {var.name}."
+        case query.NuFormula(var, _):
+            return f"nu {var.name}."
+        case _:
+            raise AssertionError
+
+
+def walk(formula: query.Formula, depth: int = 0):
+    "Yields (subformula, depth) in preorder"
+    yield formula, depth
+    match formula:
+        case query.LogicFormula(left, right, _):
+            yield from walk(left, depth + 1)
+            yield from walk(right, depth + 1)
+        case query.DiamondFormula(_, f) | query.BoxFormula(_, f) | \
+                query.MuFormula(_, f) | query.NuFormula(_, f):
+            yield from walk(f, depth + 1)
+
+
+class Profiler:
+    def __init__(self, checker):
+        self.checker = checker
+        self.profile = None
+        # [id of subformula, time spent in subformulas, size of their results]
+        self.stack = []
+        self.solve = checker.solve
+        self.solve_formula = checker.solve_formula
+        checker.solve = self.solve_profiled
+        checker.solve_formula = self.solve_formula_profiled
+
+    def solve_formula_profiled(self, variables: set[str],
+                               formula: query.Formula) -> cu.CheckerOutput:
+        self.profile = Profile(formula)
+        res = self.solve_formula(variables, formula)
+        res.profile = self.profile
+        return res
+
+    def solve_profiled(self, formula: query.Formula):
+        key = id(formula)
+        frame = [key, 0, 0]
+        self.stack.append(frame)
+        start = cu.get_time()
+        res = self.solve(formula)
+        duration = cu.get_time() - start
+        self.stack.pop()
+        size = self.checker.sets.count(res)
+        stats = self.profile.stats.get(key)
+        if stats is None:
+            stats = self.profile.stats[key] = NodeStats()
+        stats.evaluations += 1
+        stats.total_ns += duration
+        stats.self_ns += duration - frame[1]
+        stats.input_states += frame[2]
+        stats.output_states += size
+        path = tuple(f[0] for f in self.stack) + (key,)
+        self.profile.stacks[path] = self.profile.stacks.get(path, 0) + duration - frame[1]
+        if len(self.stack) > 0:
+            parent = self.stack[-1]
+            parent[1] += duration
+            parent[2] += size
+        return res
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import TypeAlias, Union
+from typing import Iterator, TypeAlias, Union
 from dataclasses import dataclass
 
 
@@ -36,15 +36,93 @@ class MuFormula:
     formula: Formula
 
 
+## Action formulas and regular expressions over them, for <R>f and [R]f. A
+## plain label stays a str, all other parts are hashable so the graph can
+## cache the edges of an action formula and the NFA of an expression (see
+## graph.py and regular.py).
+
+@dataclass(frozen=True)
+class AnyLabel:
+    "true, a step with any label"
+    def __str__(self) -> str:
+        return "true"
+
+
+@dataclass(frozen=True)
+class ActionNot:
+    "!sub, any label sub does not match"
+    sub: Action
+
+    def __str__(self) -> str:
+        return f"!{self.sub}"
+
+
+@dataclass(frozen=True)
+class ActionOr:
+    "left||right"
+    left: Action
+    right: Action
+
+    def __str__(self) -> str:
+        return f"({self.left}||{self.right})"
+
+
+@dataclass(frozen=True)
+class ActionAnd:
+    "left&&right"
+    left: Action
+    right: Action
+
+    def __str__(self) -> str:
+        return f"({self.left}&&{self.right})"
+
+
+Action: TypeAlias = Union[str, AnyLabel, ActionNot, ActionOr, ActionAnd]
+
+
+@dataclass(frozen=True)
+class RegexSequence:
+    "left.right"
+    left: Regex
+    right: Regex
+
+    def __str__(self) -> str:
+        return f"({self.left}.{self.right})"
+
+
+@dataclass(frozen=True)
+class RegexChoice:
+    "left|right"
+    left: Regex
+    right: Regex
+
+    def __str__(self) -> str:
+        return f"({self.left}|{self.right})"
+
+
+@dataclass(frozen=True)
+class RegexRepeat:
+    "sub* (at_least_once False) or sub+"
+    sub: Regex
+    at_least_once: bool
+
+    def __str__(self) -> str:
+        return f"{self.sub}{'+' if self.at_least_once else '*'}"
+
+
+Regex: TypeAlias = Union[Action, RegexSequence, RegexChoice, RegexRepeat]
+
+
 @dataclass
 class DiamondFormula:
-    label: str
+    "<label>formula, label is a single label, an action formula or a regular expression"
+    label: Regex
     formula: Formula
 
 
 @dataclass
 class BoxFormula:
-    label: str
+    label: Regex
     formula: Formula
 
 
@@ -52,6 +130,65 @@ Formula: TypeAlias = Union[TrueLiteral, FalseLiteral, RecursionVariable,
                            LogicFormula, NuFormula, MuFormula,
                            DiamondFormula, BoxFormula]
 
+def subformulas(formula: Formula) -> Iterator[Formula]:
+    "formula and all its subformulas, parents before children, without recursion"
+    stack = [formula]
+    while len(stack) > 0:
+        f = stack.pop()
+        yield f
+        match f:
+            case LogicFormula(left, right, _):
+                stack.extend((right, left))
+            case BoxFormula(_, sub) | DiamondFormula(_, sub) | MuFormula(_, sub) | NuFormula(_, sub):
+                stack.append(sub)
+
+def is_action(regex: Regex) -> bool:
+    "Whether regex is a single step, over the labels an action formula matches"
+    return isinstance(regex, (str, AnyLabel, ActionNot, ActionOr, ActionAnd))
+
+def action_matches(action: Action, label: str) -> bool:
+    match action:
+        case str(name):
+            return name == label
+        case AnyLabel():
+            return True
+        case ActionNot(sub):
+            return not action_matches(sub, label)
+        case ActionOr(left, right):
+            return action_matches(left, label) or action_matches(right, label)
+        case ActionAnd(left, right):
+            return action_matches(left, label) and action_matches(right, label)
+    raise AssertionError
+
+def regex_labels(regex: Regex) -> set[str] | None:
+    "The labels regex mentions, None when it can match labels it does not mention"
+    labels = set()
+    stack = [regex]
+    while len(stack) > 0:
+        match stack.pop():
+            case str(label):
+                labels.add(label)
+            case AnyLabel() | ActionNot():
+                return None
+            case ActionOr(left, right) | ActionAnd(left, right) | \
+                    RegexSequence(left, right) | RegexChoice(left, right):
+                stack.extend((left, right))
+            case RegexRepeat(sub, _):
+                stack.append(sub)
+    return labels
+
+def collect_labels(formula: Formula) -> set[str] | None:
+    "The labels of all modal operators in formula, None when one matches any label"
+    labels = set()
+    for f in subformulas(formula):
+        match f:
+            case BoxFormula(label, _) | DiamondFormula(label, _):
+                mentioned = regex_labels(label)
+                if mentioned is None:
+                    return None
+                labels |= mentioned
+    return labels
+
 ## There are a lot of spaces in the files with new lines
 ## This function removes as many as possible.
 def make_pretty(input_string: str) -> str:
@@ -103,22 +240,63 @@ class Parser:
             self.index += 1
 
     def parse(self) -> Formula:
-        if self.get_char() == 't':
-            return self.parse_true_literal()
-        elif self.get_char() == 'f':
-            return self.parse_false_literal()
-        elif self.get_char().isupper():
-            return self.parse_recursion_variable()
-        elif self.get_char() == '(':
-            return self.parse_logic_formula()
-        elif self.get_char() == 'm':
-            return self.parse_mu_formula()
-        elif self.get_char() == 'n':
-            return self.parse_nu_formula()
-        elif self.get_char() == '[':
-            return self.parse_box_formula()
-        elif self.get_char() == '<':
-            return self.parse_diamond_formula()
+        """
+        Parses one formula without recursion, so formulas with thousands of
+        nested operators do not hit the recursion limit. Operators whose
+        operand is not parsed yet wait on the pending stack.
+        """
+        pending = []
+        while True:
+            c = self.get_char()
+            if c == 't':
+                formula = self.parse_true_literal()
+            elif c == 'f':
+                formula = self.parse_false_literal()
+            elif c.isupper():
+                formula = self.parse_recursion_variable()
+            elif c == '(':
+                self.expect("(")
+                self.skip_whitespace()
+                pending.append(["("])
+                continue
+            elif c == 'm':
+                pending.append(["mu", self.parse_binder("mu")])
+                continue
+            elif c == 'n':
+                pending.append(["nu", self.parse_binder("nu")])
+                continue
+            elif c == '[':
+                pending.append(["[", self.parse_label("[", "]")])
+                continue
+            elif c == '<':
+                pending.append(["<", self.parse_label("<", ">")])
+                continue
+            else:
+                formula = None
+            # formula is complete, hand it to the operators waiting for it
+            while len(pending) > 0:
+                top = pending[-1]
+                if top[0] == "(":
+                    # Left operand is done, continue with the right one
+                    pending[-1] = ["&&", formula, self.parse_logic_operator()]
+                    break
+                pending.pop()
+                match top[0]:
+                    case "&&":
+                        self.skip_whitespace()
+                        self.expect(")")
+                        self.skip_whitespace()
+                        formula = LogicFormula(top[1], formula, top[2])
+                    case "mu":
+                        formula = MuFormula(top[1], formula)
+                    case "nu":
+                        formula = NuFormula(top[1], formula)
+                    case "[":
+                        formula = BoxFormula(top[1], formula)
+                    case "<":
+                        formula = DiamondFormula(top[1], formula)
+            else:
+                return formula
 
     def parse_true_literal(self) -> TrueLiteral:
         self.expect("true")
@@ -139,63 +317,135 @@ class Parser:
         self.skip_whitespace()
         return var
 
-    def parse_logic_formula(self) -> LogicFormula:
+    def parse_logic_operator(self) -> bool:
         """
         This method deviates from the provided algorithm.
-        Here we just do all the work in a single function.
-        If something breaks, it is more likely to be because of this function.
+        Called between the two operands of a logic formula, returns whether it
+        is a conjunction.
         """
-        self.expect("(")
-        self.skip_whitespace()
-        first = self.parse()
         self.skip_whitespace()
         andOperator = self.get_char() == '&'
         # Expect does not really check anything, it just advances the pointer
         # therefore, this should also take care of || case.
         self.expect("&&")
         self.skip_whitespace()
-        second = self.parse()
-        self.skip_whitespace()
-        self.expect(")")
-        self.skip_whitespace()
-        return LogicFormula(first, second, andOperator)
-
-    def parse_mu_formula(self) -> MuFormula:
-        self.expect("mu")
-        self.skip_whitespace()
-        rec_var = self.parse_recursion_variable()
-        self.expect(".")
-        self.skip_whitespace()
-        remaining = self.parse()
-        return MuFormula(rec_var, remaining)
+        return andOperator
 
-    def parse_nu_formula(self) -> NuFormula:
-        self.expect("nu")
+    def parse_binder(self, keyword: str) -> RecursionVariable:
+        "Parses 'mu X.' or 'nu X.' up to the body"
+        self.expect(keyword)
         self.skip_whitespace()
         rec_var = self.parse_recursion_variable()
         self.expect(".")
         self.skip_whitespace()
-        remaining = self.parse()
-        return NuFormula(rec_var, remaining)
+        return rec_var
 
-    def parse_box_formula(self) -> BoxFormula:
-        self.expect("[")
+    def parse_label(self, opening: str, closing: str) -> Regex:
+        "Parses '[label]' or '<label>' up to the operand"
+        self.expect(opening)
         label = ""
-        while self.get_char() != ']':
+        while self.get_char() != closing:
             label += self.get_char()
             self.index += 1
-        self.expect("]")
+        self.expect(closing)
         self.skip_whitespace()
-        remaining = self.parse()
-        return BoxFormula(label, remaining)
+        if label.strip() == "true" or any(c in label for c in MODALITY_OPERATORS):
+            return RegexParser(label).parse()
+        return label
 
-    def parse_diamond_formula(self) -> DiamondFormula:
-        self.expect("<")
-        label = ""
-        while self.get_char() != '>':
-            label += self.get_char()
+
+# Characters that make the contents of a modality an action formula or a
+# regular expression, labels inside them cannot contain these or brackets
+MODALITY_OPERATORS = ".*+|!&"
+
+
+class RegexParser:
+    """
+    R ::= R '|' R | R '.' R | R '*' | R '+' | '(' R ')' | A
+    A ::= A '||' A | A '&&' A | '!' A | '(' A ')' | 'true' | label
+    from the weakest to the strongest binding, so action formulas are the
+    single steps of a regular expression.
+    """
+    def __init__(self, regex_str: str):
+        self.regex_str = regex_str
+        self.index = 0
+
+    def peek(self) -> str:
+        while self.index < len(self.regex_str) and self.regex_str[self.index] == ' ':
             self.index += 1
-        self.expect(">")
-        self.skip_whitespace()
-        remaining = self.parse()
-        return DiamondFormula(label, remaining)
+        return self.regex_str[self.index] if self.index < len(self.regex_str) else ""
+
+    def next_is(self, operator: str) -> bool:
+        self.peek()
+        return self.regex_str.startswith(operator, self.index)
+
+    def action(self, regex: Regex, operator: str) -> Action:
+        "regex as the operand of an action operator"
+        if not is_action(regex):
+            raise ValueError(f"'{operator}' needs action formulas, not regular expressions, "
+                             f"in '{self.regex_str}'")
+        return regex
+
+    def parse(self) -> Regex:
+        regex = self.parse_choice()
+        if self.peek() != "":
+            raise ValueError(f"Unexpected '{self.peek()}' in regular expression '{self.regex_str}'")
+        return regex
+
+    def parse_choice(self) -> Regex:
+        regex = self.parse_sequence()
+        while self.next_is("|") and not self.next_is("||"):
+            self.index += 1
+            regex = RegexChoice(regex, self.parse_sequence())
+        return regex
+
+    def parse_sequence(self) -> Regex:
+        regex = self.parse_repeat()
+        while self.peek() == ".":
+            self.index += 1
+            regex = RegexSequence(regex, self.parse_repeat())
+        return regex
+
+    def parse_repeat(self) -> Regex:
+        regex = self.parse_or()
+        while self.peek() in ("*", "+"):
+            regex = RegexRepeat(regex, self.peek() == "+")
+            self.index += 1
+        return regex
+
+    def parse_or(self) -> Regex:
+        regex = self.parse_and()
+        while self.next_is("||"):
+            self.index += 2
+            regex = ActionOr(self.action(regex, "||"), self.action(self.parse_and(), "||"))
+        return regex
+
+    def parse_and(self) -> Regex:
+        regex = self.parse_not()
+        while self.next_is("&&"):
+            self.index += 2
+            regex = ActionAnd(self.action(regex, "&&"), self.action(self.parse_not(), "&&"))
+        return regex
+
+    def parse_not(self) -> Regex:
+        if self.peek() == "!":
+            self.index += 1
+            return ActionNot(self.action(self.parse_not(), "!"))
+        return self.parse_atom()
+
+    def parse_atom(self) -> Regex:
+        if self.peek() == "(":
+            self.index += 1
+            regex = self.parse_choice()
+            if self.peek() != ")":
+                raise ValueError(f"Missing ')' in regular expression '{self.regex_str}'")
+            self.index += 1
+            return regex
+        start = self.index
+        while self.index < len(self.regex_str) and \
+                self.regex_str[self.index] not in MODALITY_OPERATORS + "() ":
+            self.index += 1
+        label = self.regex_str[start:self.index]
+        if label == "":
+            raise ValueError(f"Missing label in regular expression '{self.regex_str}'")
+        return AnyLabel() if label == "true" else label
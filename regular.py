@@ -0,0 +1,273 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from itertools import count
+from typing import Sequence
+
+from graph import Graph
+import query
+import state_set as ss
+
+
+## Regular modalities <R>f and [R]f.
+##
+## R is compiled to an NFA without empty moves (Thompson's construction,
+## then closures) whose moves are action formulas. <R>f holds in s when a
+## path from s with a word of R ends in f, which is one backward search over
+## the product of the graph and the NFA: from (t, q) for t in f and q
+## accepting, over (p, q) whenever p has an edge to t with a label that a
+## move of q to the NFA state already reached matches. Every state of the
+## NFA reads every edge of its moves at most once, the edges of an action
+## formula are merged by the graph. [R]f is !<R>!f.
+##
+## The worklist and parity checkers build their own structure per
+## subformula and get the regular modalities as fixpoints instead, see
+## desugar.
+
+
+@dataclass
+class Nfa:
+    num_states: int
+    initial: int
+    accepting: list[bool]
+    # Per state (action formula, target)
+    moves: list[list[tuple[query.Action, int]]]
+
+
+def compile_regex(regex: query.Regex) -> Nfa:
+    # Thompson's construction: every part gets an entry and an exit state
+    empty_moves = []
+    label_moves = []
+
+    def new_state() -> int:
+        empty_moves.append([])
+        label_moves.append([])
+        return len(empty_moves) - 1
+
+    def build(regex: query.Regex) -> (int, int):
+        entry, exit = new_state(), new_state()
+        match regex:
+            case action if query.is_action(action):
+                label_moves[entry].append((action, exit))
+            case query.RegexSequence(left, right):
+                left_entry, left_exit = build(left)
+                right_entry, right_exit = build(right)
+                empty_moves[entry].append(left_entry)
+                empty_moves[left_exit].append(right_entry)
+                empty_moves[right_exit].append(exit)
+            case query.RegexChoice(left, right):
+                for part in (left, right):
+                    part_entry, part_exit = build(part)
+                    empty_moves[entry].append(part_entry)
+                    empty_moves[part_exit].append(exit)
+            case query.RegexRepeat(sub, at_least_once):
+                sub_entry, sub_exit = build(sub)
+                empty_moves[entry].append(sub_entry)
+                empty_moves[sub_exit].extend((sub_entry, exit))
+                if not at_least_once:
+                    empty_moves[entry].append(exit)
+            case _:
+                raise AssertionError
+        return entry, exit
+
+    initial, final = build(regex)
+    # Without empty moves, keeping the states reachable from initial
+    number = {initial: 0}
+    order = [initial]
+    accepting = []
+    moves = []
+    for q in order:
+        closure = {q}
+        stack = [q]
+        while len(stack) > 0:
+            for r in empty_moves[stack.pop()]:
+                if r not in closure:
+                    closure.add(r)
+                    stack.append(r)
+        accepting.append(final in closure)
+        state_moves = []
+        for p in closure:
+            for label, r in label_moves[p]:
+                if r not in number:
+                    number[r] = len(order)
+                    order.append(r)
+                state_moves.append((label, number[r]))
+        moves.append(state_moves)
+    return merge_equivalent(Nfa(len(order), 0, accepting, moves))
+
+
+def merge_equivalent(nfa: Nfa) -> Nfa:
+    """
+    Merges the states with the same moves into the same states, like
+    true* and true*.true* after the closures.
+    """
+    block = [int(a) for a in nfa.accepting]
+    while True:
+        signatures = dict()
+        refined = [signatures.setdefault((block[q], frozenset((label, block[r]) for label, r in nfa.moves[q])),
+                                         len(signatures))
+                   for q in range(nfa.num_states)]
+        if len(signatures) == len(set(block)):
+            break
+        block = refined
+    # Number the blocks in the order of the states, the initial one first
+    number = dict()
+    for b in refined:
+        number.setdefault(b, len(number))
+    moves = [None] * len(number)
+    accepting = [False] * len(number)
+    for q in range(nfa.num_states):
+        b = number[refined[q]]
+        if moves[b] is None:
+            moves[b] = sorted({(label, number[refined[r]]) for label, r in nfa.moves[q]},
+                              key=lambda move: (str(move[0]), move[1]))
+            accepting[b] = nfa.accepting[q]
+    return Nfa(len(number), number[refined[nfa.initial]], accepting, moves)
+
+
+def product_search(graph: Graph, nfa: Nfa, reverse: list[list[tuple[int, Sequence[int], Sequence[int]]]],
+                   target: bytes) -> bytearray:
+    """
+    The states with a path to a state of target whose word the NFA accepts.
+    reverse holds per NFA state the moves into it as (source state,
+    predecessor offsets, predecessor states) of one label.
+    """
+    n = graph.num_nodes
+    reached = [bytearray(n) for _ in range(nfa.num_states)]
+    work = []
+    for q in range(nfa.num_states):
+        if nfa.accepting[q]:
+            reached[q][:] = target
+            work.extend((q, t) for t in range(n) if target[t])
+    while len(work) > 0:
+        r, t = work.pop()
+        for q, offsets, sources in reverse[r]:
+            seen = reached[q]
+            for p in sources[offsets[t]:offsets[t + 1]]:
+                if not seen[p]:
+                    seen[p] = 1
+                    work.append((q, p))
+    return reached[nfa.initial]
+
+
+class RegularModalities:
+    "<R> and [R] for a graph and backend, with one NFA per regular expression"
+    def __init__(self, graph: Graph, sets: ss.Backend):
+        self.graph = graph
+        self.sets = sets
+        self.compiled = dict()
+
+    def get_nfa(self, regex: query.Regex) -> (Nfa, list):
+        if regex not in self.compiled:
+            nfa = compile_regex(regex)
+            graph = self.graph
+            reverse = [[] for _ in range(nfa.num_states)]
+            for q, state_moves in enumerate(nfa.moves):
+                for label, r in state_moves:
+                    l = graph.get_label_id(label)
+                    if l is not None:
+                        reverse[r].append((q, *graph.predecessors(l)))
+            self.compiled[regex] = (nfa, reverse)
+        return self.compiled[regex]
+
+    def diamond(self, regex: query.Regex, s: ss.StateSet) -> ss.StateSet:
+        nfa, reverse = self.get_nfa(regex)
+        return self.sets.from_membership(
+            product_search(self.graph, nfa, reverse, self.sets.membership(s)))
+
+    def box(self, regex: query.Regex, s: ss.StateSet) -> ss.StateSet:
+        nfa, reverse = self.get_nfa(regex)
+        outside = bytes(self.sets.membership(s)).translate(ss.FLIP)
+        return self.sets.from_membership(
+            product_search(self.graph, nfa, reverse, outside).translate(ss.FLIP))
+
+
+def has_regular_modalities(formula: query.Formula) -> bool:
+    return any(isinstance(f, (query.BoxFormula, query.DiamondFormula)) and not query.is_action(f.label)
+               for f in query.subformulas(formula))
+
+
+def bound_variables(formula: query.Formula) -> set[str]:
+    return {f.variable.name for f in query.subformulas(formula)
+            if isinstance(f, (query.MuFormula, query.NuFormula))}
+
+
+def desugar(formula: query.Formula) -> (query.Formula, set[str]):
+    """
+    formula with every regular modality replaced by modalities over action
+    formulas and fixpoints, and the variables of the new fixpoints. The NFA
+    is unfolded from its initial state, a move back to a state on the
+    current path becomes its variable: <a*.b>f = mu R1. (<a>R1 || <b>f).
+    Where a subformula is needed more than once (f for every accepting state
+    on the way, a state reached by several moves) it is copied with its
+    fixpoints renamed apart.
+    """
+    if not has_regular_modalities(formula):
+        return formula, set()
+    counter = count(1)
+    placed = set()
+
+    def fresh() -> str:
+        return f"R{next(counter)}"
+
+    def rename(f: query.Formula, names: dict[str, str]) -> query.Formula:
+        "A copy of f with fresh names for its fixpoints"
+        match f:
+            case query.RecursionVariable(name):
+                return query.RecursionVariable(names.get(name, name))
+            case query.LogicFormula(left, right, is_and):
+                return query.LogicFormula(rename(left, names), rename(right, names), is_and)
+            case query.BoxFormula(l, sub) | query.DiamondFormula(l, sub):
+                return type(f)(l, rename(sub, names))
+            case query.MuFormula(var, sub) | query.NuFormula(var, sub):
+                name = fresh()
+                return type(f)(query.RecursionVariable(name),
+                               rename(sub, {**names, var.name: name}))
+            case _:
+                return f
+
+    def place(f: query.Formula) -> query.Formula:
+        "f itself the first time, a copy after that"
+        if id(f) in placed:
+            return rename(f, {})
+        placed.add(id(f))
+        return f
+
+    def unfold(nfa: Nfa, q: int, is_box: bool, operand: query.Formula,
+               path: dict[int, str], used: set[str]) -> query.Formula:
+        name = fresh()
+        path = {**path, q: name}
+        terms = [place(operand)] if nfa.accepting[q] else []
+        for label, r in nfa.moves[q]:
+            if r in path:
+                used.add(path[r])
+                target = query.RecursionVariable(path[r])
+            else:
+                target = unfold(nfa, r, is_box, operand, path, used)
+            modality = query.BoxFormula if is_box else query.DiamondFormula
+            terms.append(modality(label, place(target)))
+        if len(terms) == 0:
+            return query.TrueLiteral() if is_box else query.FalseLiteral()
+        body = terms[0]
+        for term in terms[1:]:
+            body = query.LogicFormula(body, term, is_box)
+        if name not in used:
+            return body
+        binder = query.NuFormula if is_box else query.MuFormula
+        return binder(query.RecursionVariable(name), body)
+
+    def walk(f: query.Formula) -> query.Formula:
+        match f:
+            case query.LogicFormula(left, right, is_and):
+                return query.LogicFormula(walk(left), walk(right), is_and)
+            case query.BoxFormula(l, sub) | query.DiamondFormula(l, sub) if query.is_action(l):
+                return type(f)(l, walk(sub))
+            case query.BoxFormula(regex, sub) | query.DiamondFormula(regex, sub):
+                return unfold(compile_regex(regex), 0, isinstance(f, query.BoxFormula),
+                              walk(sub), {}, set())
+            case query.MuFormula(var, sub) | query.NuFormula(var, sub):
+                return type(f)(var, walk(sub))
+            case _:
+                return f
+
+    result = walk(formula)
+    return result, bound_variables(result) - bound_variables(formula)
@@ -0,0 +1,81 @@
+from __future__ import annotations
+import csv
+import json
+from typing import TextIO
+
+import checker_utils as cu
+
+## One record per (graph, query, algorithm), written by main.py --output
+## and read back by plot.py. Times are in nanoseconds.
+
+FIELDS = ["graph", "query", "algorithm", "formula", "parse_time_ns",
+          "load_time_ns", "solve_time_ns", "iterations", "satisfying_states",
+          "cache_hits", "cache_misses", "initial_state_holds", "decided_early",
+          "engine_reason", "budget_exceeded"]
+
+FORMATS = ["text", "json", "csv"]
+
+
+def make_record(graph: str, query: str, algorithm: str, formula: str,
+                parse_time_ns: int, load_time_ns: int, res: cu.CheckerOutput) -> dict:
+    "algorithm is replaced by the checker --engine auto chose, if any"
+    return {
+        "graph": graph,
+        "query": query,
+        "algorithm": algorithm if res.engine is None else res.engine,
+        "formula": formula,
+        "parse_time_ns": parse_time_ns,
+        "load_time_ns": load_time_ns,
+        "solve_time_ns": res.running_time_ns,
+        "iterations": dict(res.num_iter),
+        "satisfying_states": len(res.satisfied_states),
+        "cache_hits": res.cache_hits,
+        "cache_misses": res.cache_misses,
+        "initial_state_holds": res.initial_state_holds,
+        "decided_early": res.decided_early,
+        "engine_reason": res.engine_reason or "",
+        "budget_exceeded": res.budget_exceeded or "",
+    }
+
+
+def format_iterations(iterations: dict[str, int]) -> str:
+    return ";".join(f"{v}={n}" for v, n in iterations.items())
+
+
+def parse_iterations(text: str) -> dict[str, int]:
+    if text == "":
+        return {}
+    pairs = (item.split("=") for item in text.split(";"))
+    return {v: int(n) for v, n in pairs}
+
+
+def write_records(records: list[dict], output_format: str, out: TextIO):
+    if output_format == "json":
+        json.dump(records, out, indent=2)
+        out.write("\n")
+    elif output_format == "csv":
+        writer = csv.DictWriter(out, fieldnames=FIELDS)
+        writer.writeheader()
+        for record in records:
+            writer.writerow({**record, "iterations": format_iterations(record["iterations"])})
+    else:
+        raise ValueError(f"Unknown output format {output_format}")
+
+
+def read_records(filename: str) -> list[dict]:
+    "Reads records written by write_records, the format follows from the extension"
+    with open(filename, newline='') as results_file:
+        if not filename.endswith(".csv"):
+            return json.load(results_file)
+        records = []
+        for row in csv.DictReader(results_file):
+            for field in FIELDS:
+                if field.endswith("_ns") or field in ("satisfying_states", "cache_hits",
+                                                      "cache_misses"):
+                    row[field] = int(row[field])
+            row["iterations"] = parse_iterations(row["iterations"])
+            # csv writes None as an empty field
+            row["initial_state_holds"] = {"True": True, "False": False}.get(row["initial_state_holds"])
+            row["decided_early"] = row["decided_early"] == "True"
+            records.append(row)
+        return records
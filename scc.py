@@ -0,0 +1,239 @@
+from __future__ import annotations
+from array import array
+from itertools import chain
+from typing import Callable, Iterable, Iterator
+
+from graph import Graph, LabelKey, INDEX_TYPE
+import query
+import checker_utils as cu
+import state_set as ss
+from naive import NaiveChecker
+
+
+## SCC ordered evaluation of alternation-free fixpoints.
+##
+## In sigma X. f(X), where every fixpoint in f is closed, the value of X at a
+## state depends on X at the states reached along the paths of labels of the
+## modal operators above every occurrence of X in f, so only on the states it
+## reaches through edges with those labels. Along the strongly connected
+## components of that graph the fixpoint splits into one small fixpoint per
+## component: Tarjan's algorithm emits the components in reverse topological
+## order, so when a component is solved, all components it reaches already
+## have their final values.
+## Inside a component a worklist starts from empty (mu) or full (nu) and
+## evaluates f at single states. When the value of a state changes, the
+## states of the component that reach it along one of those paths are
+## evaluated again, so every component stabilises on its own, touching only
+## its own edges.
+
+
+def strongly_connected_components(graph: Graph, label_ids: Iterable[LabelKey]) -> (array, list[list[int]]):
+    """
+    Tarjan's algorithm without recursion on the edges of label_ids. Returns
+    the component of every state and the components (lists of states) in
+    reverse topological order: every edge goes to the same or an earlier one.
+    """
+    n = graph.num_nodes
+    relations = [graph.successors(l) for l in label_ids]
+
+    def successors(s: int) -> Iterator[int]:
+        return chain.from_iterable([targets[offsets[s]:offsets[s + 1]]
+                                    for offsets, targets in relations])
+
+    index = array(INDEX_TYPE, [-1]) * n
+    low = array(INDEX_TYPE, [0]) * n
+    component = array(INDEX_TYPE, [-1]) * n
+    components = []
+    stack = []
+    counter = 0
+    for root in range(n):
+        if index[root] >= 0:
+            continue
+        # (state, successors not yet visited)
+        work = [(root, successors(root))]
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        while len(work) > 0:
+            s, remaining = work[-1]
+            descended = False
+            for t in remaining:
+                if index[t] < 0:
+                    index[t] = low[t] = counter
+                    counter += 1
+                    stack.append(t)
+                    work.append((t, successors(t)))
+                    descended = True
+                    break
+                if component[t] < 0 and index[t] < low[s]:
+                    # t is still on the stack
+                    low[s] = index[t]
+            if descended:
+                continue
+            work.pop()
+            if len(work) > 0:
+                parent = work[-1][0]
+                if low[s] < low[parent]:
+                    low[parent] = low[s]
+            if low[s] == index[s]:
+                members = []
+                while True:
+                    t = stack.pop()
+                    component[t] = len(components)
+                    members.append(t)
+                    if t == s:
+                        break
+                components.append(members)
+    return component, components
+
+
+class SccChecker(NaiveChecker):
+    """
+    The Naive checker, except for fixpoints whose body contains only closed
+    fixpoints: those are solved per SCC (see above), and closed fixpoints
+    are solved once per query. Iterations of an SCC solved variable count
+    the states whose value changed.
+    """
+    def solve_formula(self, variables: set[str],
+                      formula: query.Formula) -> cu.CheckerOutput:
+        self.free_variables = dict()
+        find_free_variables(formula, self.free_variables)
+        self.closed_results = dict()
+        return super().solve_formula(variables, formula)
+
+    def solve(self, formula: query.Formula) -> ss.StateSet:
+        match formula:
+            case query.MuFormula(var, body) | query.NuFormula(var, body):
+                closed = len(self.free_variables[id(formula)]) == 0
+                if closed and id(formula) in self.closed_results:
+                    return self.closed_results[id(formula)]
+                if self.free_variables[id(body)] <= {var.name} and \
+                        self.decomposable(body, var.name):
+                    res = self.solve_by_scc(var.name, body, isinstance(formula, query.MuFormula))
+                else:
+                    res = super().solve(formula)
+                if closed:
+                    self.closed_results[id(formula)] = res
+                return res
+            case _:
+                return super().solve(formula)
+
+    def decomposable(self, body: query.Formula, name: str) -> bool:
+        """
+        Whether the nested fixpoints and regular modalities in body, which has
+        no free variables but name, are closed. Those are only solved as a
+        whole, and the outermost ones could only have name free.
+        """
+        for f in query.subformulas(body):
+            match f:
+                case query.BoxFormula(label, _) | query.DiamondFormula(label, _) \
+                        if query.is_action(label):
+                    pass
+                case query.MuFormula() | query.NuFormula() | query.BoxFormula() | query.DiamondFormula():
+                    if name in self.free_variables[id(f)]:
+                        return False
+        return True
+
+    def solve_by_scc(self, name: str, body: query.Formula, is_mu: bool) -> ss.StateSet:
+        n = self.graph.num_nodes
+        value = bytearray(n) if is_mu else bytearray(b'\x01') * n
+        paths = set()
+        evaluate = self.compile_body(body, name, value, (), paths)
+        component, components = strongly_connected_components(
+            self.graph, {l for path in paths for l in path})
+        # The states whose value depends on a state: its predecessors along
+        # every path of labels from the root of body to name, last label first
+        walks = [[self.graph.predecessors(l) for l in reversed(path)]
+                 for path in paths]
+        changes = 0
+        queued = bytearray(n)
+        for c, members in enumerate(components):
+            work = list(members)
+            for s in work:
+                queued[s] = 1
+            while len(work) > 0:
+                s = work.pop()
+                queued[s] = 0
+                new = evaluate(s)
+                if new == value[s]:
+                    continue
+                value[s] = new
+                changes += 1
+                for walk in walks:
+                    if len(walk) == 1:
+                        offsets, sources = walk[0]
+                        dependents = sources[offsets[s]:offsets[s + 1]]
+                    else:
+                        # States between them are in the component as well
+                        dependents = [s]
+                        for offsets, sources in walk:
+                            dependents = {p for t in dependents
+                                          for p in sources[offsets[t]:offsets[t + 1]]
+                                          if component[p] == c}
+                    for p in dependents:
+                        if component[p] == c and not queued[p]:
+                            queued[p] = 1
+                            work.append(p)
+        self.iter_count[name] += changes
+        return self.sets.from_membership(value)
+
+    def compile_body(self, formula: query.Formula, name: str, value: bytearray,
+                     path: tuple[int, ...], paths: set[tuple[int, ...]]) -> Callable[[int], bool]:
+        """
+        A function that evaluates formula at one state, with the current
+        value of name. path holds the label ids of the modal operators above
+        formula, paths receives it for every occurrence of name.
+        Subformulas without name are solved as a whole, once.
+        """
+        if name not in self.free_variables[id(formula)]:
+            membership = self.sets.membership(self.solve(formula))
+            return membership.__getitem__
+        match formula:
+            case query.RecursionVariable(_):
+                paths.add(path)
+                return value.__getitem__
+            case query.LogicFormula(left, right, is_and):
+                left = self.compile_body(left, name, value, path, paths)
+                right = self.compile_body(right, name, value, path, paths)
+                if is_and:
+                    return lambda s: left(s) and right(s)
+                return lambda s: left(s) or right(s)
+            case query.BoxFormula(label, sub) | query.DiamondFormula(label, sub):
+                is_box = isinstance(formula, query.BoxFormula)
+                l = self.graph.get_label_id(label)
+                if l is None:
+                    return lambda s: is_box
+                sub = self.compile_body(sub, name, value, path + (l,), paths)
+                offsets, targets = self.graph.successors(l)
+                if is_box:
+                    return lambda s: all(sub(t) for t in targets[offsets[s]:offsets[s + 1]])
+                return lambda s: any(sub(t) for t in targets[offsets[s]:offsets[s + 1]])
+            case _:
+                raise AssertionError
+
+
+def find_free_variables(formula: query.Formula, free: dict[int, frozenset[str]]):
+    "Stores the free variables of every subformula under its id, without recursion"
+    stack = [(formula, False)]
+    while len(stack) > 0:
+        f, done = stack.pop()
+        match f:
+            case query.RecursionVariable(name):
+                free[id(f)] = frozenset([name])
+            case query.TrueLiteral() | query.FalseLiteral():
+                free[id(f)] = frozenset()
+            case query.LogicFormula(left, right, _):
+                if done:
+                    free[id(f)] = free[id(left)] | free[id(right)]
+                else:
+                    stack.extend(((f, True), (left, False), (right, False)))
+            case query.BoxFormula(_, sub) | query.DiamondFormula(_, sub):
+                if done:
+                    free[id(f)] = free[id(sub)]
+                else:
+                    stack.extend(((f, True), (sub, False)))
+            case query.MuFormula(var, sub) | query.NuFormula(var, sub):
+                if done:
+                    free[id(f)] = free[id(sub)] - {var.name}
+                else:
+                    stack.extend(((f, True), (sub, False)))
@@ -0,0 +1,134 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Callable
+
+from graph import Graph
+import query
+import checker_utils as cu
+import fixpoint_tree as ft
+from depths import ComputeDepths
+
+
+## Per query choice of the checker for --engine auto.
+##
+## Measured on the Experiments (dining_7, german_linear_3.1,
+## demanding_children_9) the worklist checker is the fastest for every query,
+## all of which have a dependent alternation depth of at most 2: 3-20x faster
+## than Emerson-Lei. From dependent alternation depth 3 on its restarts of
+## nested fixpoints multiply, on generated formulas over 3000 random states
+## (depth 3 and 4) it takes 5.6s and 6.4s where the parity checker needs 0.4s
+## and 0.5s. The parity game has a vertex per state and subformula, so
+## it is only used while that stays below PARITY_MAX_VERTICES.
+
+# Dependent alternation depth from which the parity checker is used
+PARITY_DEPTH = 3
+PARITY_MAX_VERTICES = 20_000_000
+
+
+@dataclass
+class Analysis:
+    num_states: int
+    num_subformulas: int
+    num_fixpoints: int
+    # Both None when the formula is nested too deep for the recursive
+    # analysis, or binds a variable more than once
+    alternation_depth: int | None
+    dependent_alternation_depth: int | None
+    # Mu variable -> variables Emerson-Lei resets when it is entered
+    resets: dict[str, list[str]]
+    # Fixpoints below the root without free variables
+    closed_fixpoints: int
+    # Variables bound by more than one fixpoint, the analysis tells
+    # fixpoints apart by their variable
+    rebound: list[str] = field(default_factory=list)
+
+
+def count_subformulas(formula: query.Formula) -> (int, int, list[str]):
+    "The number of subformulas, of fixpoints among them and the variables bound more than once"
+    subformulas, fixpoints = 0, 0
+    bound, rebound = set(), set()
+    for f in query.subformulas(formula):
+        subformulas += 1
+        if isinstance(f, (query.MuFormula, query.NuFormula)):
+            fixpoints += 1
+            (rebound if f.variable.name in bound else bound).add(f.variable.name)
+    return subformulas, fixpoints, sorted(rebound)
+
+
+def analyse(formula: query.Formula, graph: Graph) -> Analysis:
+    num_subformulas, num_fixpoints, rebound = count_subformulas(formula)
+    if len(rebound) > 0:
+        return Analysis(graph.num_nodes, num_subformulas, num_fixpoints, None, None, dict(), 0, rebound)
+    try:
+        return analyse_fixpoints(formula, graph, num_subformulas, num_fixpoints)
+    except RecursionError:
+        # fixpoint_tree and depths recurse along the formula
+        return Analysis(graph.num_nodes, num_subformulas, num_fixpoints, None, None, dict(), 0)
+
+
+def analyse_fixpoints(formula: query.Formula, graph: Graph,
+                      num_subformulas: int, num_fixpoints: int) -> Analysis:
+    tree = ft.create_tree(formula)
+    if tree is None:
+        # No fixpoints
+        return Analysis(graph.num_nodes, num_subformulas, num_fixpoints, 0, 0, dict(), 0)
+    depths = ComputeDepths(formula, tree)
+    creator = ft.ResetRelationCreator(tree, ft.create_fixpoint_to_type_relation(tree))
+    resets = {v: r for v, r in creator.find_relation(formula).items() if len(r) > 0}
+    closed = 0
+    for f in query.subformulas(formula):
+        match f:
+            case query.MuFormula(var, sub) | query.NuFormula(var, sub):
+                if f is not formula and len(creator.find_open_variables(sub, {var.name})) == 0:
+                    closed += 1
+    return Analysis(graph.num_nodes, num_subformulas, num_fixpoints, depths.alternate(),
+                    depths.d_alternate(), resets, closed)
+
+
+def choose(analysis: Analysis) -> (str, str):
+    "The name of the checker for a query (as main.get_checker_name), and why"
+    a = analysis
+    if len(a.rebound) > 0:
+        # Its slots belong to fixpoints, not variable names
+        return "Compiled", (f"{','.join(a.rebound)} bound by more than one fixpoint, which the analysis "
+                            f"cannot tell apart, the compiled checker needs no analysis")
+    if a.alternation_depth is None:
+        # All other checkers recurse along the formula as well
+        return "Compiled", (f"{a.num_subformulas} subformulas nested too deep for the recursive "
+                            f"analysis, the compiled checker runs without recursion")
+    if a.num_fixpoints == 0:
+        return "Naive", "no fixpoints, one pass over the formula without any setup"
+    facts = (f"{a.num_states} states, {a.num_fixpoints} fixpoints, alternation depth "
+             f"{a.alternation_depth}, dependent {a.dependent_alternation_depth}, "
+             f"{'resets of ' + ','.join(sorted(a.resets)) if len(a.resets) > 0 else 'no resets'}, "
+             f"{a.closed_fixpoints} closed nested fixpoints")
+    if a.dependent_alternation_depth >= PARITY_DEPTH:
+        vertices = a.num_states * a.num_subformulas
+        if vertices <= PARITY_MAX_VERTICES:
+            return "Parity", (f"{facts}: dependent alternation depth >= {PARITY_DEPTH}, "
+                              f"Zielonka on a game of about {vertices} vertices")
+        return "Worklist", (f"{facts}: dependent alternation depth >= {PARITY_DEPTH}, "
+                            f"but a parity game of about {vertices} vertices is too large")
+    return "Worklist", (f"{facts}: dependent alternation depth below {PARITY_DEPTH}, "
+                        f"every fixpoint is O(E) per evaluation")
+
+
+class AutoChecker:
+    """
+    Chooses the checker for every query with choose, make_checker(name)
+    builds a checker of that name for graph the first time it is needed.
+    """
+    def __init__(self, graph: Graph, make_checker: Callable[[str], object]):
+        self.graph = graph
+        self.make_checker = make_checker
+        self.checkers = dict()
+
+    def solve_formula(self, variables: set[str],
+                      formula: query.Formula) -> cu.CheckerOutput:
+        name, reason = choose(analyse(formula, self.graph))
+        if name not in self.checkers:
+            self.checkers[name] = self.make_checker(name)
+        res = self.checkers[name].solve_formula(variables, formula)
+        res.engine = name
+        res.engine_reason = reason
+        return res
@@ -0,0 +1,208 @@
+from __future__ import annotations
+from typing import Iterable, TypeAlias, Union
+
+import bdd
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for the "numpy" backend
+    np = None
+
+
+## A backend decides how a set of states is represented while checking.
+## The checkers never touch the representation directly, they only go through
+## these methods. Values are never modified in place, so results can be shared
+## between variables without copying.
+##
+## membership(s) returns a bytes-like object m with m[i] == 1 iff state i is
+## in s, from_membership does the opposite. This is what the modal operators use.
+
+# Maps the characters produced by format(x, 'b') to 0/1 bytes and back
+_BIN_TO_BYTES = bytes.maketrans(b'01', b'\x00\x01')
+_BYTES_TO_BIN = bytes.maketrans(b'\x00\x01', b'01')
+# Swaps the 0 and 1 bytes of a membership, m.translate(FLIP) is the complement
+FLIP = bytes.maketrans(b'\x00\x01', b'\x01\x00')
+
+
+class PySetBackend:
+    "The original representation, a python set of state numbers"
+    name = "set"
+
+    def __init__(self, num_nodes: int):
+        self.num_nodes = num_nodes
+
+    def empty(self) -> set[int]:
+        return set()
+
+    def full(self) -> set[int]:
+        return set(range(0, self.num_nodes))
+
+    def union(self, a: set[int], b: set[int]) -> set[int]:
+        return a.union(b)
+
+    def intersection(self, a: set[int], b: set[int]) -> set[int]:
+        return a.intersection(b)
+
+    def equals(self, a: set[int], b: set[int]) -> bool:
+        return a == b
+
+    def is_subset(self, a: set[int], b: set[int]) -> bool:
+        return a <= b
+
+    def contains(self, a: set[int], i: int) -> bool:
+        return i in a
+
+    def is_empty(self, a: set[int]) -> bool:
+        return len(a) == 0
+
+    def count(self, a: set[int]) -> int:
+        return len(a)
+
+    def from_iterable(self, states: Iterable[int]) -> set[int]:
+        return set(states)
+
+    def to_set(self, a: set[int]) -> set[int]:
+        return a
+
+    def membership(self, a: set[int]) -> bytes:
+        m = bytearray(self.num_nodes)
+        for i in a:
+            m[i] = 1
+        return m
+
+    def from_membership(self, m: bytes) -> set[int]:
+        return {i for i, b in enumerate(m) if b}
+
+
+class BitmaskBackend:
+    "Bit i of a python int is set iff state i is in the set"
+    name = "bitmask"
+
+    def __init__(self, num_nodes: int):
+        self.num_nodes = num_nodes
+        self._full = (1 << num_nodes) - 1
+
+    def empty(self) -> int:
+        return 0
+
+    def full(self) -> int:
+        return self._full
+
+    def union(self, a: int, b: int) -> int:
+        return a | b
+
+    def intersection(self, a: int, b: int) -> int:
+        return a & b
+
+    def equals(self, a: int, b: int) -> bool:
+        return a == b
+
+    def is_subset(self, a: int, b: int) -> bool:
+        return a & b == a
+
+    def contains(self, a: int, i: int) -> bool:
+        return (a >> i) & 1 == 1
+
+    def is_empty(self, a: int) -> bool:
+        return a == 0
+
+    def count(self, a: int) -> int:
+        return a.bit_count()
+
+    def from_iterable(self, states: Iterable[int]) -> int:
+        m = bytearray(self.num_nodes)
+        for i in states:
+            m[i] = 1
+        return self.from_membership(m)
+
+    def to_set(self, a: int) -> set[int]:
+        m = self.membership(a)
+        return {i for i in range(self.num_nodes) if m[i]}
+
+    def membership(self, a: int) -> bytes:
+        if self.num_nodes == 0:
+            return b''
+        # Least significant bit ends up at index 0
+        bits = format(a, f'0{self.num_nodes}b')[::-1]
+        return bits.encode().translate(_BIN_TO_BYTES)
+
+    def from_membership(self, m: bytes) -> int:
+        if len(m) == 0:
+            return 0
+        return int(bytes(m).translate(_BYTES_TO_BIN)[::-1], 2)
+
+
+class NumpyBackend:
+    "A numpy bool array of length num_nodes"
+    name = "numpy"
+
+    def __init__(self, num_nodes: int):
+        if np is None:
+            raise ImportError("The numpy backend requires numpy to be installed")
+        self.num_nodes = num_nodes
+
+    def empty(self):
+        return np.zeros(self.num_nodes, dtype=np.bool_)
+
+    def full(self):
+        return np.ones(self.num_nodes, dtype=np.bool_)
+
+    def union(self, a, b):
+        return np.logical_or(a, b)
+
+    def intersection(self, a, b):
+        return np.logical_and(a, b)
+
+    def equals(self, a, b) -> bool:
+        return np.array_equal(a, b)
+
+    def is_subset(self, a, b) -> bool:
+        return not np.logical_and(a, np.logical_not(b)).any()
+
+    def contains(self, a, i: int) -> bool:
+        return bool(a[i])
+
+    def is_empty(self, a) -> bool:
+        return not a.any()
+
+    def count(self, a) -> int:
+        return int(np.count_nonzero(a))
+
+    def from_iterable(self, states: Iterable[int]):
+        a = self.empty()
+        a[np.fromiter(states, dtype=np.int64)] = True
+        return a
+
+    def to_set(self, a) -> set[int]:
+        return set(np.flatnonzero(a).tolist())
+
+    def membership(self, a) -> bytes:
+        return a.tobytes()
+
+    def from_membership(self, m: bytes):
+        return np.frombuffer(bytes(m), dtype=np.bool_).copy()
+
+
+StateSet: TypeAlias = Union[set[int], int, "np.ndarray"]
+
+Backend = PySetBackend | BitmaskBackend | NumpyBackend | bdd.BddBackend
+
+BACKENDS = {
+    "set": PySetBackend,
+    "bitmask": BitmaskBackend,
+    "numpy": NumpyBackend,
+    "bdd": bdd.BddBackend,
+}
+
+DEFAULT_BACKEND = "bitmask"
+
+
+def create_backend(name: str, num_nodes: int) -> Backend:
+    "name is a key of BACKENDS, for bdd optionally followed by :ordering"
+    name, _, option = name.partition(":")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown state set backend {name}, "
+                         f"expected one of {', '.join(BACKENDS)}")
+    if name == "bdd" and option != "":
+        return bdd.BddBackend(num_nodes, option)
+    return BACKENDS[name](num_nodes)
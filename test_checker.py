@@ -1,12 +1,67 @@
+import io
+import os
+import sys
+import tempfile
 import unittest
+from contextlib import redirect_stderr
+from unittest import mock
 import query
 import fixpoint_tree as ft
+import aut_reader
+import formula_dag
+import main
+import results as rs
+import graph_cache
+import benchmark
+import profiler
+import budget
+import local
+import bisim
 
 from graph import Graph
 from naive import NaiveChecker
+from emerson import EmersonChecker
+from worklist import WorklistChecker
+from compiler import CompiledChecker
+from parity import ParityChecker
+from scc import SccChecker
+import parity
+import selector
+import scc
+import patterns
+import regular
+import compiler
+import state_set as ss
+import modal as md
+
+# numpy is optional, the numpy backend is only tested where it is installed
+BACKENDS = [name for name in ss.BACKENDS if name != "numpy" or ss.np is not None]
+TESTCASES = ("boolean", "combined", "fixpoints_only", "modal_operators")
 
 
 class SanityTest(unittest.TestCase):
+    def check_testcases(self, make_checker, cases=TESTCASES):
+        """
+        Solves every query of the testcases with the checker make_checker(graph) returns and
+        compares it with the Naive checker. Returns the (result, expected) pairs for the
+        assertions only one engine makes.
+        """
+        outputs = []
+        for case in cases:
+            g = Graph.from_file(f"./testcases/{case}/test.aut")
+            checker = make_checker(g)
+            for i in range(1, 10):
+                path = f"./testcases/{case}/form{i}.mcf"
+                if not os.path.exists(path):
+                    continue
+                formula, variables, _ = query.parse_query(path)
+                expected = NaiveChecker(g, "set", "scalar").solve_formula(variables, formula)
+                res = checker.solve_formula(variables, formula)
+                self.assertSetEqual(res.satisfied_states, expected.satisfied_states, path)
+                self.assertEqual(res.initial_state_holds, expected.initial_state_holds, path)
+                outputs.append((res, expected))
+        return outputs
+
     def test_basic(self):
         g = Graph.from_file("./testcases/boolean/test.aut")
         q = query.TrueLiteral()
@@ -89,3 +144,544 @@ class SanityTest(unittest.TestCase):
         rc = ft.ResetRelationCreator(tree, type_relation)
         print(rc.find_relation(res))
 
+
+    def test_backends_agree(self):
+        for backend in [b for b in ("bitmask", "numpy") if b in BACKENDS]:
+            for backend_checker in (NaiveChecker, EmersonChecker):
+                self.check_testcases(lambda g: backend_checker(g, backend), ["combined"])
+
+    def test_bdd_backend(self):
+        for backend in ("bdd", "bdd:sequential", "bdd:reversed"):
+            for backend_checker in (NaiveChecker, EmersonChecker):
+                self.check_testcases(lambda g: backend_checker(g, backend, "symbolic"), ["combined"])
+        g = Graph.from_file("./testcases/combined/test.aut")
+        sets = ss.create_backend("bdd", 11)
+        a = sets.from_iterable([0, 3, 9, 10])
+        self.assertEqual(sets.count(a), 4)
+        self.assertEqual(sets.count(sets.full()), 11)
+        self.assertTrue(sets.contains(a, 9) and not sets.contains(a, 4))
+        self.assertEqual(sets.from_membership(sets.membership(a)), a)
+        # Everything not referenced any more is collected, a keeps its nodes
+        for s in range(11):
+            sets.union(a, sets.from_iterable([s]))
+        sets.manager.collect()
+        self.assertSetEqual(sets.to_set(a), {0, 3, 9, 10})
+        self.assertGreater(len(sets.manager.free), 0)
+        with self.assertRaises(ValueError):
+            md.SymbolicModalEngine(g, ss.BitmaskBackend(g.num_nodes))
+        with self.assertRaises(ValueError):
+            ss.create_backend("bdd:random", 11)
+
+    def test_projection(self):
+        g = Graph.from_file("./testcases/combined/test.aut")
+        formula, variables, _ = query.parse_query("./testcases/combined/form1.mcf")
+        labels = query.collect_labels(formula)
+        projected = g.project(labels | {"missing"})
+        self.assertSetEqual(set(projected.labels), labels & set(g.labels))
+        self.assertIs(projected.succ_targets[0], g.succ_targets[g.get_label_id(projected.labels[0])])
+        expected = NaiveChecker(g).solve_formula(variables, formula)
+        res = NaiveChecker(projected).solve_formula(variables, formula)
+        self.assertSetEqual(res.satisfied_states, expected.satisfied_states)
+        l = g.get_label_id(g.labels[0])
+        self.assertListEqual(list(g.has_successor(l)),
+                             [int(len(g.get_outgoing(s, g.labels[0])) > 0) for s in range(g.num_nodes)])
+
+    def test_predecessor_engine(self):
+        for backend in ("set", "bitmask"):
+            self.check_testcases(lambda g: EmersonChecker(g, backend, "predecessor"))
+        # Both directions: few states in S use the predecessors, many the successors
+        g = Graph.from_edges(4, {"a": ([0, 1, 2], [1, 2, 3])})
+        sets = ss.PySetBackend(4)
+        engine = md.PredecessorModalEngine(g, sets)
+        self.assertSetEqual(engine.diamond("a", {3}), {2})
+        self.assertSetEqual(engine.diamond("a", {1, 2, 3}), {0, 1, 2})
+        self.assertSetEqual(engine.box("a", {0, 1, 2}), {0, 1, 3})
+        self.assertSetEqual(engine.box("a", {3}), {2, 3})
+
+    def test_bitmask_membership(self):
+        sets = ss.BitmaskBackend(10)
+        s = sets.from_iterable([0, 3, 9])
+        self.assertEqual(s, 0b1000001001)
+        self.assertEqual(sets.membership(s)[3], 1)
+        self.assertEqual(sets.from_membership(sets.membership(s)), s)
+        self.assertSetEqual(sets.to_set(s), {0, 3, 9})
+
+    def test_graph_csr(self):
+        g = Graph.from_file("./testcases/modal_operators/test.aut")
+        num_labels = len(g.labels)
+        for src, label, dest in g.edges():
+            self.assertIn(dest, g.get_outgoing(src, label))
+            self.assertIn(src, g.get_incoming(dest, label))
+        self.assertEqual(len(g.get_outgoing(0, "missing")), 0)
+        self.assertEqual(len(g.labels), num_labels)
+        adjacency = g.adjacency_dict
+        self.assertEqual(sum(len(v) for v in adjacency.values()), g.num_edges)
+
+    @unittest.skipUnless(md.np is not None, "the vector modal engine requires numpy")
+    def test_vector_modal_engine(self):
+        for backend in ss.BACKENDS:
+            self.check_testcases(lambda g: EmersonChecker(g, backend, "vector"), ["modal_operators"])
+        g = Graph.from_file("./testcases/modal_operators/test.aut")
+        sets = ss.BitmaskBackend(g.num_nodes)
+        engine = md.VectorModalEngine(g, sets)
+        self.assertEqual(engine.box("missing", sets.empty()), sets.full())
+        self.assertEqual(engine.diamond("missing", sets.full()), sets.empty())
+
+    def test_aut_reader(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "g.aut")
+            with open(path, "w") as f:
+                f.write('des (0,3,3)\n(0,"a",1)\n(1,"b c",2)\n\n(2,"a",0)\n')
+            header, edges = aut_reader.read_aut(path)
+            self.assertEqual(header.num_nodes, 3)
+            self.assertListEqual(list(edges["b c"][1]), [2])
+            with open(path, "w") as f:
+                f.write('des (0,3,3)\n(0,"a",1)\n(1,"a"2)\n(2,"a",0)\n')
+            with self.assertRaises(aut_reader.AutFormatError) as error:
+                aut_reader.read_aut(path)
+            self.assertEqual(error.exception.line_number, 3)
+            # A line around an edge, and an edge count that does not match the header
+            for text, line_number in (('des (0,3,3)\n(0,"a",1)\njunk(1,"b",2)\n(2,"a",0)\n', 3),
+                                      ('des (0,3,3)\n(0,"a",1)\n(2,"a",0)\n', 1)):
+                with open(path, "w") as f:
+                    f.write(text)
+                with self.assertRaises(aut_reader.AutFormatError) as error:
+                    aut_reader.read_aut(path)
+                self.assertEqual(error.exception.line_number, line_number)
+
+    def test_graph_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "g.aut")
+            with open("./testcases/combined/test.aut") as source, open(path, "w") as f:
+                f.write(source.read())
+            self.assertIsNone(graph_cache.read_cache(path))
+            g = Graph.load(path)
+            cached = Graph(*graph_cache.read_cache(path))
+            self.assertListEqual(list(cached.edges()), list(g.edges()))
+            self.assertEqual(cached.initial_state, g.initial_state)
+            # Touching the source invalidates the sidecar
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            self.assertIsNone(graph_cache.read_cache(path))
+            self.assertIsNotNone(graph_cache.read_cache(path, validate="hash"))
+            # A truncated sidecar is rebuilt
+            with open(graph_cache.cache_path(path), "rb") as f:
+                data = f.read()
+            for size in range(graph_cache.HEADER.size, len(data), 7):
+                with open(graph_cache.cache_path(path), "wb") as f:
+                    f.write(data[:size])
+                self.assertIsNone(graph_cache.read_cache(path, validate="hash"))
+            self.assertListEqual(list(Graph.load(path, validate="hash").edges()), list(g.edges()))
+            self.assertIsNotNone(graph_cache.read_cache(path, validate="hash"))
+
+    def test_worklist_checker(self):
+        for res, expected in self.check_testcases(WorklistChecker):
+            self.assertSetEqual(set(res.num_iter), set(expected.num_iter))
+
+    def test_compiled_checker(self):
+        for backend in BACKENDS:
+            self.check_testcases(lambda g: CompiledChecker(g, backend))
+        # The inner nu starts from full again whenever X grew
+        g = Graph.from_file("./testcases/combined/test.aut")
+        formula = query.Parser("mu X. nu Y. ([a]X && Y)").parse()
+        expected = NaiveChecker(g).solve_formula({"X", "Y"}, formula)
+        res = CompiledChecker(g).solve_formula({"X", "Y"}, formula)
+        self.assertSetEqual(res.satisfied_states, expected.satisfied_states)
+        program = compiler.compile_formula(formula)
+        self.assertListEqual([i.op for i in program.instructions],
+                             ["RESET", "BOX", "AND", "LOOP", "LOOP"])
+
+    def test_parity_checker(self):
+        self.check_testcases(ParityChecker)
+        g = Graph.from_file("./testcases/combined/test.aut")
+        formula = query.Parser("mu X. nu Y. ([a]X && Y)").parse()
+        expected = NaiveChecker(g).solve_formula({"X", "Y"}, formula)
+        self.assertSetEqual(ParityChecker(g).solve_formula({"X", "Y"}, formula).satisfied_states,
+                            expected.satisfied_states)
+        self.assertEqual(parity.alternation_depth(formula), 2)
+        self.assertEqual(parity.alternation_depth(query.Parser("<a>true").parse()), 0)
+        # Only the second query goes to the parity checker
+        used = []
+        naive = NaiveChecker(g)
+        naive.solve = lambda f, solve=naive.solve: used.append("naive") or solve(f)
+        switch = parity.AlternationSwitch(naive, ParityChecker(g), 1)
+        switch.solve_formula({"X"}, query.Parser("mu X. <a>X").parse())
+        self.assertGreater(len(used), 0)
+        calls = len(used)
+        switch.solve_formula({"X", "Y"}, formula)
+        self.assertEqual(len(used), calls)
+        # Too deep to tell, the compiled checker takes it
+        deep = query.Parser("mu X. " + "<a>" * 3000 + "X").parse()
+        self.assertIsNone(parity.alternation_depth(deep))
+        switch = parity.AlternationSwitch(CompiledChecker(g), ParityChecker(g), 1)
+        self.assertSetEqual(switch.solve_formula({"X"}, deep).satisfied_states, set())
+
+    def test_scc_checker(self):
+        g = Graph.from_edges(3, {"a": ([0, 1, 1], [1, 0, 2]), "b": ([2], [0])})
+        component, components = scc.strongly_connected_components(g, [g.get_label_id("a")])
+        self.assertEqual([sorted(c) for c in components], [[2], [0, 1]])
+        self.assertEqual(component[0], component[1])
+        _, components = scc.strongly_connected_components(g, [g.get_label_id("a"), g.get_label_id("b")])
+        self.assertEqual(len(components), 1)
+        self.check_testcases(SccChecker)
+        # X depends on states two steps away
+        g = Graph.from_edges(4, {"a": ([0, 2], [1, 3]), "b": ([1, 3], [2, 0])})
+        formula = query.Parser("mu X. (<a><b>X || [a]false)").parse()
+        expected = NaiveChecker(g).solve_formula({"X"}, formula)
+        self.assertSetEqual(SccChecker(g).solve_formula({"X"}, formula).satisfied_states,
+                            expected.satisfied_states)
+
+    def test_pattern_kernels(self):
+        shapes = {
+            "mu Y. (<a>Y || <b>true)": patterns.Flat,
+            "nu X. ([a]X && [b]X)": patterns.Flat,
+            "nu X. <a>X": patterns.Flat,
+            "mu Y. ([a]Y && <b>true)": patterns.Flat,
+            "nu X. mu Y. (<a>X || <b>Y)": patterns.Fair,
+            "mu X. nu Y. ([a]X && [b]Y)": patterns.Fair,
+            "mu X. nu Y. ([a]X && <b>Y)": None,
+            "mu Y. (<a>Y && <b>Y)": patterns.Flat,
+            "mu Y. <a>(Y && true)": None,
+        }
+        g = Graph.from_file("./testcases/combined/test.aut")
+        for text, shape in shapes.items():
+            formula = query.Parser(text).parse()
+            found = patterns.recognise(formula).get(id(formula))
+            self.assertIs(type(found) if found is not None else None, shape, text)
+            variables = set(ft.create_fixpoint_to_type_relation(ft.create_tree(formula)))
+            expected = NaiveChecker(g).solve_formula(variables, formula)
+            res = patterns.PatternChecker(g).solve_formula(variables, formula)
+            self.assertSetEqual(res.satisfied_states, expected.satisfied_states, text)
+        self.check_testcases(patterns.PatternChecker)
+        # An a-cycle through 1 and 2, 0 only reaches it, 3 has no a-successor
+        g = Graph.from_edges(4, {"a": ([0, 1, 2], [1, 2, 1])})
+        fair = patterns.fair_states(g, None, ["a"], [])
+        self.assertListEqual(list(fair), [1, 1, 1, 0])
+
+    def test_regular_modalities(self):
+        formula = query.Parser("[true*.a]<(a|b)+.c>true").parse()
+        self.assertEqual(formula.label, query.RegexSequence(query.RegexRepeat(query.AnyLabel(), False), "a"))
+        self.assertEqual(query.Parser("<a>true").parse().label, "a")
+        self.assertIsNone(query.collect_labels(formula))
+        self.assertSetEqual(query.collect_labels(formula.formula), {"a", "b", "c"})
+        with self.assertRaises(ValueError):
+            query.Parser("<a.(b>true").parse()
+        nfa = regular.compile_regex(formula.formula.label)
+        self.assertEqual(nfa.num_states, 3)
+        # a path a.b.a from 0 to 3, c from 3 to 4
+        g = Graph.from_edges(5, {"a": ([0, 2], [1, 3]), "b": ([1], [2]), "c": ([3], [4])})
+        cases = {
+            "<a.b.a>true": {0},
+            "<(a|b)*.c>true": {0, 1, 2, 3},
+            "<(a|b)+>[c]false": {0, 1},
+            "[true*]<true*.c>true": set(),
+            "[a.b]<a>true": {0, 1, 2, 3, 4},
+            "[true+]false": {4},
+            "nu X. <a.b>X": set(),
+            "mu X. ([true]false || <a.b.a>X)": {4},
+            "mu X. ([true]false || <a.b.a.c>X)": {0, 4},
+        }
+        for text, expected in cases.items():
+            formula = query.Parser(text).parse()
+            variables = set(ft.create_fixpoint_to_type_relation(ft.create_tree(formula)))
+            for checker in (NaiveChecker(g), EmersonChecker(g), WorklistChecker(g), CompiledChecker(g),
+                            ParityChecker(g), SccChecker(g), patterns.PatternChecker(g)):
+                res = checker.solve_formula(variables, formula)
+                self.assertSetEqual(res.satisfied_states, expected, f"{text} {type(checker).__name__}")
+            desugared, added = regular.desugar(formula)
+            self.assertFalse(regular.has_regular_modalities(desugared))
+            res = NaiveChecker(g).solve_formula(variables | added, desugared)
+            self.assertSetEqual(res.satisfied_states, expected, text)
+
+    def test_action_formulas(self):
+        formula = query.Parser("<!(a||b)&&true>[(a||c).b*]false").parse()
+        self.assertEqual(formula.label, query.ActionAnd(query.ActionNot(query.ActionOr("a", "b")),
+                                                        query.AnyLabel()))
+        self.assertEqual(formula.formula.label.left, query.ActionOr("a", "c"))
+        self.assertIsNone(query.collect_labels(formula))
+        self.assertSetEqual(query.collect_labels(formula.formula), {"a", "b", "c"})
+        for text in ("<!(a.b)>true", "<(a|b)&&c>true", "<a&b>true"):
+            with self.assertRaises(ValueError):
+                query.Parser(text).parse()
+        g = Graph.from_edges(4, {"a": ([0, 1], [1, 2]), "b": ([0], [2]), "c": ([2], [3])})
+        # One merged key per label set, shared by the action formulas that match it
+        l = g.get_label_id(query.ActionNot("c"))
+        self.assertEqual(l, g.get_label_id(query.ActionOr("b", "a")))
+        self.assertEqual(l, g.label_set_id(["a", "b", "d"]))
+        self.assertEqual(g.get_label_id(query.ActionAnd("a", query.AnyLabel())), g.get_label_id("a"))
+        self.assertIsNone(g.get_label_id(query.ActionAnd("a", "b")))
+        offsets, targets = g.successors(l)
+        self.assertEqual(list(targets[offsets[0]:offsets[1]]), [1, 2])
+        offsets, sources = g.predecessors(l)
+        self.assertEqual(list(sources[offsets[2]:offsets[3]]), [1, 0])
+        # The per label arrays are left alone
+        self.assertEqual(len(g.succ_offsets), len(g.labels))
+        self.assertEqual(len(g.merged), 1)
+        self.assertEqual(g.num_edges, 4)
+        cases = {
+            "<!c>true": {0, 1},
+            "[!a]false": {1, 3},
+            "<a&&b>true": set(),
+            "[a||b]<c>true": {1, 2, 3},
+            "mu X. (<c>true || <!c>X)": {0, 1, 2},
+            "<(!c)*.c>true": {0, 1, 2},
+        }
+        for text, expected in cases.items():
+            formula = query.Parser(text).parse()
+            variables = set(ft.create_fixpoint_to_type_relation(ft.create_tree(formula)))
+            for checker in (NaiveChecker(g), EmersonChecker(g, "set", "scalar"), WorklistChecker(g),
+                            CompiledChecker(g), ParityChecker(g), SccChecker(g), patterns.PatternChecker(g)):
+                res = checker.solve_formula(variables, formula)
+                self.assertSetEqual(res.satisfied_states, expected, f"{text} {type(checker).__name__}")
+
+    def test_auto_engine(self):
+        g = Graph.from_file("./testcases/combined/test.aut")
+        cases = {"<a>true": "Naive", "nu X. (<a>X && mu Y. <b>Y)": "Worklist",
+                 "nu X. mu Y. nu Z. ((<a>X || <a>Y) && <a>Z)": "Parity"}
+        checkers = {"Naive": NaiveChecker(g), "Worklist": WorklistChecker(g), "Parity": ParityChecker(g)}
+        auto = selector.AutoChecker(g, checkers.get)
+        for text, engine in cases.items():
+            parser = query.Parser(text)
+            formula = parser.parse()
+            variables = parser.get_variables()
+            self.assertEqual(selector.choose(selector.analyse(formula, g))[0], engine)
+            res = auto.solve_formula(variables, formula)
+            expected = NaiveChecker(g).solve_formula(variables, formula)
+            self.assertSetEqual(res.satisfied_states, expected.satisfied_states)
+            self.assertEqual(res.engine, engine)
+            record = rs.make_record("test.aut", "q.mcf", "Auto", text, 0, 0, res)
+            self.assertEqual(record["algorithm"], engine)
+            self.assertEqual(record["engine_reason"], res.engine_reason)
+        analysis = selector.analyse(query.Parser("nu X. (<a>X && mu Y. <b>Y)").parse(), g)
+        self.assertEqual((analysis.alternation_depth, analysis.dependent_alternation_depth), (2, 1))
+        self.assertEqual(analysis.closed_fixpoints, 1)
+        # nu A. mu B. ... (A && (B && ...)), every fixpoint depends on all outer ones
+        letters = [chr(ord("A") + i) for i in range(26)]
+        body = letters[-1]
+        for v in reversed(letters[:-1]):
+            body = f"({v} && {body})"
+        text = "".join(f"{'nu' if i % 2 == 0 else 'mu'} {v}. " for i, v in enumerate(letters)) + body
+        analysis = selector.analyse(query.Parser(text).parse(), g)
+        self.assertEqual(analysis.dependent_alternation_depth, 26)
+        # Deeper than the recursion limit, only the compiled checker gets through
+        formula = query.Parser("nu X. " + "<tau>" * 3000 + "X").parse()
+        self.assertEqual(selector.choose(selector.analyse(formula, g))[0], "Compiled")
+        auto = selector.AutoChecker(g, lambda name: CompiledChecker(g))
+        res = auto.solve_formula({"X"}, formula)
+        expected = NaiveChecker(g).solve_formula({"X"}, query.Parser("nu X. <tau>X").parse())
+        self.assertSetEqual(res.satisfied_states, expected.satisfied_states)
+        self.assertEqual(res.engine, "Compiled")
+        # The analysis keys fixpoints by variable, a reused name goes to the compiled checker
+        formula = query.Parser("(mu X. <tau>X && nu Y. (<a>Y && nu X. [tau]X))").parse()
+        analysis = selector.analyse(formula, g)
+        self.assertListEqual(analysis.rebound, ["X"])
+        self.assertEqual(selector.choose(analysis)[0], "Compiled")
+        res = auto.solve_formula({"X", "Y"}, formula)
+        self.assertSetEqual(res.satisfied_states, NaiveChecker(g).solve_formula({"X", "Y"}, formula).satisfied_states)
+        # --engine replaces the single letter flags instead of silently winning over them
+        with mock.patch.object(sys, "argv", ["main.py", "./testcases/combined", "--engine", "worklist"]):
+            self.assertEqual(main.get_checker_name(main.parse_args()), "Worklist")
+        with mock.patch.object(sys, "argv", ["main.py", "./testcases/combined", "--engine", "worklist", "-p"]):
+            with redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+                main.parse_args()
+
+    def test_budgets(self):
+        g = Graph.from_file("./testcases/combined/test.aut")
+        formula, variables, _ = query.parse_query("./testcases/combined/form3.mcf")
+        expected = NaiveChecker(g).solve_formula(variables, formula)
+        for checker_class in (NaiveChecker, EmersonChecker):
+            reports = []
+            checker = checker_class(g)
+            budget.Supervisor(checker, budget.Budget(), reports.append, interval_ns=0)
+            res = checker.solve_formula(variables, formula)
+            self.assertSetEqual(res.satisfied_states, expected.satisfied_states)
+            self.assertIsNone(res.budget_exceeded)
+            self.assertGreater(len(reports), 0)
+            self.assertTrue(all(r.variable in variables for r in reports))
+            for limits, reason in ((budget.Budget(timeout_ns=0), "time"),
+                                   (budget.Budget(max_memory=1), "memory")):
+                checker = checker_class(g)
+                budget.Supervisor(checker, limits)
+                res = checker.solve_formula(variables, formula)
+                self.assertEqual(res.budget_exceeded, reason)
+                self.assertSetEqual(res.satisfied_states, set())
+                self.assertSetEqual(set(res.approximation_sizes), set(variables))
+                self.assertSetEqual(set(res.num_iter), set(variables))
+        # Budgets work in worker processes, the profiler does not
+        arguments = ["main.py", "./testcases/combined", "-e"]
+        with mock.patch.object(sys, "argv", arguments + ["--timeout", "5", "-j", "2"]):
+            self.assertEqual(main.parse_args().jobs, 2)
+        with mock.patch.object(sys, "argv", arguments + ["--profile", "-j", "2"]), \
+                redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+            main.parse_args()
+
+    def test_local_checking(self):
+        edges = {"a": ([0, 1, 2, 3], [1, 0, 3, 2]), "b": ([1, 4], [1, 0])}
+        g = Graph.from_edges(5, edges, initial_state=1)
+        sub, states = local.reachable_part(g)
+        self.assertListEqual(list(states), [0, 1])
+        self.assertEqual(sub.initial_state, 1)
+        for text in ("mu X. (<b>true || <a>X)", "nu X. (<a>X && [b]false)", "<a><b>true"):
+            parser = query.Parser(text)
+            formula = parser.parse()
+            variables = parser.get_variables()
+            expected = NaiveChecker(g).solve_formula(variables, formula)
+            for checker, early_stop in ((NaiveChecker(sub), False), (EmersonChecker(sub), True),
+                                        (CompiledChecker(sub), False), (WorklistChecker(sub), False)):
+                res = local.LocalChecker(checker, states, early_stop).solve_formula(variables, formula)
+                self.assertEqual(res.initial_state_holds, expected.initial_state_holds)
+                if not res.decided_early:
+                    self.assertSetEqual(res.satisfied_states,
+                                        expected.satisfied_states & set(states))
+        # A mu that holds in the initial state after one iteration
+        formula = query.Parser("mu X. (<a>X || <b>true)").parse()
+        res = local.LocalChecker(EmersonChecker(sub), states, True).solve_formula({"X"}, formula)
+        self.assertTrue(res.decided_early)
+        self.assertTrue(res.initial_state_holds)
+
+    def test_bisimulation(self):
+        # 0 -a-> 1 -b-> 3 and 0 -a-> 2 -b-> 4 -c-> 4, states 1 and 2 only
+        # differ in the c loop behind them
+        edges = {"a": ([0, 0], [1, 2]), "b": ([1, 2], [3, 4]), "c": ([4], [4])}
+        g = Graph.from_edges(5, edges)
+        blocks, num_blocks = bisim.bisimulation(g)
+        self.assertEqual(num_blocks, 5)
+        blocks, num_blocks = bisim.bisimulation(g, ["a", "b"])
+        self.assertEqual(num_blocks, 3)
+        self.assertEqual(blocks[1], blocks[2])
+        self.assertEqual(blocks[3], blocks[4])
+        def quotient_checker(g):
+            quotient, blocks = bisim.minimise(g, g.labels)
+            self.assertLessEqual(quotient.num_nodes, g.num_nodes)
+            return bisim.QuotientChecker(EmersonChecker(quotient), blocks)
+        self.check_testcases(quotient_checker)
+
+    def test_deep_formula(self):
+        g = Graph.from_file("./testcases/combined/test.aut")
+        depth = 5000
+        formula = query.Parser("<tau>" * depth + "true").parse()
+        # Paths longer than the number of states all end up on a cycle
+        short = query.Parser("<tau>" * g.num_nodes + "true").parse()
+        self.assertSetEqual(CompiledChecker(g).solve_formula(set(), formula).satisfied_states,
+                            NaiveChecker(g).solve_formula(set(), short).satisfied_states)
+        formula = query.Parser("nu X. " + "(X && " * depth + "<tau>X" + ")" * depth).parse()
+        res = CompiledChecker(g).solve_formula({"X"}, formula)
+        expected = NaiveChecker(g).solve_formula({"X"}, query.Parser("nu X. <tau>X").parse())
+        self.assertSetEqual(res.satisfied_states, expected.satisfied_states)
+
+    def test_memoization(self):
+        self.check_testcases(lambda g: EmersonChecker(g, memoize=True), ["combined"])
+        g = Graph.from_file("./testcases/combined/test.aut")
+        # The closed inner fixpoint is only solved once
+        formula = query.Parser("nu X. (<tau>X && mu Y. (<tau>Y || [a]false))").parse()
+        res = EmersonChecker(g, memoize=True).solve_formula({"X", "Y"}, formula)
+        self.assertGreater(res.cache_hits, 0)
+        self.assertLessEqual(res.num_iter["Y"],
+                             EmersonChecker(g).solve_formula({"X", "Y"}, formula).num_iter["Y"])
+
+    def test_formula_dag(self):
+        dag = formula_dag.FormulaDAG()
+        first = dag.add(query.Parser("nu X. ([a]X && mu Y. (<b>Y || <c>true))").parse())
+        second = dag.add(query.Parser("(<c>true && mu Y. (<b>Y || <c>true))").parse())
+        self.assertIs(first.formula.right, second.right)
+        self.assertIs(first.formula.right.formula.right, second.left)
+        self.assertTrue(dag.is_closed(second.right))
+        self.assertFalse(dag.is_closed(first.formula))
+
+    def test_alpha_key(self):
+        first = query.Parser("nu X. ([a]X && mu Y. (<b>Y || Z))").parse()
+        second = query.Parser("nu Y. ([a]Y && mu X. (<b>X || W))").parse()
+        third = query.Parser("nu X. ([a]X && mu Y. (<b>X || Z))").parse()
+        self.assertEqual(formula_dag.alpha_key(first), (formula_dag.alpha_key(second)[0], ("Z",)))
+        self.assertNotEqual(formula_dag.alpha_key(first)[0], formula_dag.alpha_key(third)[0])
+
+    def test_warm_start(self):
+        g = Graph.from_file("./testcases/combined/test.aut")
+        queries = [query.parse_query(f"./testcases/combined/form{i}.mcf") for i in range(1, 6)]
+        for backend in BACKENDS:
+            checker = EmersonChecker(g, backend, warm_start=True)
+            for _ in range(2):
+                for formula, variables, _ in queries:
+                    expected = EmersonChecker(g).solve_formula(variables, formula)
+                    res = checker.solve_formula(variables, formula)
+                    self.assertSetEqual(res.satisfied_states, expected.satisfied_states)
+        # The same query with other variable names starts from the first result
+        checker = EmersonChecker(g, warm_start=True)
+        first = checker.solve_formula({"X", "Y"}, query.Parser("nu X. (<tau>X && mu Y. <tau>Y)").parse())
+        second = checker.solve_formula({"A", "B"}, query.Parser("nu A. (<tau>A && mu B. <tau>B)").parse())
+        self.assertSetEqual(first.satisfied_states, second.satisfied_states)
+        self.assertLess(second.num_iter["A"], max(first.num_iter["X"], 1))
+
+    def test_batch_results(self):
+        g = Graph.from_file("./testcases/combined/test.aut")
+        queries = [query.parse_query(f"./testcases/combined/form{i}.mcf") for i in range(1, 6)]
+        dag = formula_dag.FormulaDAG()
+        for backend_checker in (NaiveChecker, EmersonChecker):
+            checker = backend_checker(g)
+            formula_dag.share_closed_results(checker, dag)
+            for formula, variables, _ in queries:
+                expected = backend_checker(g).solve_formula(variables, formula)
+                res = checker.solve_formula(variables, dag.add(formula))
+                self.assertSetEqual(res.satisfied_states, expected.satisfied_states)
+
+    def test_parallel_worker(self):
+        with mock.patch.object(sys, "argv", ["main.py", "./testcases/combined", "-e", "-j", "2", "--no-cache"]):
+            args = main.parse_args()
+        queries = [query.parse_query(f"./testcases/combined/form{i}.mcf") for i in range(1, 3)]
+        g = Graph.from_file("./testcases/combined/test.aut")
+        expected = [EmersonChecker(g).solve_formula(variables, formula).satisfied_states
+                    for formula, variables, _ in queries]
+        with mock.patch.dict(main._worker):
+            main.init_worker(args, queries)
+            for i in range(len(queries)):
+                res, load_time = main.run_query("test.aut", i)
+                self.assertSetEqual(res.satisfied_states, expected[i])
+                self.assertGreater(load_time, 0)
+        # The same on a pool of two processes, in the serial order
+        results = [(graph_file, [res.satisfied_states for res, _ in outputs])
+                   for graph_file, outputs in main.solve_parallel(args, queries, ["test.aut", "test.aut"])]
+        self.assertListEqual(results, [("test.aut", expected)] * 2)
+
+    def test_profiler(self):
+        g = Graph.from_file("./testcases/combined/test.aut")
+        formula, variables, _ = query.parse_query("./testcases/combined/form1.mcf")
+        for checker_class in (NaiveChecker, EmersonChecker):
+            expected = checker_class(g).solve_formula(variables, formula)
+            checker = checker_class(g)
+            profiler.Profiler(checker)
+            res = checker.solve_formula(variables, formula)
+            self.assertSetEqual(res.satisfied_states, expected.satisfied_states)
+            root = res.profile.stats[id(formula)]
+            self.assertEqual(root.evaluations, 1)
+            self.assertEqual(root.output_states, len(res.satisfied_states))
+            # Self times add up to the time of the root
+            self.assertEqual(sum(res.profile.stacks.values()), root.total_ns)
+            self.assertEqual(len(res.profile.format_tree().splitlines()),
+                             len(list(profiler.walk(formula))) + 1)
+            for line in res.profile.collapsed_stacks(["test.aut"]):
+                self.assertTrue(line.startswith("test.aut;"))
+
+    def test_benchmark(self):
+        results = benchmark.run_suite("./testcases", ["combined"], benchmark.DEFAULT_CHECKERS,
+                                      warmup=0, repeats=3, use_cache=False, log=lambda _: None)
+        self.assertIn("combined/test.aut/load", results)
+        for name in benchmark.DEFAULT_CHECKERS:
+            self.assertIn(f"combined/test.aut/form1.mcf/{name}", results)
+        self.assertEqual(benchmark.percentile([5, 1, 4, 2, 3], 95), 5)
+        slower = {k: {**v, "median_ns": v["median_ns"] * 2 + 1} for k, v in results.items()}
+        self.assertEqual(len(benchmark.compare(results, slower, 0.5, noise_floor_ns=0)),
+                         len(results))
+        self.assertEqual(len(benchmark.compare(slower, results, 0.5, noise_floor_ns=0)), 0)
+
+    def test_result_records(self):
+        g = Graph.from_file("./testcases/combined/test.aut")
+        formula, variables, formula_string = query.parse_query("./testcases/combined/form3.mcf")
+        res = EmersonChecker(g).solve_formula(variables, formula)
+        record = rs.make_record("test.aut", "form3.mcf", "Emerson", formula_string, 1, 2, res)
+        self.assertEqual(record["solve_time_ns"], res.running_time_ns)
+        with tempfile.TemporaryDirectory() as tmp:
+            for output_format in ("json", "csv"):
+                path = os.path.join(tmp, f"results.{output_format}")
+                with open(path, "w", newline="") as out:
+                    rs.write_records([record], output_format, out)
+                self.assertListEqual(rs.read_records(path), [record])
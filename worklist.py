@@ -0,0 +1,295 @@
+from __future__ import annotations
+from array import array
+
+from graph import Graph, INDEX_TYPE
+import query
+import checker_utils as cu
+import state_set as ss
+import regular
+
+
+## Local fixpoint engine.
+## Every subformula keeps its value as a 0/1 bytearray over the states, and the
+## modal operators additionally keep a counter per state: the number of
+## successors inside the subformula (diamond) or outside of it (box).
+## After the first evaluation of a fixpoint body we never evaluate it again,
+## instead the states that were added to (mu) or removed from (nu) the variable
+## are pushed upwards through the formula along the reverse edges.
+## Every state can enter a mu variable (or leave a nu variable) only once, so a
+## fixpoint costs O(E) instead of O(iterations * E).
+##
+## Changes always move in the direction of the fixpoint that is iterating.
+## A nested fixpoint of the same kind can continue from its current value, one
+## of the other kind is evaluated again from scratch.
+
+
+class Node:
+    __slots__ = ('parent', 'depth', 'value')
+
+    def __init__(self, depth: int):
+        self.parent = None
+        self.depth = depth
+        self.value = None
+
+
+class Literal(Node):
+    __slots__ = ()
+
+
+class Variable(Node):
+    __slots__ = ('binder',)
+
+    def __init__(self, depth: int, binder: Fixpoint | None):
+        super().__init__(depth)
+        self.binder = binder
+
+
+class Logic(Node):
+    __slots__ = ('left', 'right', 'is_and')
+
+    def __init__(self, depth: int, left: Node, right: Node, is_and: bool):
+        super().__init__(depth)
+        self.left = left
+        self.right = right
+        self.is_and = is_and
+
+
+class Modal(Node):
+    __slots__ = ('child', 'is_box', 'succ_offsets', 'succ_targets',
+                 'pred_offsets', 'pred_targets', 'counts')
+
+    def __init__(self, depth: int, child: Node, is_box: bool, relation: tuple):
+        super().__init__(depth)
+        self.child = child
+        self.is_box = is_box
+        (self.succ_offsets, self.succ_targets,
+         self.pred_offsets, self.pred_targets) = relation
+        self.counts = None
+
+
+class Fixpoint(Node):
+    __slots__ = ('name', 'is_mu', 'body', 'occurrences')
+
+    def __init__(self, depth: int, name: str, is_mu: bool):
+        super().__init__(depth)
+        self.name = name
+        self.is_mu = is_mu
+        self.body = None
+        self.occurrences = []
+
+
+class WorklistChecker:
+    def __init__(self, graph: Graph):
+        self.graph = graph
+        self.bits = ss.BitmaskBackend(graph.num_nodes)
+        # Used for labels that do not occur in the graph
+        no_offsets = array(INDEX_TYPE, [0]) * (graph.num_nodes + 1)
+        self.no_edges = (no_offsets, array(INDEX_TYPE), no_offsets, array(INDEX_TYPE))
+
+    def solve_formula(self, variables: set[str],
+                      formula: query.Formula) -> cu.CheckerOutput:
+        # Regular modalities become fixpoints over single steps
+        formula, added = regular.desugar(formula)
+        self.iter_count = dict()
+        for v in variables | added:
+            self.iter_count[v] = 0
+        self.max_depth = 0
+        root = self.compile(formula, 0, {})
+        start = cu.get_time()
+        self.evaluate(root)
+        res = {i for i, b in enumerate(root.value) if b}
+        duration = cu.get_time() - start
+        return cu.CheckerOutput(res, self.iter_count, duration,
+                                initial_state_holds=self.graph.initial_state in res)
+
+    def get_relation(self, label: query.Action) -> tuple:
+        l = self.graph.get_label_id(label)
+        if l is None:
+            return self.no_edges
+        return (*self.graph.successors(l), *self.graph.predecessors(l))
+
+    def compile(self, formula: query.Formula, depth: int,
+                scope: dict[str, Fixpoint]) -> Node:
+        self.max_depth = max(self.max_depth, depth)
+        n = self.graph.num_nodes
+        match formula:
+            case query.TrueLiteral():
+                node = Literal(depth)
+                node.value = bytearray(b'\x01') * n
+            case query.FalseLiteral():
+                node = Literal(depth)
+                node.value = bytearray(n)
+            case query.RecursionVariable(name):
+                binder = scope.get(name)
+                node = Variable(depth, binder)
+                if binder is None:
+                    # Free variables are empty, as in the other checkers
+                    node.value = bytearray(n)
+                else:
+                    binder.occurrences.append(node)
+            case query.LogicFormula(left, right, is_and):
+                node = Logic(depth, self.compile(left, depth + 1, scope),
+                             self.compile(right, depth + 1, scope), is_and)
+                node.left.parent = node
+                node.right.parent = node
+            case query.BoxFormula(l, f) | query.DiamondFormula(l, f):
+                is_box = isinstance(formula, query.BoxFormula)
+                node = Modal(depth, self.compile(f, depth + 1, scope), is_box,
+                             self.get_relation(l))
+                node.child.parent = node
+            case query.MuFormula(var, f) | query.NuFormula(var, f):
+                node = Fixpoint(depth, var.name, isinstance(formula, query.MuFormula))
+                node.value = bytearray(n)
+                inner_scope = {**scope, var.name: node}
+                node.body = self.compile(f, depth + 1, inner_scope)
+                node.body.parent = node
+                self.iter_count.setdefault(var.name, 0)
+            case _:
+                raise AssertionError
+        return node
+
+    def evaluate(self, node: Node):
+        "Computes the value of node and everything below it from scratch"
+        match node:
+            case Literal():
+                pass
+            case Variable(binder=binder):
+                if binder is not None:
+                    node.value = binder.value
+            case Logic():
+                self.evaluate(node.left)
+                self.evaluate(node.right)
+                left = self.bits.from_membership(node.left.value)
+                right = self.bits.from_membership(node.right.value)
+                res = left & right if node.is_and else left | right
+                node.value = bytearray(self.bits.membership(res))
+            case Modal():
+                self.evaluate(node.child)
+                self.evaluate_modal(node)
+            case Fixpoint():
+                self.solve_fixpoint(node)
+            case _:
+                raise AssertionError
+
+    def evaluate_modal(self, node: Modal):
+        child = node.child.value
+        offsets, targets = node.succ_offsets, node.succ_targets
+        counts = array(INDEX_TYPE, [0]) * self.graph.num_nodes
+        value = bytearray(self.graph.num_nodes)
+        for s in range(self.graph.num_nodes):
+            c = 0
+            for j in range(offsets[s], offsets[s + 1]):
+                if child[targets[j]]:
+                    c += 1
+            if node.is_box:
+                # Successors that are not in the child
+                c = offsets[s + 1] - offsets[s] - c
+                value[s] = c == 0
+            else:
+                value[s] = c > 0
+            counts[s] = c
+        node.counts = counts
+        node.value = value
+
+    def solve_fixpoint(self, binder: Fixpoint):
+        n = self.graph.num_nodes
+        binder.value[:] = bytearray(b'\x01') * n if not binder.is_mu else bytearray(n)
+        self.evaluate(binder.body)
+        body = binder.body.value
+        if binder.is_mu:
+            delta = [s for s in range(n) if body[s]]
+        else:
+            delta = [s for s in range(n) if not body[s]]
+        self.iterate(binder, delta)
+
+    def iterate(self, binder: Fixpoint, delta: list[int]) -> list[int]:
+        """
+        Moves delta into the variable of binder and keeps propagating until
+        the body no longer changes. Returns all states that changed.
+        """
+        changed = []
+        flag = 1 if binder.is_mu else 0
+        while len(delta) > 0:
+            self.iter_count[binder.name] += 1
+            value = binder.value
+            for s in delta:
+                value[s] = flag
+            changed.extend(delta)
+            delta = self.propagate(binder, delta)
+        return changed
+
+    def propagate(self, binder: Fixpoint, delta: list[int]) -> list[int]:
+        """
+        Pushes a change of the variable of binder up to its body, handling the
+        deepest nodes first so that every node sees all changes of its children
+        before it passes its own change on. Returns the change of the body.
+        """
+        adding = binder.is_mu
+        pending = dict()
+        buckets = [[] for _ in range(self.max_depth + 1)]
+        result = []
+
+        def notify(child: Node, change: list[int]):
+            parent = child.parent
+            if parent is binder:
+                result.extend(change)
+                return
+            if parent not in pending:
+                pending[parent] = []
+                buckets[parent.depth].append(parent)
+            pending[parent].append((child, change))
+
+        for occurrence in binder.occurrences:
+            notify(occurrence, delta)
+        for depth in range(self.max_depth, binder.depth, -1):
+            for node in buckets[depth]:
+                for child, change in pending.pop(node):
+                    out = self.update(node, child, change, adding)
+                    if len(out) > 0:
+                        notify(node, out)
+        return result
+
+    def update(self, node: Node, child: Node, change: list[int], adding: bool) -> list[int]:
+        "Applies a change of child to node and returns the change of node"
+        value = node.value
+        match node:
+            case Logic(is_and=is_and):
+                other = (node.right if child is node.left else node.left).value
+                if adding and is_and:
+                    out = [s for s in change if other[s] and not value[s]]
+                elif adding:
+                    out = [s for s in change if not value[s]]
+                elif is_and:
+                    out = [s for s in change if value[s]]
+                else:
+                    out = [s for s in change if value[s] and not other[s]]
+                flag = 1 if adding else 0
+                for s in out:
+                    value[s] = flag
+                return out
+            case Modal(is_box=is_box):
+                # A box counts successors outside of the child, which go down
+                # when the child grows
+                step = -1 if is_box == adding else 1
+                trigger = 0 if step == -1 else 1
+                flag = 1 if adding else 0
+                offsets, sources = node.pred_offsets, node.pred_targets
+                counts = node.counts
+                out = []
+                for t in change:
+                    for j in range(offsets[t], offsets[t + 1]):
+                        s = sources[j]
+                        counts[s] += step
+                        if counts[s] == trigger:
+                            value[s] = flag
+                            out.append(s)
+                return out
+            case Fixpoint(is_mu=is_mu):
+                if is_mu == adding:
+                    return self.iterate(node, change)
+                old = bytes(node.value)
+                self.solve_fixpoint(node)
+                new = node.value
+                return [s for s in range(self.graph.num_nodes) if old[s] != new[s]]
+            case _:
+                raise AssertionError